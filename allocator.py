@@ -0,0 +1,175 @@
+# Allocation of pending blood requests when stock is replenished.
+# Pending requests are served by urgency (Critical, Urgent, Normal) and then
+# by request time. The queue is the partial index idx_requests_pending_queue,
+# which only holds Pending rows in exactly that order, so a replenishment
+# reads just the head of the queues that can take the new units instead of
+# the whole table.
+import heapq
+from typing import NamedTuple
+
+import compatibility
+import engine
+import metrics
+
+# Pending requests read from the queue per round trip
+QUEUE_BATCH = 500
+
+
+class Allocation(NamedTuple):
+    blood_type: str
+    fulfilled: list       # request ids, in the order they were served
+    units: int            # units issued to them
+    remaining: int        # stock left afterwards
+
+
+# Pending requests of one recipient type in serving order, read from the queue
+# index in keyset batches. Only requests needing at most remaining() units and
+# with one of the allowed priorities are returned.
+def pending_queue(conn, recipient, priorities, remaining):
+    marks = ", ".join("?" * len(priorities))
+    position = None
+    while remaining() > 0:
+        params = [recipient, *priorities, remaining()]
+        after = ""
+        if position is not None:
+            after = "AND (priority, datetime, request_id) > (?, ?, ?)"
+            params.extend(position)
+        batch = conn.execute(f'''SELECT priority, datetime, request_id, quantity_needed
+                                 FROM blood_requests INDEXED BY idx_requests_pending_queue
+                                 WHERE status = 'Pending' AND blood_type_required = ?
+                                 AND priority IN ({marks}) AND quantity_needed <= ? {after}
+                                 ORDER BY priority, datetime, request_id
+                                 LIMIT {QUEUE_BATCH}''', params).fetchall()
+        yield from batch
+        if len(batch) < QUEUE_BATCH:
+            return
+        position = batch[-1][:3]
+
+
+# Give the stock of donor_type to pending requests in priority order, skipping
+# any that need more than what is left. Every recipient type that may take
+# donor_type under the policy has its own queue; heapq.merge interleaves them
+# by (priority, datetime, request_id). Must run inside a write transaction;
+# every request served is issued the unexpired units that expire first.
+@metrics.timed("allocate_pending")
+def allocate_pending(conn, donor_type, policy=None, today=None) -> Allocation:
+    policy = policy or compatibility.DEFAULT_POLICY
+    today = today or engine.utc_today()
+    available = engine.usable_stock(conn, today).get(donor_type) or 0
+    left = [available]
+    fulfilled = []
+
+    queues = [pending_queue(conn, recipient, [engine.URGENCY_PRIORITY[u] for u in urgencies], lambda: left[0])
+              for recipient, urgencies in compatibility.recipients_of(donor_type, policy)]
+    for _, _, request_id, quantity in heapq.merge(*queues):
+        if left[0] == 0:
+            break
+        if quantity <= left[0]:
+            fulfilled.append((request_id, quantity))
+            left[0] -= quantity
+
+    metrics.rows("allocate_pending", len(fulfilled))
+    if fulfilled:
+        conn.executemany('''UPDATE blood_requests SET status = 'Fulfilled', fulfilled_with = ?, fulfilled_at = CURRENT_TIMESTAMP
+                            WHERE request_id = ?''',
+                         [(donor_type, request_id) for request_id, _ in fulfilled])
+        for request_id, quantity in fulfilled:
+            if not engine.reserve_stock(conn, donor_type, quantity, request_id, today):
+                raise RuntimeError(f"Stock of {donor_type} changed while request {request_id} was allocated")
+    return Allocation(donor_type, [request_id for request_id, _ in fulfilled], available - left[0], left[0])
+
+
+# Add a lot of units to the stock of blood_type and, in the same transaction,
+# fulfil as many pending requests that can take it as the new stock allows.
+# The units were collected on collected_on (default today) and expire on
+# expires_on (default engine.SHELF_LIFE_DAYS later).
+@metrics.timed("receive_stock")
+def receive_stock(blood_type: str, quantity: int, conn=None, policy=None, collected_on: str = None,
+                  expires_on: str = None) -> Allocation:
+    if blood_type not in engine.BLOOD_TYPES:
+        raise engine.ValidationError("Input Error", "Please select a valid blood type.")
+    try:
+        quantity = int(quantity)
+    except (TypeError, ValueError):
+        quantity = 0
+    if quantity <= 0:
+        raise engine.ValidationError("Input Error", "Please enter a valid number of units received.")
+    if collected_on:
+        engine.check_collection_date(collected_on)
+    if expires_on:
+        engine.check_expiry_date(expires_on)
+
+    conn = conn or engine.get_connection()
+
+    def receive():
+        with engine.write_transaction(conn):
+            engine.receive_units(conn, blood_type, quantity, "receipt", collected_on, expires_on)
+            return allocate_pending(conn, blood_type, policy)
+
+    return engine.retry_on_busy(receive)
+
+
+# Set the stock of each blood type in `levels` ({blood_type: quantity}) with
+# adjustments: a new lot for the units added, or the soonest to expire taken
+# out. Pending requests that can take a blood type whose stock rose are then
+# fulfilled from it in the same transaction, as for a receipt. Returns the
+# Allocation of each of those blood types.
+@metrics.timed("set_stock_levels")
+def set_stock_levels(levels: dict, note: str = None, conn=None, policy=None) -> list:
+    checked = {}
+    for blood_type, quantity in levels.items():
+        if blood_type not in engine.BLOOD_TYPES:
+            raise engine.ValidationError("Input Error", f"{blood_type} is not a valid blood type.")
+        try:
+            checked[blood_type] = int(quantity)
+        except (TypeError, ValueError):
+            checked[blood_type] = -1
+        if checked[blood_type] < 0:
+            raise engine.ValidationError("Input Error", f"Please enter a stock level of 0 or more for {blood_type}.")
+
+    conn = conn or engine.get_connection()
+
+    def apply():
+        with engine.write_transaction(conn):
+            current = engine.get_stock(conn)
+            raised = []
+            for blood_type, quantity in checked.items():
+                delta = quantity - (current.get(blood_type) or 0)
+                if delta > 0:
+                    engine.receive_units(conn, blood_type, delta, "adjustment", note=note)
+                    raised.append(blood_type)
+                elif delta < 0:
+                    engine.take_units(conn, blood_type, -delta, "adjustment", note=note)
+            return [allocate_pending(conn, blood_type, policy) for blood_type in raised]
+
+    return engine.retry_on_busy(apply)
+
+
+# Correct the stock of blood_type by delta units (negative for units
+# discarded or found missing, soonest to expire first), never below zero.
+# Units added go to pending requests that can take them, as in
+# set_stock_levels. Returns the quantity left.
+@metrics.timed("adjust_stock")
+def adjust_stock(blood_type: str, delta: int, note: str = None, conn=None, policy=None) -> int:
+    if blood_type not in engine.BLOOD_TYPES:
+        raise engine.ValidationError("Input Error", "Please select a valid blood type.")
+    try:
+        delta = int(delta)
+    except (TypeError, ValueError):
+        delta = 0
+    if delta == 0:
+        raise engine.ValidationError("Input Error", "Please enter a non-zero number of units.")
+
+    conn = conn or engine.get_connection()
+
+    def adjust():
+        with engine.write_transaction(conn):
+            if delta > 0:
+                engine.receive_units(conn, blood_type, delta, "adjustment", note=note)
+                allocate_pending(conn, blood_type, policy)
+            elif not engine.take_units(conn, blood_type, -delta, "adjustment", note=note):
+                raise engine.ValidationError("Input Error",
+                                             f"There are fewer than {-delta} units of {blood_type} in stock.")
+            return engine.get_stock(conn)[blood_type]
+
+    return engine.retry_on_busy(adjust)
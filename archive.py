@@ -0,0 +1,162 @@
+# Hot/cold archival of closed blood requests.
+# Fulfilled requests older than ARCHIVE_AFTER_DAYS are moved from
+# blood_requests to the same table in a separate archive database, so the live
+# table only holds open and recent requests. Each batch is copied to the
+# archive in one transaction and deleted from the live table in the next:
+# SQLite does not commit attached WAL databases atomically together, so a
+# crash in between leaves the rows in both and the next run finishes the
+# move. The freed pages are then returned to the file system with
+# incremental_vacuum, a few at a time.
+#
+# attach() adds the archive to a connection along with the all_blood_requests
+# view, which reads live and archived requests as one table. The reporting
+# rollups are not affected: archived requests stay counted.
+#
+#   python bloodlink.py archive --older-than 180
+#   python bloodlink.py archive --vacuum
+import json
+import os
+import time
+from datetime import date, timedelta
+from typing import NamedTuple
+
+import engine
+import metrics
+import migrations
+
+ARCHIVE_AFTER_DAYS = 180
+ARCHIVE_BATCH = 500
+# Pages freed per incremental_vacuum transaction
+VACUUM_PAGES = 2000
+ALIAS = "archive"
+
+REQUEST_COLUMNS = ("request_id", "requestor_name", "contact_number", "email_address", "blood_type_required",
+                   "quantity_needed", "urgency", "priority", "patient_name", "datetime", "status", "fulfilled_with",
+                   "fulfilled_at")
+
+
+class ArchiveResult(NamedTuple):
+    moved: int
+    batches: int
+    pages_freed: int
+    seconds: float
+
+
+# Archive database of a live database: blood_donation_platform_archive.db
+def archive_path(db_path=None):
+    root, extension = os.path.splitext(db_path or engine.DB_PATH)
+    return f"{root}_archive{extension}"
+
+
+def is_attached(conn):
+    return any(row[1] == ALIAS for row in conn.execute("PRAGMA database_list"))
+
+
+# Attach the archive database (created if needed, by default next to the
+# database conn has open) to conn and define the all_blood_requests view;
+# does nothing if it is already attached
+def attach(conn, path=None):
+    if is_attached(conn):
+        return conn
+    main_path = next(row[2] for row in conn.execute("PRAGMA database_list") if row[1] == "main")
+    conn.execute(f"ATTACH DATABASE ? AS {ALIAS}", (path or archive_path(main_path or None),))
+    for name in ("journal_mode", "synchronous"):
+        conn.execute(f"PRAGMA {ALIAS}.{name} = {migrations.PRAGMAS[name]}")
+    conn.execute(f'''CREATE TABLE IF NOT EXISTS {ALIAS}.blood_requests (
+                        request_id INTEGER PRIMARY KEY,
+                        requestor_name TEXT,
+                        contact_number TEXT,
+                        email_address TEXT,
+                        blood_type_required TEXT,
+                        quantity_needed INTEGER,
+                        urgency TEXT,
+                        priority INTEGER,
+                        patient_name TEXT,
+                        datetime TEXT,
+                        status TEXT,
+                        fulfilled_with TEXT,
+                        fulfilled_at TEXT,
+                        archived_at TEXT DEFAULT CURRENT_TIMESTAMP
+                    )''')
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {ALIAS}.idx_archive_datetime ON blood_requests (datetime)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {ALIAS}.idx_archive_blood_type "
+                 f"ON blood_requests (blood_type_required, datetime)")
+    # A view in one database cannot name another, so the view is temporary (per connection).
+    # A request found in both (a move interrupted between its two commits) is read from the live table.
+    columns = ", ".join(REQUEST_COLUMNS)
+    conn.execute(f'''CREATE TEMP VIEW IF NOT EXISTS all_blood_requests AS
+                     SELECT {columns}, NULL AS archived_at FROM main.blood_requests
+                     UNION ALL
+                     SELECT {columns}, archived_at FROM {ALIAS}.blood_requests AS archived
+                     WHERE NOT EXISTS (SELECT 1 FROM main.blood_requests AS live
+                                       WHERE live.request_id = archived.request_id)''')
+    return conn
+
+
+# Move one batch of fulfilled requests submitted before `cutoff`, returns the number moved
+def archive_batch(conn, cutoff, batch_size=ARCHIVE_BATCH):
+    columns = ", ".join(REQUEST_COLUMNS)
+    with engine.write_transaction(conn):
+        ids = [row[0] for row in conn.execute('''SELECT request_id FROM main.blood_requests
+                                                 INDEXED BY idx_requests_status
+                                                 WHERE status = 'Fulfilled' AND datetime < ?
+                                                 ORDER BY datetime LIMIT ?''', (cutoff, batch_size))]
+        if not ids:
+            return 0
+        batch = json.dumps(ids)
+        conn.execute(f'''INSERT OR REPLACE INTO {ALIAS}.blood_requests ({columns})
+                         SELECT {columns} FROM main.blood_requests
+                         WHERE request_id IN (SELECT value FROM json_each(?))''', (batch,))
+    with engine.write_transaction(conn):
+        conn.execute("DELETE FROM main.blood_requests WHERE status = 'Fulfilled' "
+                     "AND request_id IN (SELECT value FROM json_each(?))", (batch,))
+    return len(ids)
+
+
+# Give free pages of the live database back to the file system,
+# VACUUM_PAGES per transaction. Returns the number of pages freed
+# (0 unless the database uses auto_vacuum=INCREMENTAL, see vacuum()).
+def reclaim_space(conn, pages=VACUUM_PAGES):
+    if conn.execute("PRAGMA main.auto_vacuum").fetchone()[0] != 2:
+        return 0
+    freed = 0
+    while True:
+        free = conn.execute("PRAGMA main.freelist_count").fetchone()[0]
+        if not free:
+            return freed
+        engine.retry_on_busy(lambda: conn.execute(f"PRAGMA main.incremental_vacuum({min(free, pages)})").fetchall())
+        left = conn.execute("PRAGMA main.freelist_count").fetchone()[0]
+        if left >= free:
+            return freed
+        freed += free - left
+
+
+# Move every fulfilled request older than `older_than` days to the archive and
+# reclaim the space. Each batch takes the write lock only briefly, so it can
+# run while the application is in use.
+@metrics.timed("archive_requests")
+def archive_requests(older_than=ARCHIVE_AFTER_DAYS, conn=None, path=None, today=None,
+                     batch_size=ARCHIVE_BATCH) -> ArchiveResult:
+    conn = attach(conn or engine.get_connection(), path)
+    cutoff = ((today or date.today()) - timedelta(days=older_than)).isoformat()
+    moved = batches = 0
+    started = time.perf_counter()
+    while True:
+        count = engine.retry_on_busy(lambda: archive_batch(conn, cutoff, batch_size))
+        metrics.rows("archive_requests", count)
+        moved += count
+        batches += bool(count)
+        if count < batch_size:
+            break
+    pages_freed = reclaim_space(conn)
+    return ArchiveResult(moved, batches, pages_freed, time.perf_counter() - started)
+
+
+# Switch a database created before auto_vacuum=INCREMENTAL over to it. This is
+# a full VACUUM: it rewrites the whole file and blocks writers while it runs,
+# so it is done once, when the application is not in use.
+def vacuum(conn=None):
+    conn = conn or engine.get_connection()
+    conn.execute("PRAGMA main.auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM main")
+    return conn.execute("PRAGMA main.auto_vacuum").fetchone()[0] == 2
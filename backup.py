@@ -0,0 +1,302 @@
+# Online backups and point-in-time restore.
+# backup() copies the live database with SQLite's online backup API,
+# BACKUP_PAGES pages per step and a BACKUP_PAUSE rest between steps. A step
+# only holds a read lock on the database, which under WAL never stops a
+# request being saved, and the copy is always consistent: when another
+# connection commits during the copy SQLite starts it again. After
+# MAX_RESTARTS such restarts (a busy database) the rest is copied in a single
+# step, one read transaction that writers still do not wait for. The copy is
+# written next to the target, checked (quick_check) and renamed when complete.
+#
+# Snapshots are named after the database and the time they were taken
+# (blood_donation_platform-20240601-120000.db) in a backups directory next to
+# it; the newest KEEP_SNAPSHOTS are kept. restore() checks a snapshot, saves
+# the current database as a "before-restore" copy, copies the snapshot over
+# the live database and checks the result. Connections that are open see the
+# restored data with their next read.
+#
+#   python bloodlink.py backup
+#   python bloodlink.py backup --every 60 --keep 48
+#   python bloodlink.py restore --at "2024-06-01 12:00"
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import NamedTuple
+from urllib.request import pathname2url
+
+import engine
+import metrics
+import migrations
+from engine import ValidationError
+
+BACKUP_PAGES = 1024
+BACKUP_PAUSE = 0.01          # seconds between steps
+MAX_RESTARTS = 3
+KEEP_SNAPSHOTS = 24
+# Minutes between snapshots of the background scheduler
+BACKUP_INTERVAL = 60.0
+TIME_FORMAT = "%Y%m%d-%H%M%S"
+REQUIRED_TABLES = ("donors", "blood_requests", "blood_stock")
+
+
+class BackupResult(NamedTuple):
+    path: str
+    pages: int
+    bytes: int
+    steps: int
+    restarts: int           # copies started again because another connection wrote
+    seconds: float          # copying, without the check
+    max_lock_seconds: float  # longest step
+    check_seconds: float
+
+    @property
+    def bytes_per_sec(self):
+        return self.bytes / self.seconds if self.seconds else 0.0
+
+
+class Snapshot(NamedTuple):
+    path: str
+    taken_at: datetime
+    size: int
+
+
+class RestoreResult(NamedTuple):
+    snapshot: str
+    saved_as: str           # copy of the database as it was before, None if not kept
+    pages: int
+    seconds: float
+
+
+class _Restarted(Exception):
+    pass
+
+
+def main_path(conn):
+    return next(row[2] for row in conn.execute("PRAGMA database_list") if row[1] == "main")
+
+
+# Snapshot directory of a database: backups/ next to it
+def backup_dir(db_path=None):
+    return os.path.join(os.path.dirname(os.path.abspath(db_path or engine.DB_PATH)), "backups")
+
+
+def snapshot_name(db_path, taken_at):
+    stem = os.path.splitext(os.path.basename(db_path))[0]
+    return f"{stem}-{taken_at.strftime(TIME_FORMAT)}.db"
+
+
+# Copy the database conn has open to `target`, `pages` pages per step
+@metrics.timed("backup")
+def backup(target, conn=None, pages=BACKUP_PAGES, pause=BACKUP_PAUSE) -> BackupResult:
+    conn = conn or engine.get_connection()
+    temporary = f"{target}.tmp"
+    steps = restarts = 0
+    longest = 0.0
+    last_remaining = None
+    started = step_started = time.perf_counter()
+
+    def progress(status, remaining, total):
+        nonlocal steps, restarts, longest, last_remaining, step_started
+        held = time.perf_counter() - step_started
+        steps += 1
+        longest = max(longest, held)
+        metrics.observe(metrics.BACKUP_LOCK_SECONDS, (), held)
+        if last_remaining is not None and remaining >= last_remaining:
+            restarts += 1
+            if restarts >= MAX_RESTARTS:
+                raise _Restarted()
+        last_remaining = remaining
+        if remaining and pause:
+            time.sleep(pause)
+        step_started = time.perf_counter()
+
+    try:
+        copy = sqlite3.connect(temporary, isolation_level=None)
+        try:
+            try:
+                conn.backup(copy, pages=pages, progress=progress)
+            except _Restarted:
+                step_started = time.perf_counter()
+                conn.backup(copy, pages=-1, progress=progress)
+            # A copy of a WAL database is one too; a snapshot is a single file
+            copy.execute("PRAGMA journal_mode = DELETE")
+            page_count, page_size = (copy.execute(f"PRAGMA {name}").fetchone()[0]
+                                     for name in ("page_count", "page_size"))
+        finally:
+            copy.close()
+        copied = time.perf_counter()
+        problems = verify(temporary, quick=True)
+        if problems:
+            raise RuntimeError(f"Backup {target} failed its check: {'; '.join(problems)}")
+        os.replace(temporary, target)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+    metrics.rows("backup", page_count)
+    return BackupResult(target, page_count, page_count * page_size, steps, restarts, copied - started, longest,
+                        time.perf_counter() - copied)
+
+
+# Problems found in a database file, an empty list if it is sound. quick
+# skips the check of index contents, ten times faster on a large database.
+def verify(path, quick=False) -> list:
+    if not os.path.isfile(path):
+        return [f"{path} does not exist"]
+    try:
+        conn = sqlite3.connect(f"file:{pathname2url(os.path.abspath(path))}?mode=ro", uri=True)
+    except sqlite3.Error as error:
+        return [str(error)]
+    try:
+        check = "quick_check" if quick else "integrity_check"
+        problems = [row[0] for row in conn.execute(f"PRAGMA {check}") if row[0] != "ok"]
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        problems += [f"no {table} table" for table in REQUIRED_TABLES if table not in tables]
+        version = migrations.get_version(conn)
+        if version > migrations.LATEST_VERSION:
+            problems.append(f"schema version {version} is newer than this program ({migrations.LATEST_VERSION})")
+        return problems
+    except sqlite3.DatabaseError as error:
+        return [str(error)]
+    finally:
+        conn.close()
+
+
+# Snapshots of a database in `directory`, oldest first
+def list_snapshots(directory=None, db_path=None) -> list:
+    db_path = db_path or engine.DB_PATH
+    directory = directory or backup_dir(db_path)
+    stem = os.path.splitext(os.path.basename(db_path))[0]
+    pattern = re.compile(re.escape(stem) + r"-(\d{8}-\d{6})\.db")
+    snapshots = []
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            match = pattern.fullmatch(name)
+            if match:
+                path = os.path.join(directory, name)
+                snapshots.append(Snapshot(path, datetime.strptime(match.group(1), TIME_FORMAT),
+                                          os.path.getsize(path)))
+    return sorted(snapshots, key=lambda snapshot: snapshot.taken_at)
+
+
+# Delete all but the newest `keep` snapshots, returns the paths deleted
+def prune(directory=None, db_path=None, keep=KEEP_SNAPSHOTS) -> list:
+    snapshots = list_snapshots(directory, db_path)
+    expired = snapshots[:-keep] if keep > 0 else snapshots
+    for snapshot in expired:
+        os.remove(snapshot.path)
+    return [snapshot.path for snapshot in expired]
+
+
+# Take a snapshot of the database conn has open and apply the retention
+def snapshot(conn=None, directory=None, keep=KEEP_SNAPSHOTS, pages=BACKUP_PAGES,
+             pause=BACKUP_PAUSE) -> BackupResult:
+    conn = conn or engine.get_connection()
+    db_path = main_path(conn) or engine.DB_PATH
+    directory = directory or backup_dir(db_path)
+    os.makedirs(directory, exist_ok=True)
+    result = backup(os.path.join(directory, snapshot_name(db_path, datetime.now())), conn, pages, pause)
+    prune(directory, db_path, keep)
+    return result
+
+
+# The newest snapshot taken at or before `at` ("YYYY-MM-DD[ HH:MM[:SS]]",
+# default: the newest of all)
+def find_snapshot(at=None, directory=None, db_path=None) -> Snapshot:
+    snapshots = list_snapshots(directory, db_path)
+    if at:
+        try:
+            moment = datetime.fromisoformat(at)
+        except ValueError:
+            raise ValidationError("Input Error", "Invalid restore time. Please use YYYY-MM-DD HH:MM.")
+        if len(at) == 10:
+            moment = moment.replace(hour=23, minute=59, second=59)
+        snapshots = [snapshot for snapshot in snapshots if snapshot.taken_at <= moment]
+    if not snapshots:
+        raise ValidationError("Restore Error", "No snapshot found" + (f" taken before {at}." if at else "."))
+    return snapshots[-1]
+
+
+# Replace the database at db_path with a snapshot (a file, or the newest one
+# taken at or before `at`). The current database is first saved next to the
+# snapshots unless keep_current is False.
+@metrics.timed("restore")
+def restore(path=None, at=None, db_path=None, directory=None, keep_current=True) -> RestoreResult:
+    db_path = db_path or engine.DB_PATH
+    path = path or find_snapshot(at, directory, db_path).path
+    problems = verify(path)
+    if problems:
+        raise ValidationError("Restore Error", f"{path} cannot be restored: {'; '.join(problems)}")
+    started = time.perf_counter()
+
+    live = sqlite3.connect(db_path, timeout=engine.BUSY_TIMEOUT, isolation_level=None)
+    try:
+        saved_as = None
+        if keep_current and os.path.exists(db_path) and os.path.getsize(db_path):
+            # Named so that it is neither pruned nor picked as the snapshot to restore
+            directory = directory or backup_dir(db_path)
+            os.makedirs(directory, exist_ok=True)
+            stem = os.path.splitext(os.path.basename(db_path))[0]
+            name = f"{stem}-before-restore-{datetime.now().strftime(TIME_FORMAT)}.db"
+            saved_as = backup(os.path.join(directory, name), live).path
+        source = sqlite3.connect(f"file:{pathname2url(os.path.abspath(path))}?mode=ro", uri=True)
+        try:
+            source.backup(live)
+        finally:
+            source.close()
+        migrations.apply_pragmas(live)
+        migrations.migrate(live)
+        pages = live.execute("PRAGMA page_count").fetchone()[0]
+    finally:
+        live.close()
+
+    problems = verify(db_path)
+    if problems:
+        raise RuntimeError(f"Restored database {db_path} failed its check: {'; '.join(problems)}")
+    return RestoreResult(path, saved_as, pages, time.perf_counter() - started)
+
+
+# Background thread taking a snapshot when it starts and then every `interval` minutes
+class Scheduler(threading.Thread):
+    def __init__(self, path=None, interval=BACKUP_INTERVAL, directory=None, keep=KEEP_SNAPSHOTS):
+        super().__init__(name="bloodlink-backup", daemon=True)
+        self.path = path or engine.DB_PATH
+        self.interval = interval
+        self.directory = directory
+        self.keep = keep
+        self.stopped = threading.Event()
+        self.last_backup = None     # BackupResult
+        self.error = None
+
+    def run(self):
+        conn = engine.connect(self.path)
+        try:
+            while True:
+                try:
+                    self.last_backup = snapshot(conn, self.directory, self.keep)
+                except Exception as error:
+                    self.error = error
+                if self.stopped.wait(self.interval * 60):
+                    return
+        finally:
+            conn.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def stats(self):
+        result = self.last_backup
+        return {"interval_minutes": self.interval, "keep": self.keep,
+                "last": result._asdict() | {"bytes_per_sec": result.bytes_per_sec} if result else None,
+                "error": str(self.error) if self.error else None}
+
+
+def start_scheduler(path=None, interval=BACKUP_INTERVAL, directory=None, keep=KEEP_SNAPSHOTS):
+    scheduler = Scheduler(path, interval, directory, keep)
+    scheduler.start()
+    return scheduler
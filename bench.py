@@ -0,0 +1,290 @@
+# Reproducible benchmark suite.
+# A seeded generator fills a database with donors, requests and stock at the
+# volumes we expect (10k up to 10M rows), then each benchmark times one part
+# of BloodLink: donor inserts, request submission (one and several
+# processes), the listing pages of the display views, donor search and the
+# allocation of pending requests. Results are written as JSON so runs of different versions
+# can be compared; the same seed always produces the same data.
+#
+#   python bench.py --rows 100000 --output bench-100k.json
+#   python bench.py --rows 10000 --benchmarks listing,allocation
+#   python bench.py --rows 1000000 --benchmarks search
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+import allocator
+import engine
+import importer
+import migrations
+import stress
+
+# Share of each blood type among donors and requests
+BLOOD_TYPE_WEIGHTS = {"O+": 38, "A+": 34, "B+": 9, "O-": 7, "A-": 6, "AB+": 3, "B-": 2, "AB-": 1}
+URGENCY_WEIGHTS = {"Normal": 70, "Urgent": 22, "Critical": 8}
+PENDING_SHARE = 0.05
+STOCK_RANGE = (20, 400)
+# "Today" of the synthetic data, so donor eligibility does not depend on the day of the run
+DATA_DATE = date(2025, 1, 1)
+
+FILL_BATCH = 50000
+REPEAT = 5
+# Latency a donor search page has to stay under, up to 1M donors
+SEARCH_TARGET_MS = 10
+
+
+# Synthetic data. Every generator takes its own seed so the donors do not
+# change when only the number of requests does.
+
+def donor_rows(count, seed=0):
+    rng = random.Random(seed)
+    types, weights = list(BLOOD_TYPE_WEIGHTS), list(BLOOD_TYPE_WEIGHTS.values())
+    start = date(1960, 1, 1).toordinal()
+    today = DATA_DATE.toordinal()
+    for number in range(count):
+        # Two donors in three have given blood in the last year
+        last_donation = (date.fromordinal(today - rng.randrange(365)).isoformat()
+                         if rng.random() < 2 / 3 else "")
+        yield (f"Donor {number:08d}", "Female",
+               date.fromordinal(start + rng.randrange(365 * 45)).isoformat(),
+               rng.choices(types, weights)[0],
+               f"9{rng.randrange(10 ** 9):09d}", "donor@example.com", "", "Indian", last_donation, "",
+               "9876543210", engine.next_eligible_date(last_donation, today=DATA_DATE))
+
+
+def request_rows(count, seed=0):
+    rng = random.Random(seed + 1)
+    types, weights = list(BLOOD_TYPE_WEIGHTS), list(BLOOD_TYPE_WEIGHTS.values())
+    urgencies, urgency_weights = list(URGENCY_WEIGHTS), list(URGENCY_WEIGHTS.values())
+    start = datetime(2024, 1, 1)
+    for number in range(count):
+        blood_type = rng.choices(types, weights)[0]
+        urgency = rng.choices(urgencies, urgency_weights)[0]
+        pending = rng.random() < PENDING_SHARE
+        submitted = start + timedelta(seconds=rng.randrange(365 * 86400))
+        # One fulfilled request in five waited up to two days for stock
+        waited = timedelta(seconds=rng.randrange(2 * 86400)) if rng.random() < 0.2 else timedelta()
+        yield (f"Requestor {number % 500}", f"9{rng.randrange(10 ** 9):09d}", "ward@example.com",
+               blood_type, rng.randint(1, 5), urgency, engine.URGENCY_PRIORITY[urgency],
+               f"Patient {number:08d}", submitted.strftime("%Y-%m-%d %H:%M:%S"),
+               "Pending" if pending else "Fulfilled", None if pending else blood_type,
+               None if pending else (submitted + waited).strftime("%Y-%m-%d %H:%M:%S"))
+
+
+def stock_levels(seed=0):
+    rng = random.Random(seed + 2)
+    return {blood_type: rng.randint(*STOCK_RANGE) for blood_type in engine.BLOOD_TYPES}
+
+
+def populate(conn, donors, requests, seed=0):
+    for batch in importer.batched(donor_rows(donors, seed), FILL_BATCH):
+        engine.bulk_insert_donors(conn, batch)
+    # Before the requests, which would otherwise be allocated the stock
+    set_stock(conn, stock_levels(seed))
+    for batch in importer.batched(request_rows(requests, seed), FILL_BATCH):
+        with engine.write_transaction(conn):
+            conn.executemany('''INSERT INTO blood_requests (requestor_name, contact_number, email_address,
+                                blood_type_required, quantity_needed, urgency, priority, patient_name,
+                                datetime, status, fulfilled_with, fulfilled_at)
+                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', batch)
+    conn.execute("ANALYZE")
+
+
+def set_stock(conn, stock):
+    allocator.set_stock_levels(stock, note="benchmark", conn=conn)
+
+
+def timed(fn, repeat=REPEAT):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return {"median_ms": round(statistics.median(timings) * 1000, 3),
+            "min_ms": round(min(timings) * 1000, 3)}
+
+
+# Benchmarks. Each takes (path, rows, seed) and returns a dict of figures.
+
+# Bulk inserts through the import path and single registrations through the engine
+def bench_donor_insert(path, rows, seed):
+    conn = engine.connect(path)
+    started = time.perf_counter()
+    for batch in importer.batched(donor_rows(rows, seed + 10), importer.BATCH_SIZE):
+        importer.insert_batch(conn, batch)
+    bulk = time.perf_counter() - started
+
+    singles = min(rows, 2000)
+    started = time.perf_counter()
+    for name, _, dob, blood_type, contact, *_ in donor_rows(singles, seed + 11):
+        engine.register_donor(name, "Female", "1990-01-01", blood_type, contact, "donor@example.com",
+                              "Indian", "9876543210", consent=True, conn=conn)
+    single = time.perf_counter() - started
+    conn.close()
+    return {"bulk_rows": rows, "bulk_rows_per_sec": round(rows / bulk, 1),
+            "register_calls": singles, "register_per_sec": round(singles / single, 1)}
+
+
+# submit_request from one process on one connection, then the multi-process stress run
+def bench_request_submit(path, rows, seed, processes=(1, 2, 4)):
+    count = min(rows, 2000)
+    conn = engine.connect(path)
+    set_stock(conn, stock_levels(seed))
+    rng = random.Random(seed + 20)
+    types, weights = list(BLOOD_TYPE_WEIGHTS), list(BLOOD_TYPE_WEIGHTS.values())
+    urgencies, urgency_weights = list(URGENCY_WEIGHTS), list(URGENCY_WEIGHTS.values())
+    started = time.perf_counter()
+    for number in range(count):
+        engine.submit_request("Bench", "9876543210", "bench@example.com", rng.choices(types, weights)[0],
+                              rng.randint(1, 5), rng.choices(urgencies, urgency_weights)[0],
+                              f"Patient {number}", 40, "Bench", approval=True, conn=conn)
+    single = time.perf_counter() - started
+    conn.close()
+
+    # The stress run works on its own file, so it measures contention and not the table size
+    with tempfile.TemporaryDirectory() as tmp:
+        runs = [stress.run(os.path.join(tmp, "stress.db"), n, max(count // n, 1)) for n in processes]
+    return {"single_requests": count, "single_per_sec": round(count / single, 1),
+            "multi_process": [{"processes": r["processes"], "requests_per_sec": r["requests_per_sec"]}
+                              for r in runs]}
+
+
+# Latency of the pages the donor and request windows load: first page, a page
+# deep in the table, a filtered page and a page sorted by another column
+def bench_listing(path, rows, seed):
+    conn = engine.connect(path)
+    results = {}
+    for table, sort, filters in (("donors", "name", {"blood_type": "AB-"}),
+                                 ("blood_requests", "datetime", {"status": "Pending", "urgency": "Critical"})):
+        key = engine.LISTINGS[table][0]
+        deep = conn.execute(f"SELECT {key} FROM {table} ORDER BY {key} LIMIT 1 OFFSET ?",
+                            (rows * 9 // 10,)).fetchone()
+        results[table] = {
+            "rows": conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0],
+            "first_page": timed(lambda: engine.fetch_page(table, conn=conn)),
+            "deep_page": timed(lambda: engine.fetch_page(table, after=deep, conn=conn)),
+            "last_page": timed(lambda: engine.fetch_page(table, descending=True, conn=conn)),
+            "filtered_page": timed(lambda: engine.fetch_page(table, filters=filters, conn=conn)),
+            "sorted_page": timed(lambda: engine.fetch_page(table, sort=sort, conn=conn)),
+        }
+    results["eligible_donors"] = {blood_type: timed(lambda: engine.eligible_donors(blood_type, on=DATA_DATE,
+                                                                                   conn=conn))
+                                  for blood_type in ("A+", "AB-")}
+    conn.close()
+    return results
+
+
+# Latency of a page of donor search results: the start of a contact number at
+# every length from one digit (nearly every donor) to the whole number, with a
+# blood type, and a name. Every synthetic donor is called "Donor", the worst
+# case for a name search.
+def bench_search(path, rows, seed):
+    conn = engine.connect(path)
+    contact = conn.execute("SELECT contact FROM donors ORDER BY donor_id LIMIT 1 OFFSET ?",
+                           (rows // 3,)).fetchone()[0]
+    searches = [contact[:length] for length in (1, 2, 3, 4, 5, 7, 10)]
+    searches += [f"{contact[:3]} ab-", f"{contact[:5]} o+", "donor", f"donor {contact[:5]}"]
+    results = {}
+    for text in searches:
+        timing = timed(lambda: engine.search_donors(text, conn=conn))
+        results[text] = timing | {"rows": len(engine.search_donors(text, conn=conn)),
+                                  "within_target": timing["median_ms"] < SEARCH_TARGET_MS}
+    conn.close()
+    return {"target_ms": SEARCH_TARGET_MS, "searches": results}
+
+
+# receive_stock for every blood type against the pending queue. Each run is
+# rolled back so every blood type sees the same queue.
+def bench_allocation(path, rows, seed):
+    conn = engine.connect(path)
+    pending = conn.execute("SELECT COUNT(*) FROM blood_requests WHERE status = 'Pending'").fetchone()[0]
+    results = {}
+    for blood_type in engine.BLOOD_TYPES:
+        timings = []
+        fulfilled = 0
+        for _ in range(REPEAT):
+            conn.execute("BEGIN IMMEDIATE")
+            started = time.perf_counter()
+            allocation = allocator.receive_stock(blood_type, 500, conn=conn)
+            timings.append(time.perf_counter() - started)
+            conn.execute("ROLLBACK")
+            fulfilled = len(allocation.fulfilled)
+        results[blood_type] = {"median_ms": round(statistics.median(timings) * 1000, 3),
+                               "fulfilled": fulfilled}
+    conn.close()
+    return {"pending": pending, "units_received": 500, "by_blood_type": results}
+
+
+BENCHMARKS = {
+    "donor_insert": bench_donor_insert,
+    "request_submit": bench_request_submit,
+    "listing": bench_listing,
+    "search": bench_search,
+    "allocation": bench_allocation,
+}
+
+
+# Build a database of `rows` donors and `rows` requests and run the chosen
+# benchmarks against it. Benchmarks that write run on a copy, so the order
+# they run in does not change the others' results.
+def run(rows, seed=0, benchmarks=None, path=None):
+    names = benchmarks or list(BENCHMARKS)
+    report = {
+        "rows": rows,
+        "seed": seed,
+        "schema_version": migrations.LATEST_VERSION,
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "started": datetime.now().isoformat(timespec="seconds"),
+        "results": {},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        base = path or os.path.join(tmp, "bench.db")
+        started = time.perf_counter()
+        conn = engine.connect(base)
+        populate(conn, rows, rows, seed)
+        report["populate_seconds"] = round(time.perf_counter() - started, 3)
+
+        for name in names:
+            target = os.path.join(tmp, f"{name}.db")
+            copy = engine.connect(target)
+            conn.backup(copy)
+            copy.close()
+            report["results"][name] = BENCHMARKS[name](target, rows, seed)
+        conn.close()
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="BloodLink benchmark suite")
+    parser.add_argument("--rows", type=int, default=10000, help="donors and requests to generate (10k-10M)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--benchmarks", help=f"comma separated subset of: {', '.join(BENCHMARKS)}")
+    parser.add_argument("--db", help="keep the generated database in this file")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    names = args.benchmarks.split(",") if args.benchmarks else None
+    unknown = set(names or ()) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    report = run(args.rows, args.seed, names, args.db)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,606 +1,974 @@
-import tkinter as tk
-from tkinter import messagebox, ttk
-from datetime import datetime
-import sqlite3
-import re
-from PIL import Image, ImageTk
-
-# Connect to SQLite database
-conn = sqlite3.connect('blood_donation_platform.db')
-cursor = conn.cursor()
-
-# Create tables
-#display donors
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS donors (
-    donor_id INTEGER PRIMARY KEY AUTOINCREMENT,
-    name TEXT,
-    dob TEXT,
-    blood_type TEXT,
-    contact TEXT
-)''')
-#blood stock
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS blood_stock (
-    blood_type TEXT PRIMARY KEY,
-    quantity INTEGER
-)''')
-#blood requests
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS blood_requests (
-    request_id INTEGER PRIMARY KEY AUTOINCREMENT,
-    requestor_name TEXT,
-    contact_number TEXT,
-    email_address TEXT,
-    blood_type_required TEXT,
-    quantity_needed INTEGER,
-    urgency TEXT,
-    patient_name TEXT,
-    datetime TEXT DEFAULT CURRENT_TIMESTAMP,
-    status TEXT
-)''')
-
-# Function to validate date format (YYYY-MM-DD)
-def validate_date_input(input_date):
-    # Regular expression to match date format YYYY-MM-DD
-    date_pattern = r"^\d{4}-\d{2}-\d{2}$"
-
-    if not re.match(date_pattern, input_date): # Check if the input matches the pattern
-        return False
-
-    year, month, day = map(int, input_date.split('-'))  # Extract the year, month, and day from the input string
-
-    if month < 1 or month > 12: # Check if the month is valid (1 to 12)
-        return False
-
-    if not is_valid_day_for_month(month, day, year):   # Check if the day is valid for the given month
-        return False
-
-    return True
-
-# Function to check if the day is valid for the given month
-def is_valid_day_for_month(month, day, year):
-    # Days in each month (for non-leap year)
-    days_in_month = {
-        1: 31, 2: 28, 3: 31, 4: 30, 5: 31, 6: 30,
-        7: 31, 8: 31, 9: 30, 10: 31, 11: 30, 12: 31
-    }
-    # Check if the month is February and account for leap years
-    if month == 2:
-        # Leap year check (divisible by 4, but not by 100 unless divisible by 400)
-        if (year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)):
-            days_in_month[2] = 29  # February has 29 days in a leap year
-
-    # Check if the day is valid for the month
-    if day < 1 or day > days_in_month[month]:
-        return False
-
-    return True
-
-# Function to check if a date is in the future
-def is_future_date(date_str):
-    try:
-        entered_date = datetime.strptime(date_str, "%Y-%m-%d")
-        current_date = datetime.now()
-        return entered_date > current_date
-    except ValueError:
-        return False
-
-def show_message(message):      # Function to show a message box
-    messagebox.showinfo("Input Error", message)
-
-# Function to calculate age
-def calculate_age(dob):
-    today = datetime.today()
-    dob_date = datetime.strptime(dob, "%Y-%m-%d")
-    age = today.year - dob_date.year - ((today.month, today.day) < (dob_date.month, dob_date.day))
-    return age
-
-def is_valid_email(email):
-    email_regex = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    return re.match(email_regex, email) is not None
-
-def clear_form():
-    # Blood request form Entry fields
-    blood_request_entries = [
-        entry_requestor_name, entry_organization_name, entry_requestor_contact, entry_requestor_email,
-        entry_quantity_needed, entry_patient_name, entry_patient_age, entry_patient_condition,
-        entry_special_requirements
-    ]
-
-    # Donor form Entry fields
-    donor_entries = [
-        entry_name, entry_dob, entry_address, entry_contact, entry_email,
-        entry_nationality, entry_last_donation, entry_emergency_contact_name, entry_emergency_contact_number
-    ]
-
-    # Clear all Entry fields (blood request + donor form)
-    for entry in blood_request_entries + donor_entries:
-        entry.delete(0, tk.END)
-
-    # Reset all StringVar and IntVar values for both forms
-    var_blood_type_request.set('')
-    var_urgency.set('')
-    var_purpose.set('')
-    var_approval.set(0)
-
-    var_gender.set('')
-    var_blood_type.set('')
-    var_transfusion.set(0)
-    var_chronic_illness.set(0)
-    var_allergies.set(0)
-    var_surgeries.set(0)
-    var_medication.set(0)
-    var_high_risk.set(0)
-    var_donated_before.set(0)
-    var_consent.set(0)
-
-# Function to handle Donor Registration form submission
-def submit_donor():
-    name = entry_name.get()
-    gender = var_gender.get()
-    dob = entry_dob.get()
-    age = None  # None because age is calculated by calculate_age function and only people of age 18-65 yrs are eligible to donate
-    blood_type = var_blood_type.get()
-    address = entry_address.get()
-    contact = entry_contact.get()
-    email = entry_email.get()
-    nationality = entry_nationality.get()
-    transfusion = var_transfusion.get()
-    chronic_illness = var_chronic_illness.get()
-    allergies = var_allergies.get()
-    surgeries = var_surgeries.get()
-    medication = var_medication.get()
-    high_risk = var_high_risk.get()
-    donated_before = var_donated_before.get()
-    last_donation = entry_last_donation.get()
-    consent = var_consent.get()
-    emergency_contact_name = entry_emergency_contact_name.get()
-    emergency_contact_number = entry_emergency_contact_number.get()
-
-    # Basic validation for ensuring required fields are filled
-    if not (name and gender and email and nationality and dob and blood_type and contact):
-        messagebox.showwarning("Input Error", "Please fill in all mandatory fields.")
-        return
-
-    try:
-        age = calculate_age(dob)
-    except ValueError:
-        show_message("Invalid Date of Birth format. Please use YYYY-MM-DD.")
-        return
-
-    if is_future_date(entry_dob.get()):
-        show_message("Date of Birth cannot be a future date.")
-        return
-
-    # Check age eligibility
-    if age < 18 or age > 65:
-        messagebox.showwarning("Eligibility Error", "Age must be between 18 and 65 to donate blood.")
-        return
-
-    # Validate phone number (must be 10 digits)
-    if not contact.isdigit() or len(contact) != 10:
-        messagebox.showwarning("Input Error", "Please enter a valid 10-digit phone number.")
-        return
-
-    # Check if email is valid
-    if not is_valid_email(email):
-        messagebox.showwarning("Invalid Email", "Please enter a valid email address.")
-        return
-
-    # Check medical history
-    if any([transfusion, chronic_illness, allergies, surgeries, medication, high_risk]):
-        messagebox.showwarning("Eligibility Error", "Donors with medical history are not eligible to donate blood.")
-        return
-
-     # Validate Last Donation Date (if provided, it must be a valid date and can't be in future)
-    if entry_last_donation.get():
-        if not validate_date_input(entry_last_donation.get()):
-            show_message("Invalid Last Donation date format. Please use YYYY-MM-DD.")
-            return
-
-    if is_future_date(entry_last_donation.get()):
-            show_message("Last donation date cannot be a future date.")
-            return
-
-    # Validate emergency contact number (must be 10 digits)
-    if not emergency_contact_number.isdigit() or len(emergency_contact_number) != 10:
-        messagebox.showwarning("Input Error", "Please enter a valid 10-digit emergency phone number.")
-        return
-
-    if consent != 1:
-        messagebox.showwarning("Consent Error", "You must provide consent to register.")
-    else:
-        # Save donor details into the database
-        cursor.execute('''
-        INSERT INTO donors (name, dob, blood_type, contact)
-        VALUES (?, ?, ?, ?)
-        ''', (name, dob, blood_type, contact))
-
-        # Commit changes and show success message
-        conn.commit()
-        messagebox.showinfo("Registration Successful", f"Donor {name} (Age: {age}) registered successfully!")
-    clear_form()
-
-# Function to display all donors
-def display_donors():
-    # Create a new window to display donor details
-    donor_window = tk.Toplevel(root)
-    donor_window.title("Donor List")
-
-    # Create a treeview to display donors
-    tree = ttk.Treeview(donor_window, columns=("Donor ID", "Name", "DOB", "Blood Type", "Contact"),
-                        show="headings")
-    tree.heading("Donor ID", text="Donor ID")
-    tree.heading("Name", text="Name")
-    tree.heading("DOB", text="DOB")
-    tree.heading("Blood Type", text="Blood Type")
-    tree.heading("Contact", text="Contact")
-
-    tree.grid(row=0, column=0, padx=10, pady=10)
-
-    # Fetch donor details from the database
-    cursor.execute("SELECT * FROM donors")
-    donors = cursor.fetchall()
-
-    for donor in donors:
-        tree.insert("", "end", values=donor)
-
-# Function to handle blood request form submission
-def submit_blood_request():
-    blood_stock = 0
-
-    requestor_name = entry_requestor_name.get()
-    organization_name = entry_organization_name.get()
-    contact_number = entry_requestor_contact.get()
-    email_address = entry_requestor_email.get()
-    blood_type_required = var_blood_type_request.get()
-    quantity_needed = entry_quantity_needed.get()
-    urgency = var_urgency.get()
-    purpose = var_purpose.get()
-    patient_name = entry_patient_name.get()
-    patient_age = entry_patient_age.get()
-    patient_condition = entry_patient_condition.get()
-    # request_datetime = entry_request_datetime.get()   # not included this because date and time is auto generated by SQL command 'TIMESTAMP'
-    special_requirements = entry_special_requirements.get()
-    approval = var_approval.get()
-
-    # Check if all fields are filled
-    if not (requestor_name and contact_number and email_address and blood_type_required and quantity_needed and urgency and patient_name and patient_age and patient_condition):
-        messagebox.showwarning("Input Error", "Please fill in all mandatory fields.")
-        return
-
-    # Validate phone number (must be 10 digits)
-    if not contact_number.isdigit() or len(contact_number) != 10:
-        messagebox.showwarning("Input Error", "Please enter a valid 10-digit phone number.")
-        return
-
-    # Check if email is valid
-    if not is_valid_email(email_address):
-        messagebox.showwarning("Invalid Email", "Please enter a valid email address.")
-        return
-
-    if approval != 1:
-        messagebox.showwarning("Error", "You must have authorization to submit request.")
-    else:
-    # Fetch blood stock details to check availability
-        cursor.execute("SELECT quantity FROM blood_stock WHERE blood_type = ?", (blood_type_required,))
-        blood_stock = cursor.fetchone()
-
-    if blood_stock:
-        available_quantity = blood_stock[0]
-
-        # Case 1: Sufficient stock
-        if int(quantity_needed) <= available_quantity:
-            status = "Fulfilled"
-            # Update the blood stock quantity
-            cursor.execute("UPDATE blood_stock SET quantity = quantity - ? WHERE blood_type = ?",
-                           (quantity_needed, blood_type_required))
-            message = f"Blood request for {patient_name} has been fulfilled."
-
-        # Case 2: Insufficient stock (but stock available)
-        elif int(quantity_needed) > available_quantity:
-            status = "Pending"
-            message = f"Insufficient stock for {blood_type_required}. Available stock: {available_quantity} units. Blood request for {patient_name} is pending."
-
-    else:
-        # Case 3: No stock available
-        status = "Pending"
-        message = f"Currently out of stock for {blood_type_required}. Blood request for {patient_name} is pending."
-
-    # Save the blood request details with the status (Pending or Fulfilled)
-    cursor.execute('''INSERT INTO blood_requests (requestor_name, contact_number, email_address, blood_type_required, quantity_needed, urgency, patient_name, status)
-                      VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
-                   (requestor_name, contact_number, email_address, blood_type_required, quantity_needed, urgency,
-                    patient_name, status))
-
-    # Commit changes and show the appropriate message
-    conn.commit()
-    messagebox.showinfo("Request Submitted", message)
-    clear_form()
-
-
-# Function to display blood stock
-def display_blood_stock():
-    stock_window = tk.Toplevel(root)
-    stock_window.title("Blood Stock")
-
-    # Create a treeview to display blood stock
-    tree = ttk.Treeview(stock_window, columns=("Blood Type", "Quantity"), show="headings")
-    tree.heading("Blood Type", text="Blood Type")
-    tree.heading("Quantity", text="Quantity")
-    tree.grid(row=0, column=0, padx=10, pady=10)
-
-    # Fetch blood stock details
-    cursor.execute("SELECT * FROM blood_stock")
-    stock = cursor.fetchall()
-
-    for stock_item in stock:
-        tree.insert("", "end", values=stock_item)
-
-# Function to display blood request details
-def display_blood_request_details():
-    request_window = tk.Toplevel(root)
-    request_window.title("Blood Request Details")
-
-    # Create a treeview to display blood requests
-    tree = ttk.Treeview(request_window, columns=("Request ID", "Requestor_name", "Contact", "Email", "Blood Type", "Quantity", "Urgency", "Patient Name","Datetime", "Status"), show="headings")
-    tree.heading("Request ID", text="Request ID")
-    tree.heading("Requestor_name", text="Requestor Name")
-    tree.heading("Contact", text="Contact")
-    tree.heading("Email", text="Email")
-    tree.heading("Blood Type", text="Blood Type")
-    tree.heading("Quantity", text="Quantity")
-    tree.heading("Urgency", text="Urgency")
-    tree.heading("Patient Name", text="Patient Name")
-    tree.heading("Datetime", text="Datetime")
-    tree.heading("Status", text="Status")
-
-    # Set column widths
-    tree.column("Request ID", width=70, anchor="center")
-    tree.column("Requestor_name", width=150, anchor="center")
-    tree.column("Contact", width=100, anchor="center")
-    tree.column("Email", width=200, anchor="center")
-    tree.column("Blood Type", width=100, anchor="center")
-    tree.column("Quantity", width=80, anchor="center")
-    tree.column("Urgency", width=100, anchor="center")
-    tree.column("Patient Name", width=100, anchor="center")
-    tree.column("Datetime", width=150, anchor="center")
-    tree.column("Status", width=100, anchor="center")
-
-    # Place the treeview in the window using grid layout
-    tree.grid(row=0, column=0, padx=10, pady=10, sticky='nsew')
-
-    # make the window size adjustable
-    request_window.grid_rowconfigure(0, weight=1)
-    request_window.grid_columnconfigure(0, weight=1)
-
-    # Fetch blood request details
-    cursor.execute("SELECT * FROM blood_requests")
-    requests = cursor.fetchall()
-
-    for request in requests:
-        tree.insert("", "end", values=request)
-
-# Function to show the form
-def show_donor_registration_form():
-    blood_request_form_frame.grid_forget()  # Hide the blood request form
-    donor_form_frame.grid(row=1, column=0, sticky="nsew")#padx=10, #pady=10)  # Show the donor form
-
-def show_blood_request_form():
-    donor_form_frame.grid_forget()  # Hide the donor registration form
-    blood_request_form_frame.grid(row=1, column=0,sticky="nsew") #padx=10, pady=10)  # Show the blood request form
-
-# Main Tkinter window
-root = tk.Tk()
-root.title('"Blood Link" – Blood donation and request management platform')
-root.geometry("800x600")
-
-# Load the background image
-bg_image = Image.open("B5.jpg")
-bg_image = bg_image.resize((root.winfo_screenwidth(), root.winfo_screenheight()), Image.LANCZOS)
-bg_photo = ImageTk.PhotoImage(bg_image)
-
-canvas = tk.Canvas(root, width=200, height=200)
-canvas.pack(fill="both", expand=True)
-canvas.create_image(0, 0, image=bg_photo, anchor="nw")
-
-# Create a scrollable frame for long forms
-scrollable_frame = tk.Frame(canvas, bg="white")
-scrollbar = tk.Scrollbar(root, orient="vertical", command=canvas.yview)
-canvas.configure(yscrollcommand=scrollbar.set)
-
-scrollbar.pack(side="right", fill="y")
-canvas.pack(side="left", fill="both", expand=True)
-canvas.create_window((0, 0), window=scrollable_frame, anchor="nw")
-
-scrollable_frame.bind("<Configure>", lambda e: canvas.configure(scrollregion=canvas.bbox("all")))
-
-# Create frames for the forms
-donor_form_frame = tk.Frame(scrollable_frame, bg="white")  # Donor registration form frame
-blood_request_form_frame = tk.Frame(scrollable_frame, bg="white")  # Blood request form frame
-
-# Radio button for form selection
-var_form_selection = tk.StringVar()
-tk.Label(scrollable_frame, text="Select the form type", font=("georgia", 14, "bold")).grid(row=0,column=0,padx=10,pady=5)
-tk.Radiobutton(scrollable_frame, text="Donor Registration", variable=var_form_selection, value="donor",
-               command=show_donor_registration_form, font=("georgia", 14,"bold")).grid(row=0, column=1, padx=10, pady=5, sticky="w")
-tk.Radiobutton(scrollable_frame, text="Blood Request", variable=var_form_selection, value="request",
-               command=show_blood_request_form, font=("georgia", 14,"bold")).grid(row=0, column=2, padx=10, pady=5, sticky="w")
-
-scrollable_frame.grid_columnconfigure(0, weight=1, uniform="equal")
-scrollable_frame.grid_columnconfigure(1, weight=1, uniform="equal")
-scrollable_frame.grid_columnconfigure(2, weight=1, uniform="equal")
-
-# Donor Registration Form Fields
-tk.Label(donor_form_frame, text="Full Name:*",bg="white", font=("abadi", 10,"bold")).grid(row=1, column=0, sticky="w", pady=5)
-entry_name = tk.Entry(donor_form_frame, width=30, bg="lightgrey", font=("abadi", 10))
-entry_name.grid(row=1, column=1, pady=5)
-
-tk.Label(donor_form_frame, text="Gender:*",bg="white", font=("abadi", 10,"bold")).grid(row=2, column=0, sticky="w", pady=5)
-var_gender = tk.StringVar()
-gender_menu = ttk.Combobox(donor_form_frame, textvariable=var_gender, values=["Male", "Female", "Other"],
-                           state="readonly")
-gender_menu.grid(row=2, column=1, pady=5)
-
-tk.Label(donor_form_frame, text="Date of Birth (YYYY-MM-DD):*",bg="white", font=("abadi", 10,"bold")).grid(row=3, column=0, sticky="w", pady=5)
-entry_dob = tk.Entry(donor_form_frame, width=30,bg="lightgrey", font=("abadi", 10))
-entry_dob.grid(row=3, column=1, pady=5)
-
-tk.Label(donor_form_frame, text="Blood Type:*",bg="white", font=("abadi", 10,"bold")).grid(row=4, column=0, sticky="w", pady=5)
-var_blood_type = tk.StringVar()
-blood_type_menu = ttk.Combobox(donor_form_frame, textvariable=var_blood_type,
-                               values=["A+", "A-", "B+", "B-", "O+", "O-", "AB+", "AB-"], state="readonly")
-blood_type_menu.grid(row=4, column=1, pady=5)
-
-tk.Label(donor_form_frame, text="Address:",bg="white", font=("abadi", 10,"bold")).grid(row=5, column=0, sticky="w", pady=5)
-entry_address = tk.Entry(donor_form_frame, width=30,bg="lightgrey", font=("abadi", 10))
-entry_address.grid(row=5, column=1, pady=5)
-
-tk.Label(donor_form_frame, text="Contact Number:*", bg="white", font=("abadi", 10,"bold")).grid(row=6, column=0, sticky="w", pady=5)
-entry_contact = tk.Entry(donor_form_frame, width=30,bg="lightgrey", font=("abadi", 10))
-entry_contact.grid(row=6, column=1, pady=5)
-
-tk.Label(donor_form_frame, text="Email Address:*",bg="white", font=("abadi", 10,"bold")).grid(row=7, column=0, sticky="w", pady=5)
-entry_email = tk.Entry(donor_form_frame, width=30,bg="lightgrey", font=("abadi", 10))
-entry_email.grid(row=7, column=1, pady=5)
-
-tk.Label(donor_form_frame, text="Nationality:*",bg="white", font=("abadi", 10,"bold")).grid(row=8, column=0, sticky="w", pady=5)
-entry_nationality = tk.Entry(donor_form_frame, width=30,bg="lightgrey", font=("abadi", 10))
-entry_nationality.grid(row=8, column=1, pady=5)
-
-tk.Label(donor_form_frame, text="Medical History:", bg="white", font=("abadi", 10,"bold")).grid(row=9, column=0, sticky="w", pady=5)
-var_transfusion = tk.IntVar()
-var_chronic_illness = tk.IntVar()
-var_allergies = tk.IntVar()
-var_surgeries = tk.IntVar()
-var_medication = tk.IntVar()
-var_high_risk = tk.IntVar()
-
-tk.Checkbutton(donor_form_frame, text="Have you ever had a blood transfusion?", variable=var_transfusion,bg="white", font=("abadi", 10)).grid(row=10,
-                                                                                                               column=0,
-                                                                                                               columnspan=2,
-                                                                                                               sticky="w",
-                                                                                                               pady=2)
-tk.Checkbutton(donor_form_frame, text="Do you have any chronic illnesses?", variable=var_chronic_illness,bg="white", font=("abadi", 10)).grid(row=11,
-                                                                                                               column=0,
-                                                                                                               columnspan=2,
-                                                                                                               sticky="w",
-                                                                                                               pady=2)
-tk.Checkbutton(donor_form_frame, text="Do you have any known allergies?", variable=var_allergies,bg="white", font=("abadi", 10)).grid(row=12, column=0,
-                                                                                                       columnspan=2,
-                                                                                                       sticky="w",
-                                                                                                       pady=2)
-tk.Checkbutton(donor_form_frame, text="Have you had any surgeries in the last 12 months?", variable=var_surgeries,bg="white", font=("abadi", 10)).grid(
-    row=13, column=0, columnspan=2, sticky="w", pady=2)
-tk.Checkbutton(donor_form_frame, text="Are you currently on any medication?", variable=var_medication,bg="white", font=("abadi", 10)).grid(row=14,
-                                                                                                            column=0,
-                                                                                                            columnspan=2,
-                                                                                                            sticky="w",
-                                                                                                            pady=2)
-tk.Checkbutton(donor_form_frame, text="Do you have a history of high-risk behavior?", variable=var_high_risk,bg="white", font=("abadi", 10)).grid(
-    row=15, column=0, columnspan=2, sticky="w", pady=2)
-
-tk.Label(donor_form_frame, text="Donor History:",bg="white", font=("abadi", 10,"bold")).grid(row=16, column=0, sticky="w", pady=5)
-var_donated_before = tk.IntVar()
-tk.Checkbutton(donor_form_frame, text="Have you donated blood before?", variable=var_donated_before,bg="white", font=("abadi", 10)).grid(row=17,
-                                                                                                          column=0,
-                                                                                                          columnspan=2,
-                                                                                                          sticky="w",
-                                                                                                          pady=2)
-tk.Label(donor_form_frame, text="When was your last blood donation? (YYYY-MM-DD):",bg="white", font=("abadi", 10)).grid(row=18, column=0, sticky="w", pady=2)
-entry_last_donation = tk.Entry(donor_form_frame, width=30,bg="lightgrey")
-entry_last_donation.grid(row=18, column=1, pady=2)
-
-tk.Label(donor_form_frame, text="Emergency Contact Information:",bg="white", font=("abadi", 10, "bold")).grid(row=19, column=0, sticky="w", pady=5)
-tk.Label(donor_form_frame, text="Name:*", bg="white", font=("abadi", 10)).grid(row=20, column=0, sticky="w", pady=2)
-entry_emergency_contact_name = tk.Entry(donor_form_frame, width=30,bg="lightgrey", font=("abadi", 10))
-entry_emergency_contact_name.grid(row=20, column=1, pady=2)
-
-tk.Label(donor_form_frame, text="Contact Number:*",bg="white", font=("abadi", 10)).grid(row=21, column=0, sticky="w", pady=2)
-entry_emergency_contact_number = tk.Entry(donor_form_frame, width=30,bg="lightgrey", font=("abadi", 10))
-entry_emergency_contact_number.grid(row=21, column=1, pady=2)
-
-var_consent = tk.IntVar()
-tk.Checkbutton(donor_form_frame, text="I consent to donate blood and acknowledge the risks.",
-               variable=var_consent,bg="white", font=("abadi", 10, "bold")).grid(row=22, column=0, columnspan=2, sticky="w", pady=5)
-
-tk.Label(donor_form_frame, text="* - Required fields",bg="white", font=("abadi", 10)).grid(row=23, column=0, sticky="w", pady=2)
-# Submit Button
-tk.Button(donor_form_frame, text="Submit", command=submit_donor,bg="lightgrey", font=("abadi", 10,"bold")).grid(row=24, column=0, columnspan=2, pady=10)
-
-tk.Button(donor_form_frame, text="Display Donors", command = display_donors, font=("abadi", 10,"bold")).grid(row=25, column=0, columnspan=2, pady=10)
-
-
-# Blood Request Form Fields
-tk.Label(blood_request_form_frame, text="Requestor Name:*",bg="white", font=("abadi", 10, "bold")).grid(row=1, column=0, sticky="w", pady=5)
-entry_requestor_name = tk.Entry(blood_request_form_frame, width=30,bg="lightgrey", font=("abadi", 10))
-entry_requestor_name.grid(row=1, column=1, pady=5)
-
-tk.Label(blood_request_form_frame, text="Organization Name (if applicable):",bg="white", font=("abadi", 10, "bold")).grid(row=2, column=0, sticky="w", pady=5)
-entry_organization_name = tk.Entry(blood_request_form_frame, width=30,bg="lightgrey", font=("abadi", 10))
-entry_organization_name.grid(row=2, column=1, pady=5)
-
-tk.Label(blood_request_form_frame, text="Contact Number:*",bg="white", font=("abadi", 10, "bold")).grid(row=3, column=0, sticky="w", pady=5)
-entry_requestor_contact = tk.Entry(blood_request_form_frame, width=30,bg="lightgrey", font=("abadi", 10))
-entry_requestor_contact.grid(row=3, column=1, pady=5)
-
-tk.Label(blood_request_form_frame, text="Email Address:*",bg="white", font=("abadi", 10, "bold")).grid(row=4, column=0, sticky="w", pady=5)
-entry_requestor_email = tk.Entry(blood_request_form_frame, width=30,bg="lightgrey", font=("abadi", 10))
-entry_requestor_email.grid(row=4, column=1, pady=5)
-
-tk.Label(blood_request_form_frame, text="Blood Type Required:*",bg="white", font=("abadi", 10, "bold")).grid(row=5, column=0, sticky="w", pady=5)
-var_blood_type_request = tk.StringVar()
-blood_type_request_menu = ttk.Combobox(blood_request_form_frame, textvariable=var_blood_type_request,
-                                         values=["A+", "A-", "B+", "B-", "O+", "O-", "AB+", "AB-"], state="readonly")
-blood_type_request_menu.grid(row=5, column=1, pady=5)
-
-tk.Label(blood_request_form_frame, text="Quantity of Blood Needed:*",bg="white", font=("abadi", 10, "bold")).grid(row=6, column=0, sticky="w", pady=5)
-entry_quantity_needed = tk.Entry(blood_request_form_frame, width=30,bg="lightgrey", font=("abadi", 10))
-entry_quantity_needed.grid(row=6, column=1, pady=5)
-
-tk.Label(blood_request_form_frame, text="Urgency:*",bg="white", font=("abadi", 10, "bold")).grid(row=7, column=0, sticky="w", pady=5)
-var_urgency = tk.StringVar()
-urgency_menu = ttk.Combobox(blood_request_form_frame, textvariable=var_urgency, values=["Normal", "Urgent", "Critical"],
-                             state="readonly")
-urgency_menu.grid(row=7, column=1, pady=5)
-
-tk.Label(blood_request_form_frame, text="Purpose of the Request:",bg="white", font=("abadi", 10, "bold")).grid(row=8, column=0, sticky="w", pady=5)
-var_purpose = tk.StringVar()
-purpose_menu = ttk.Combobox(blood_request_form_frame, textvariable=var_purpose,
-                             values=["Medical Procedure", "Emergency", "Chronic Condition"], state="readonly")
-purpose_menu.grid(row=8, column=1, pady=5)
-
-tk.Label(blood_request_form_frame, text="Patient Name:*",bg="white", font=("abadi", 10, "bold")).grid(row=9, column=0, sticky="w", pady=5)
-entry_patient_name = tk.Entry(blood_request_form_frame, width=30,bg="lightgrey", font=("abadi", 10))
-entry_patient_name.grid(row=9, column=1, pady=5)
-
-tk.Label(blood_request_form_frame, text="Patient Age:*",bg="white", font=("abadi", 10, "bold")).grid(row=10, column=0, sticky="w", pady=5)
-entry_patient_age = tk.Entry(blood_request_form_frame, width=30,bg="lightgrey", font=("abadi", 10))
-entry_patient_age.grid(row=10, column=1, pady=5)
-
-tk.Label(blood_request_form_frame, text="Patient Condition:*",bg="white", font=("abadi", 10, "bold")).grid(row=11, column=0, sticky="w", pady=5)
-entry_patient_condition = tk.Entry(blood_request_form_frame, width=30,bg="lightgrey", font=("abadi", 10))
-entry_patient_condition.grid(row=11, column=1, pady=5)
-
-tk.Label(blood_request_form_frame, text="Special Requirements or Notes:",bg="white", font=("abadi", 10, "bold")).grid(row=13, column=0, sticky="w", pady=5)
-entry_special_requirements = tk.Entry(blood_request_form_frame, width=30,bg="lightgrey", font=("abadi", 10))
-entry_special_requirements.grid(row=13, column=1, pady=5)
-
-tk.Label(blood_request_form_frame, text="Approval/Authorization:*",bg="white", font=("abadi", 10, "bold")).grid(row=14, column=0, sticky="w", pady=5)
-var_approval = tk.IntVar()
-tk.Checkbutton(blood_request_form_frame, text="Request authorized by medical professional.", variable=var_approval,bg="white", font=("abadi", 10, "bold")).grid(
-    row=14, column=1, pady=5)
-
-tk.Label(blood_request_form_frame, text="* - Required fields",bg="white", font=("abadi", 10)).grid(row=15, column=0, sticky="w", pady=2)
-tk.Button(blood_request_form_frame, text="Submit Blood Request", command=submit_blood_request,bg="lightgrey", font=("abadi", 10,"bold")).grid(row=16, column=0, columnspan=2, pady=20)
-
-# Add buttons under the blood request form
-tk.Button(blood_request_form_frame, text="Display Blood Stock", command=display_blood_stock, font=("abadi", 10,"bold")).grid(row=17, column=0, columnspan=2, pady=10)
-tk.Button(blood_request_form_frame, text="Display Blood Request Details", command=display_blood_request_details, font=("abadi", 10,"bold")).grid(row=18, column=0, columnspan=2, pady=10)
-
-# Run the Tkinter loop
-root.mainloop()
-
-
-
+import argparse
+import os
+import threading
+import time
+import tkinter as tk
+from tkinter import messagebox, ttk
+
+import allocator
+import engine
+import expiry
+import metrics
+from db_worker import DatabaseWorker
+from engine import BLOOD_TYPES, REQUEST_STATUSES, URGENCY_LEVELS, ValidationError
+from listing import PagedTreeview
+
+STARTED = time.perf_counter()
+
+# Background picture. It is scaled to the screen once per resolution and
+# cached as a PPM file, which Tk loads without decoding; PIL is only needed to
+# build the cache.
+BACKGROUND_IMAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "b5.jpg")
+BACKGROUND_CACHE = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "bloodlink")
+
+root = None
+db = None   # DatabaseWorker: all SQL runs on its thread, never on the Tk event loop
+built_forms = set()     # forms are built the first time they are picked
+startup = {}            # phase -> seconds since STARTED, printed by --startup-time
+background_source = "none"
+background_thread = None
+
+
+def show_message(message):      # Function to show a message box
+    messagebox.showinfo("Input Error", message)
+
+# Function to show a validation error raised by the engine
+def show_validation_error(error):
+    messagebox.showwarning(error.title, error.message)
+
+# Function to show an error coming back from the database worker
+def show_error(error):
+    if isinstance(error, ValidationError):
+        show_validation_error(error)
+    else:
+        messagebox.showerror("Database Error", f"The database could not complete the operation: {error}")
+
+def clear_form():
+    # Only the forms that have been built have fields to clear
+    if "request" in built_forms:
+        # Blood request form Entry fields
+        blood_request_entries = [
+            entry_requestor_name, entry_organization_name, entry_requestor_contact, entry_requestor_email,
+            entry_quantity_needed, entry_patient_name, entry_patient_age, entry_patient_condition,
+            entry_special_requirements
+        ]
+        for entry in blood_request_entries:
+            entry.delete(0, tk.END)
+
+        var_blood_type_request.set('')
+        var_urgency.set('')
+        var_purpose.set('')
+        var_approval.set(0)
+
+    if "donor" not in built_forms:
+        return
+
+    # Donor form Entry fields
+    donor_entries = [
+        entry_name, entry_dob, entry_address, entry_contact, entry_email,
+        entry_nationality, entry_last_donation, entry_emergency_contact_name, entry_emergency_contact_number
+    ]
+    for entry in donor_entries:
+        entry.delete(0, tk.END)
+
+    var_gender.set('')
+    var_blood_type.set('')
+    var_transfusion.set(0)
+    var_chronic_illness.set(0)
+    var_allergies.set(0)
+    var_surgeries.set(0)
+    var_medication.set(0)
+    var_high_risk.set(0)
+    var_donated_before.set(0)
+    var_consent.set(0)
+
+# Function to handle Donor Registration form submission
+@metrics.timed("gui.submit_donor")
+def submit_donor():
+    name = entry_name.get()
+    medical_history = [var_transfusion.get(), var_chronic_illness.get(), var_allergies.get(),
+                       var_surgeries.get(), var_medication.get(), var_high_risk.get()]
+
+    def registered(result):
+        donor_id, age = result
+        messagebox.showinfo("Registration Successful", f"Donor {name} (Age: {age}) registered successfully!")
+        clear_form()
+
+    def failed(error):
+        show_error(error)
+        # A missing consent still resets the form, as before
+        if isinstance(error, ValidationError) and error.title == "Consent Error":
+            clear_form()
+
+    db.submit(engine.register_donor,
+              name=name,
+              gender=var_gender.get(),
+              dob=entry_dob.get(),
+              blood_type=var_blood_type.get(),
+              contact=entry_contact.get(),
+              email=entry_email.get(),
+              nationality=entry_nationality.get(),
+              emergency_contact_number=entry_emergency_contact_number.get(),
+              last_donation=entry_last_donation.get(),
+              medical_history=medical_history,
+              consent=var_consent.get() == 1,
+              address=entry_address.get(),
+              emergency_contact_name=entry_emergency_contact_name.get(),
+              write=True, callback=registered, error_callback=failed)
+
+# Function to display all donors
+@metrics.timed("gui.display_donors")
+def display_donors():
+    # Create a new window to display donor details
+    donor_window = tk.Toplevel(root)
+    donor_window.title("Donor List")
+
+    # Paged treeview: rows are fetched from the database as the list is scrolled
+    tree = PagedTreeview(donor_window, "donors", [
+        ("donor_id", "Donor ID", 70),
+        ("name", "Name", 150),
+        ("dob", "DOB", 100),
+        ("blood_type", "Blood Type", 100),
+        ("contact", "Contact", 100),
+    ], filters={"blood_type": ("Blood Type", BLOOD_TYPES)}, search="Search name / contact", worker=db)
+
+    tree.grid(row=0, column=0, padx=10, pady=10, sticky='nsew')
+    donor_window.grid_rowconfigure(0, weight=1)
+    donor_window.grid_columnconfigure(0, weight=1)
+
+# Function to handle blood request form submission
+@metrics.timed("gui.submit_blood_request")
+def submit_blood_request():
+    def submitted(result):
+        messagebox.showinfo("Request Submitted", result.message)
+        clear_form()
+
+    db.submit(engine.submit_request,
+              requestor_name=entry_requestor_name.get(),
+              contact_number=entry_requestor_contact.get(),
+              email_address=entry_requestor_email.get(),
+              blood_type_required=var_blood_type_request.get(),
+              quantity_needed=entry_quantity_needed.get(),
+              urgency=var_urgency.get(),
+              patient_name=entry_patient_name.get(),
+              patient_age=entry_patient_age.get(),
+              patient_condition=entry_patient_condition.get(),
+              approval=var_approval.get() == 1,
+              write=True, callback=submitted, error_callback=show_error)
+
+
+# Function to display blood stock
+@metrics.timed("gui.display_blood_stock")
+def display_blood_stock():
+    stock_window = tk.Toplevel(root)
+    stock_window.title("Blood Stock")
+
+    # Create a treeview to display blood stock
+    tree = ttk.Treeview(stock_window, columns=("Blood Type", "Quantity"), show="headings")
+    tree.heading("Blood Type", text="Blood Type")
+    tree.heading("Quantity", text="Quantity")
+    tree.grid(row=0, column=0, padx=10, pady=10)
+
+    # Fetch blood stock details
+    def show_stock(stock):
+        tree.delete(*tree.get_children())
+        for stock_item in stock.items():
+            tree.insert("", "end", values=stock_item)
+
+    def refresh_stock():
+        db.submit(engine.get_stock, callback=show_stock, error_callback=show_error)
+
+    refresh_stock()
+
+    # Receive new units; pending requests for that type are fulfilled right away
+    receive_frame = tk.Frame(stock_window)
+    receive_frame.grid(row=1, column=0, padx=10, pady=(0, 10), sticky="w")
+    var_receive_type = tk.StringVar()
+    tk.Label(receive_frame, text="Receive units:", font=("abadi", 10, "bold")).grid(row=0, column=0, padx=(0, 5))
+    ttk.Combobox(receive_frame, textvariable=var_receive_type, values=BLOOD_TYPES, state="readonly",
+                 width=6).grid(row=0, column=1, padx=5)
+    entry_receive_quantity = tk.Entry(receive_frame, width=8, bg="lightgrey", font=("abadi", 10))
+    entry_receive_quantity.grid(row=0, column=2, padx=5)
+    tk.Label(receive_frame, text="Expires (YYYY-MM-DD):").grid(row=0, column=3, padx=(10, 5))
+    entry_receive_expiry = tk.Entry(receive_frame, width=12, bg="lightgrey", font=("abadi", 10))
+    entry_receive_expiry.grid(row=0, column=4, padx=5)
+
+    # Demand forecast and reorder points (forecast.py, only with NumPy installed)
+    forecast_frame = tk.LabelFrame(stock_window, text="Forecast", font=("abadi", 10, "bold"))
+    forecast_frame.grid(row=2, column=0, padx=10, pady=(0, 10), sticky="nsew")
+    try:
+        import forecast
+    except ImportError:
+        forecast = None
+        tk.Label(forecast_frame, text="Install NumPy (pip install numpy) to see demand forecasts."
+                 ).pack(padx=10, pady=10)
+    if forecast:
+        headings = [("Blood Type", 80), ("Stock", 60), ("Per Day", 70), (f"Next {forecast.LEAD_DAYS} Days", 90),
+                    ("Reorder At", 80), ("Cover", 70)]
+        forecast_tree = ttk.Treeview(forecast_frame, columns=[text for text, _ in headings], show="headings",
+                                     height=len(BLOOD_TYPES))
+        for text, width in headings:
+            forecast_tree.heading(text, text=text)
+            forecast_tree.column(text, width=width, anchor="center")
+        forecast_tree.tag_configure("reorder", foreground="red")
+        forecast_tree.pack(fill="both", expand=True, padx=5, pady=5)
+
+        def show_forecast(reorders):
+            forecast_tree.delete(*forecast_tree.get_children())
+            for row in reorders:
+                cover = f"{row.days_of_cover:.1f} days" if row.days_of_cover is not None else "-"
+                forecast_tree.insert("", "end", values=(row.blood_type, row.stock, f"{row.daily_demand:.1f}",
+                                                        f"{row.lead_demand:.1f}", row.reorder_point, cover),
+                                     tags=("reorder",) if row.reorder else ())
+
+        def refresh_forecast():
+            db.submit(forecast.forecast, callback=show_forecast, error_callback=show_error)
+
+        refresh_forecast()
+
+    def received(allocation):
+        entry_receive_quantity.delete(0, tk.END)
+        entry_receive_expiry.delete(0, tk.END)
+        refresh_stock()
+        if forecast:
+            refresh_forecast()
+        messagebox.showinfo("Stock Received",
+                            f"{len(allocation.fulfilled)} pending request(s) fulfilled with {allocation.units} units. "
+                            f"{allocation.remaining} units of {allocation.blood_type} left in stock.")
+
+    def receive_stock():
+        db.submit(allocator.receive_stock, var_receive_type.get(), entry_receive_quantity.get(),
+                  expires_on=entry_receive_expiry.get().strip() or None,
+                  write=True, callback=received, error_callback=show_error)
+
+    tk.Button(receive_frame, text="Add to Stock", command=receive_stock, font=("abadi", 10, "bold")).grid(row=0, column=5, padx=5)
+
+# Function to display blood request details
+@metrics.timed("gui.display_blood_request_details")
+def display_blood_request_details():
+    request_window = tk.Toplevel(root)
+    request_window.title("Blood Request Details")
+
+    # Paged treeview with sort (click a heading) and filters, all done in SQL
+    tree = PagedTreeview(request_window, "blood_requests", [
+        ("request_id", "Request ID", 70),
+        ("requestor_name", "Requestor Name", 150),
+        ("contact_number", "Contact", 100),
+        ("email_address", "Email", 200),
+        ("blood_type_required", "Blood Type", 100),
+        ("quantity_needed", "Quantity", 80),
+        ("urgency", "Urgency", 100),
+        ("patient_name", "Patient Name", 100),
+        ("datetime", "Datetime", 150),
+        ("status", "Status", 100),
+    ], filters={
+        "blood_type": ("Blood Type", BLOOD_TYPES),
+        "status": ("Status", REQUEST_STATUSES),
+        "urgency": ("Urgency", URGENCY_LEVELS),
+    }, worker=db)
+
+    # Place the treeview in the window using grid layout
+    tree.grid(row=0, column=0, padx=10, pady=10, sticky='nsew')
+
+    # make the window size adjustable
+    request_window.grid_rowconfigure(0, weight=1)
+    request_window.grid_columnconfigure(0, weight=1)
+
+# Reporting window: requests per day, fulfilment rate and time to fulfil,
+# read from the rollup tables
+@metrics.timed("gui.display_reports")
+def display_reports():
+    import reports
+
+    report_window = tk.Toplevel(root)
+    report_window.title("Reports")
+
+    range_frame = tk.Frame(report_window)
+    range_frame.grid(row=0, column=0, columnspan=2, padx=10, pady=10, sticky="w")
+    start, end = reports.date_range()
+    entries = []
+    for position, (label, value) in enumerate((("From (YYYY-MM-DD):", start), ("To:", end))):
+        tk.Label(range_frame, text=label).grid(row=0, column=position * 2, padx=(0, 5))
+        entry = tk.Entry(range_frame, width=12, bg="lightgrey", font=("abadi", 10))
+        entry.insert(0, value)
+        entry.grid(row=0, column=position * 2 + 1, padx=(0, 15))
+        entries.append(entry)
+
+    def table(row, column, title, headings, height):
+        frame = tk.LabelFrame(report_window, text=title, font=("abadi", 10, "bold"))
+        frame.grid(row=row, column=column, padx=10, pady=(0, 10), sticky="nsew")
+        tree = ttk.Treeview(frame, columns=[text for text, _ in headings], show="headings", height=height)
+        for text, width in headings:
+            tree.heading(text, text=text)
+            tree.column(text, width=width, anchor="center")
+        scrollbar = tk.Scrollbar(frame, orient="vertical", command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        tree.pack(side="left", fill="both", expand=True)
+        scrollbar.pack(side="right", fill="y")
+        return tree
+
+    per_day_tree = table(1, 0, "Requests per day", [("Day", 100), ("Blood Type", 80), ("Requests", 80),
+                                                    ("Units", 70)], 18)
+    rate_tree = table(1, 1, "Fulfilment rate", [("Blood Type", 80), ("Requests", 80), ("Fulfilled", 80),
+                                                ("Rate", 70)], 8)
+    time_tree = table(2, 1, "Time to fulfil", [("Urgency", 80), ("Fulfilled", 80), ("Average", 100)], 3)
+
+    def show_report(report):
+        for tree in (per_day_tree, rate_tree, time_tree):
+            tree.delete(*tree.get_children())
+        for row in report.per_day:
+            per_day_tree.insert("", "end", values=row)
+        for row in report.rates:
+            rate_tree.insert("", "end", values=(row.blood_type, row.requests, row.fulfilled, f"{row.rate:.1%}"))
+        for row in report.times:
+            time_tree.insert("", "end", values=(row.urgency, row.fulfilled, f"{row.average_seconds / 3600:.1f} h"))
+
+    def refresh_report():
+        db.submit(reports.summary, entries[0].get().strip(), entries[1].get().strip(),
+                  callback=show_report, error_callback=show_error)
+
+    tk.Button(range_frame, text="Show", command=refresh_report, font=("abadi", 10, "bold")).grid(row=0, column=4)
+    report_window.grid_rowconfigure(1, weight=1)
+    report_window.grid_columnconfigure(0, weight=1)
+    refresh_report()
+
+# Function to show the form (built the first time it is picked)
+def show_donor_registration_form():
+    if "donor" not in built_forms:
+        build_donor_form()
+    blood_request_form_frame.grid_forget()  # Hide the blood request form
+    donor_form_frame.grid(row=1, column=0, sticky="nsew")#padx=10, #pady=10)  # Show the donor form
+
+def show_blood_request_form():
+    if "request" not in built_forms:
+        build_blood_request_form()
+    donor_form_frame.grid_forget()  # Hide the donor registration form
+    blood_request_form_frame.grid(row=1, column=0,sticky="nsew") #padx=10, pady=10)  # Show the blood request form
+
+# Background cache file for a screen size. The name changes with the
+# picture, so an edited b5.jpg is scaled again too.
+def background_cache_path(width, height, source=BACKGROUND_IMAGE):
+    stat = os.stat(source)
+    return os.path.join(BACKGROUND_CACHE, f"background-{width}x{height}-{stat.st_size}-{stat.st_mtime_ns}.ppm")
+
+
+# Scale the picture to the screen and write it to the cache, removing the
+# copies made for other resolutions. Runs off the Tk thread.
+def scale_background(source, path, width, height):
+    from PIL import Image
+    image = Image.open(source).convert("RGB").resize((width, height), Image.LANCZOS)
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    image.save(temporary, "PPM")
+    os.replace(temporary, path)
+    for name in os.listdir(directory):
+        if name.startswith("background-") and name.endswith(".ppm") and os.path.join(directory, name) != path:
+            os.remove(os.path.join(directory, name))
+
+
+def show_background(path):
+    global bg_photo
+    try:
+        bg_photo = tk.PhotoImage(file=path)
+    except tk.TclError:
+        os.remove(path)     # unreadable: scaled again on the next start
+        return
+    canvas.itemconfigure(bg_item, image=bg_photo)
+
+
+# Show the cached background. On a cache miss the window opens on a plain
+# background while the picture is scaled on a thread, and the picture appears
+# when it is ready. Without PIL or the picture the background stays plain.
+def load_background():
+    global background_source, background_thread
+    width, height = root.winfo_screenwidth(), root.winfo_screenheight()
+    try:
+        path = background_cache_path(width, height)
+    except OSError:
+        return
+    if os.path.exists(path):
+        background_source = "cache"
+        show_background(path)
+        return
+
+    def scale():
+        global background_source
+        try:
+            scale_background(BACKGROUND_IMAGE, path, width, height)
+        except Exception as error:      # no PIL, or a picture it cannot read
+            background_source = f"plain ({type(error).__name__}: {error})"
+
+    def show_when_scaled():
+        if background_thread.is_alive():
+            root.after(50, show_when_scaled)
+        elif os.path.exists(path):
+            show_background(path)
+
+    background_source = "scaled"
+    background_thread = threading.Thread(target=scale, name="bloodlink-background", daemon=True)
+    background_thread.start()
+    root.after(50, show_when_scaled)
+
+
+# Main Tkinter window
+def build_main_window():
+    global root, bg_item, canvas, scrollable_frame, donor_form_frame, blood_request_form_frame, var_form_selection
+    root = tk.Tk()
+    root.title('"Blood Link" – Blood donation and request management platform')
+    root.geometry("800x600")
+
+    # Status bar with the database worker's queue depth and latency
+    global status_bar
+    status_bar = tk.Label(root, anchor="w", font=("abadi", 9), fg="grey")
+    status_bar.pack(side="bottom", fill="x")
+
+    canvas = tk.Canvas(root, width=200, height=200)
+    canvas.pack(fill="both", expand=True)
+    bg_item = canvas.create_image(0, 0, anchor="nw")
+    load_background()
+
+    # Create a scrollable frame for long forms
+    scrollable_frame = tk.Frame(canvas, bg="white")
+    scrollbar = tk.Scrollbar(root, orient="vertical", command=canvas.yview)
+    canvas.configure(yscrollcommand=scrollbar.set)
+
+    scrollbar.pack(side="right", fill="y")
+    canvas.pack(side="left", fill="both", expand=True)
+    canvas.create_window((0, 0), window=scrollable_frame, anchor="nw")
+
+    scrollable_frame.bind("<Configure>", lambda e: canvas.configure(scrollregion=canvas.bbox("all")))
+
+    # Create frames for the forms
+    donor_form_frame = tk.Frame(scrollable_frame, bg="white")  # Donor registration form frame
+    blood_request_form_frame = tk.Frame(scrollable_frame, bg="white")  # Blood request form frame
+
+    # Radio button for form selection
+    var_form_selection = tk.StringVar()
+    tk.Label(scrollable_frame, text="Select the form type", font=("georgia", 14, "bold")).grid(row=0,column=0,padx=10,pady=5)
+    tk.Radiobutton(scrollable_frame, text="Donor Registration", variable=var_form_selection, value="donor",
+                   command=show_donor_registration_form, font=("georgia", 14,"bold")).grid(row=0, column=1, padx=10, pady=5, sticky="w")
+    tk.Radiobutton(scrollable_frame, text="Blood Request", variable=var_form_selection, value="request",
+                   command=show_blood_request_form, font=("georgia", 14,"bold")).grid(row=0, column=2, padx=10, pady=5, sticky="w")
+
+    scrollable_frame.grid_columnconfigure(0, weight=1, uniform="equal")
+    scrollable_frame.grid_columnconfigure(1, weight=1, uniform="equal")
+    scrollable_frame.grid_columnconfigure(2, weight=1, uniform="equal")
+
+
+# Donor Registration Form Fields
+@metrics.timed("gui.build_donor_form")
+def build_donor_form():
+    global entry_name, var_gender, entry_dob, var_blood_type, entry_address, entry_contact, entry_email, entry_nationality
+    global var_transfusion, var_chronic_illness, var_allergies, var_surgeries, var_medication, var_high_risk
+    global var_donated_before, entry_last_donation, entry_emergency_contact_name, entry_emergency_contact_number, var_consent
+    built_forms.add("donor")
+    tk.Label(donor_form_frame, text="Full Name:*",bg="white", font=("abadi", 10,"bold")).grid(row=1, column=0, sticky="w", pady=5)
+    entry_name = tk.Entry(donor_form_frame, width=30, bg="lightgrey", font=("abadi", 10))
+    entry_name.grid(row=1, column=1, pady=5)
+
+    tk.Label(donor_form_frame, text="Gender:*",bg="white", font=("abadi", 10,"bold")).grid(row=2, column=0, sticky="w", pady=5)
+    var_gender = tk.StringVar()
+    gender_menu = ttk.Combobox(donor_form_frame, textvariable=var_gender, values=["Male", "Female", "Other"],
+                               state="readonly")
+    gender_menu.grid(row=2, column=1, pady=5)
+
+    tk.Label(donor_form_frame, text="Date of Birth (YYYY-MM-DD):*",bg="white", font=("abadi", 10,"bold")).grid(row=3, column=0, sticky="w", pady=5)
+    entry_dob = tk.Entry(donor_form_frame, width=30,bg="lightgrey", font=("abadi", 10))
+    entry_dob.grid(row=3, column=1, pady=5)
+
+    tk.Label(donor_form_frame, text="Blood Type:*",bg="white", font=("abadi", 10,"bold")).grid(row=4, column=0, sticky="w", pady=5)
+    var_blood_type = tk.StringVar()
+    blood_type_menu = ttk.Combobox(donor_form_frame, textvariable=var_blood_type,
+                                   values=BLOOD_TYPES, state="readonly")
+    blood_type_menu.grid(row=4, column=1, pady=5)
+
+    tk.Label(donor_form_frame, text="Address:",bg="white", font=("abadi", 10,"bold")).grid(row=5, column=0, sticky="w", pady=5)
+    entry_address = tk.Entry(donor_form_frame, width=30,bg="lightgrey", font=("abadi", 10))
+    entry_address.grid(row=5, column=1, pady=5)
+
+    tk.Label(donor_form_frame, text="Contact Number:*", bg="white", font=("abadi", 10,"bold")).grid(row=6, column=0, sticky="w", pady=5)
+    entry_contact = tk.Entry(donor_form_frame, width=30,bg="lightgrey", font=("abadi", 10))
+    entry_contact.grid(row=6, column=1, pady=5)
+
+    tk.Label(donor_form_frame, text="Email Address:*",bg="white", font=("abadi", 10,"bold")).grid(row=7, column=0, sticky="w", pady=5)
+    entry_email = tk.Entry(donor_form_frame, width=30,bg="lightgrey", font=("abadi", 10))
+    entry_email.grid(row=7, column=1, pady=5)
+
+    tk.Label(donor_form_frame, text="Nationality:*",bg="white", font=("abadi", 10,"bold")).grid(row=8, column=0, sticky="w", pady=5)
+    entry_nationality = tk.Entry(donor_form_frame, width=30,bg="lightgrey", font=("abadi", 10))
+    entry_nationality.grid(row=8, column=1, pady=5)
+
+    tk.Label(donor_form_frame, text="Medical History:", bg="white", font=("abadi", 10,"bold")).grid(row=9, column=0, sticky="w", pady=5)
+    var_transfusion = tk.IntVar()
+    var_chronic_illness = tk.IntVar()
+    var_allergies = tk.IntVar()
+    var_surgeries = tk.IntVar()
+    var_medication = tk.IntVar()
+    var_high_risk = tk.IntVar()
+
+    tk.Checkbutton(donor_form_frame, text="Have you ever had a blood transfusion?", variable=var_transfusion,bg="white", font=("abadi", 10)).grid(row=10,
+                                                                                                                   column=0,
+                                                                                                                   columnspan=2,
+                                                                                                                   sticky="w",
+                                                                                                                   pady=2)
+    tk.Checkbutton(donor_form_frame, text="Do you have any chronic illnesses?", variable=var_chronic_illness,bg="white", font=("abadi", 10)).grid(row=11,
+                                                                                                                   column=0,
+                                                                                                                   columnspan=2,
+                                                                                                                   sticky="w",
+                                                                                                                   pady=2)
+    tk.Checkbutton(donor_form_frame, text="Do you have any known allergies?", variable=var_allergies,bg="white", font=("abadi", 10)).grid(row=12, column=0,
+                                                                                                           columnspan=2,
+                                                                                                           sticky="w",
+                                                                                                           pady=2)
+    tk.Checkbutton(donor_form_frame, text="Have you had any surgeries in the last 12 months?", variable=var_surgeries,bg="white", font=("abadi", 10)).grid(
+        row=13, column=0, columnspan=2, sticky="w", pady=2)
+    tk.Checkbutton(donor_form_frame, text="Are you currently on any medication?", variable=var_medication,bg="white", font=("abadi", 10)).grid(row=14,
+                                                                                                                column=0,
+                                                                                                                columnspan=2,
+                                                                                                                sticky="w",
+                                                                                                                pady=2)
+    tk.Checkbutton(donor_form_frame, text="Do you have a history of high-risk behavior?", variable=var_high_risk,bg="white", font=("abadi", 10)).grid(
+        row=15, column=0, columnspan=2, sticky="w", pady=2)
+
+    tk.Label(donor_form_frame, text="Donor History:",bg="white", font=("abadi", 10,"bold")).grid(row=16, column=0, sticky="w", pady=5)
+    var_donated_before = tk.IntVar()
+    tk.Checkbutton(donor_form_frame, text="Have you donated blood before?", variable=var_donated_before,bg="white", font=("abadi", 10)).grid(row=17,
+                                                                                                              column=0,
+                                                                                                              columnspan=2,
+                                                                                                              sticky="w",
+                                                                                                              pady=2)
+    tk.Label(donor_form_frame, text="When was your last blood donation? (YYYY-MM-DD):",bg="white", font=("abadi", 10)).grid(row=18, column=0, sticky="w", pady=2)
+    entry_last_donation = tk.Entry(donor_form_frame, width=30,bg="lightgrey")
+    entry_last_donation.grid(row=18, column=1, pady=2)
+
+    tk.Label(donor_form_frame, text="Emergency Contact Information:",bg="white", font=("abadi", 10, "bold")).grid(row=19, column=0, sticky="w", pady=5)
+    tk.Label(donor_form_frame, text="Name:*", bg="white", font=("abadi", 10)).grid(row=20, column=0, sticky="w", pady=2)
+    entry_emergency_contact_name = tk.Entry(donor_form_frame, width=30,bg="lightgrey", font=("abadi", 10))
+    entry_emergency_contact_name.grid(row=20, column=1, pady=2)
+
+    tk.Label(donor_form_frame, text="Contact Number:*",bg="white", font=("abadi", 10)).grid(row=21, column=0, sticky="w", pady=2)
+    entry_emergency_contact_number = tk.Entry(donor_form_frame, width=30,bg="lightgrey", font=("abadi", 10))
+    entry_emergency_contact_number.grid(row=21, column=1, pady=2)
+
+    var_consent = tk.IntVar()
+    tk.Checkbutton(donor_form_frame, text="I consent to donate blood and acknowledge the risks.",
+                   variable=var_consent,bg="white", font=("abadi", 10, "bold")).grid(row=22, column=0, columnspan=2, sticky="w", pady=5)
+
+    tk.Label(donor_form_frame, text="* - Required fields",bg="white", font=("abadi", 10)).grid(row=23, column=0, sticky="w", pady=2)
+    # Submit Button
+    tk.Button(donor_form_frame, text="Submit", command=submit_donor,bg="lightgrey", font=("abadi", 10,"bold")).grid(row=24, column=0, columnspan=2, pady=10)
+
+    tk.Button(donor_form_frame, text="Display Donors", command = display_donors, font=("abadi", 10,"bold")).grid(row=25, column=0, columnspan=2, pady=10)
+
+
+# Blood Request Form Fields
+@metrics.timed("gui.build_blood_request_form")
+def build_blood_request_form():
+    global entry_requestor_name, entry_organization_name, entry_requestor_contact, entry_requestor_email
+    global var_blood_type_request, entry_quantity_needed, var_urgency, var_purpose
+    global entry_patient_name, entry_patient_age, entry_patient_condition, entry_special_requirements, var_approval
+    built_forms.add("request")
+    tk.Label(blood_request_form_frame, text="Requestor Name:*",bg="white", font=("abadi", 10, "bold")).grid(row=1, column=0, sticky="w", pady=5)
+    entry_requestor_name = tk.Entry(blood_request_form_frame, width=30,bg="lightgrey", font=("abadi", 10))
+    entry_requestor_name.grid(row=1, column=1, pady=5)
+
+    tk.Label(blood_request_form_frame, text="Organization Name (if applicable):",bg="white", font=("abadi", 10, "bold")).grid(row=2, column=0, sticky="w", pady=5)
+    entry_organization_name = tk.Entry(blood_request_form_frame, width=30,bg="lightgrey", font=("abadi", 10))
+    entry_organization_name.grid(row=2, column=1, pady=5)
+
+    tk.Label(blood_request_form_frame, text="Contact Number:*",bg="white", font=("abadi", 10, "bold")).grid(row=3, column=0, sticky="w", pady=5)
+    entry_requestor_contact = tk.Entry(blood_request_form_frame, width=30,bg="lightgrey", font=("abadi", 10))
+    entry_requestor_contact.grid(row=3, column=1, pady=5)
+
+    tk.Label(blood_request_form_frame, text="Email Address:*",bg="white", font=("abadi", 10, "bold")).grid(row=4, column=0, sticky="w", pady=5)
+    entry_requestor_email = tk.Entry(blood_request_form_frame, width=30,bg="lightgrey", font=("abadi", 10))
+    entry_requestor_email.grid(row=4, column=1, pady=5)
+
+    tk.Label(blood_request_form_frame, text="Blood Type Required:*",bg="white", font=("abadi", 10, "bold")).grid(row=5, column=0, sticky="w", pady=5)
+    var_blood_type_request = tk.StringVar()
+    blood_type_request_menu = ttk.Combobox(blood_request_form_frame, textvariable=var_blood_type_request,
+                                             values=BLOOD_TYPES, state="readonly")
+    blood_type_request_menu.grid(row=5, column=1, pady=5)
+
+    tk.Label(blood_request_form_frame, text="Quantity of Blood Needed:*",bg="white", font=("abadi", 10, "bold")).grid(row=6, column=0, sticky="w", pady=5)
+    entry_quantity_needed = tk.Entry(blood_request_form_frame, width=30,bg="lightgrey", font=("abadi", 10))
+    entry_quantity_needed.grid(row=6, column=1, pady=5)
+
+    tk.Label(blood_request_form_frame, text="Urgency:*",bg="white", font=("abadi", 10, "bold")).grid(row=7, column=0, sticky="w", pady=5)
+    var_urgency = tk.StringVar()
+    urgency_menu = ttk.Combobox(blood_request_form_frame, textvariable=var_urgency, values=URGENCY_LEVELS,
+                                 state="readonly")
+    urgency_menu.grid(row=7, column=1, pady=5)
+
+    tk.Label(blood_request_form_frame, text="Purpose of the Request:",bg="white", font=("abadi", 10, "bold")).grid(row=8, column=0, sticky="w", pady=5)
+    var_purpose = tk.StringVar()
+    purpose_menu = ttk.Combobox(blood_request_form_frame, textvariable=var_purpose,
+                                 values=["Medical Procedure", "Emergency", "Chronic Condition"], state="readonly")
+    purpose_menu.grid(row=8, column=1, pady=5)
+
+    tk.Label(blood_request_form_frame, text="Patient Name:*",bg="white", font=("abadi", 10, "bold")).grid(row=9, column=0, sticky="w", pady=5)
+    entry_patient_name = tk.Entry(blood_request_form_frame, width=30,bg="lightgrey", font=("abadi", 10))
+    entry_patient_name.grid(row=9, column=1, pady=5)
+
+    tk.Label(blood_request_form_frame, text="Patient Age:*",bg="white", font=("abadi", 10, "bold")).grid(row=10, column=0, sticky="w", pady=5)
+    entry_patient_age = tk.Entry(blood_request_form_frame, width=30,bg="lightgrey", font=("abadi", 10))
+    entry_patient_age.grid(row=10, column=1, pady=5)
+
+    tk.Label(blood_request_form_frame, text="Patient Condition:*",bg="white", font=("abadi", 10, "bold")).grid(row=11, column=0, sticky="w", pady=5)
+    entry_patient_condition = tk.Entry(blood_request_form_frame, width=30,bg="lightgrey", font=("abadi", 10))
+    entry_patient_condition.grid(row=11, column=1, pady=5)
+
+    tk.Label(blood_request_form_frame, text="Special Requirements or Notes:",bg="white", font=("abadi", 10, "bold")).grid(row=13, column=0, sticky="w", pady=5)
+    entry_special_requirements = tk.Entry(blood_request_form_frame, width=30,bg="lightgrey", font=("abadi", 10))
+    entry_special_requirements.grid(row=13, column=1, pady=5)
+
+    tk.Label(blood_request_form_frame, text="Approval/Authorization:*",bg="white", font=("abadi", 10, "bold")).grid(row=14, column=0, sticky="w", pady=5)
+    var_approval = tk.IntVar()
+    tk.Checkbutton(blood_request_form_frame, text="Request authorized by medical professional.", variable=var_approval,bg="white", font=("abadi", 10, "bold")).grid(
+        row=14, column=1, pady=5)
+
+    tk.Label(blood_request_form_frame, text="* - Required fields",bg="white", font=("abadi", 10)).grid(row=15, column=0, sticky="w", pady=2)
+    tk.Button(blood_request_form_frame, text="Submit Blood Request", command=submit_blood_request,bg="lightgrey", font=("abadi", 10,"bold")).grid(row=16, column=0, columnspan=2, pady=20)
+
+    # Add buttons under the blood request form
+    tk.Button(blood_request_form_frame, text="Display Blood Stock", command=display_blood_stock, font=("abadi", 10,"bold")).grid(row=17, column=0, columnspan=2, pady=10)
+    tk.Button(blood_request_form_frame, text="Display Blood Request Details", command=display_blood_request_details, font=("abadi", 10,"bold")).grid(row=18, column=0, columnspan=2, pady=10)
+    tk.Button(blood_request_form_frame, text="Reports", command=display_reports, font=("abadi", 10,"bold")).grid(row=19, column=0, columnspan=2, pady=10)
+
+
+# Refresh the status bar once a second
+def update_status():
+    stats = db.stats()
+    status_bar.config(text=f"Database queue: {stats['queue_depth']}   "
+                           f"latency avg {stats['avg_latency_ms']:.1f} ms, max {stats['max_latency_ms']:.1f} ms   "
+                           f"writes per commit {stats['writes_per_commit']:.1f}")
+    root.after(1000, update_status)
+
+
+def mark(phase):
+    startup[phase] = time.perf_counter() - STARTED
+
+
+# --startup-time: once the window is on screen, print the startup phases and
+# what building the forms up front would have added, then quit
+def report_startup():
+    root.wait_visibility(root)
+    root.update_idletasks()
+    mark("first_frame")
+    lines = [f"  {phase:<14} {seconds * 1000:8.1f} ms" for phase, seconds in startup.items()]
+    lines.append(f"  background     {background_source}")
+    if background_thread is not None:
+        background_thread.join()
+        mark("background_scaled")
+        lines.append(f"  scaled after   {startup['background_scaled'] * 1000:8.1f} ms (cached for the next start)")
+    for name, build in (("donor form", build_donor_form), ("request form", build_blood_request_form)):
+        started = time.perf_counter()
+        build()
+        root.update_idletasks()
+        lines.append(f"  {name:<14} {(time.perf_counter() - started) * 1000:8.1f} ms (deferred until picked)")
+    print("Startup, from module import:\n" + "\n".join(lines))
+    root.destroy()
+
+
+def run_gui(args=None):
+    global db
+    build_main_window()
+    mark("window")
+
+    db = DatabaseWorker(engine.DB_PATH)
+    db.poll(root)
+    update_status()
+    sweeper = expiry.start_sweeper(engine.DB_PATH)
+    mark("database")
+    if getattr(args, "startup_time", False):
+        root.after_idle(report_startup)
+
+    # Run the Tkinter loop
+    root.mainloop()
+    sweeper.stop()
+    db.stop()
+
+
+# Command line: no command starts the GUI, the others run headless
+def run_import(args):
+    import importer
+
+    result = importer.import_donors(args.file, reject_path=args.rejects, fmt=args.format,
+                                    batch_size=args.batch_size)
+    print(f"Imported {result.accepted} donors, rejected {result.rejected} "
+          f"in {result.seconds:.2f}s ({result.rows_per_sec:,.0f} rows/s)")
+
+
+def run_export(args):
+    import exporter
+
+    filters = {"blood_type": args.blood_type, "status": args.status, "urgency": args.urgency, "kind": args.kind}
+    result = exporter.export_table(args.table, args.file, args.start, args.end, filters, fmt=args.format,
+                                   compress=args.gzip or None, batch_size=args.batch_size)
+    print(f"Exported {result.rows} rows of {args.table} to {args.file} "
+          f"in {result.seconds:.2f}s ({result.rows_per_sec:,.0f} rows/s)")
+
+
+def run_receive(args):
+    allocation = allocator.receive_stock(args.blood_type, args.units, collected_on=args.collected_on,
+                                         expires_on=args.expires_on)
+    print(f"Fulfilled {len(allocation.fulfilled)} pending request(s) with {allocation.units} units, "
+          f"{allocation.remaining} units of {allocation.blood_type} left")
+
+
+def run_expire(args):
+    retired = expiry.expire_lots()
+    print(f"Retired {sum(retired.values())} expired units"
+          + "".join(f", {units} {blood_type}" for blood_type, units in sorted(retired.items())))
+
+
+def run_network(args):
+    import federation
+
+    argv = [engine.DB_PATH, *args.databases, "--quantity", str(args.quantity), "--urgency", args.urgency]
+    federation.main(argv + (["--blood-type", args.blood_type] if args.blood_type else []))
+
+
+def run_report(args):
+    import reports
+
+    if args.rebuild:
+        print(f"Rebuilt {reports.rebuild_rollups()} rollup rows")
+    report = reports.summary(args.start, args.end)
+    print(f"Requests from {report.start} to {report.end}")
+    for row in report.rates:
+        print(f"  {row.blood_type:<4} {row.requests:>7} requests  {row.fulfilled:>7} fulfilled  {row.rate:6.1%}")
+    for row in report.times:
+        print(f"  {row.urgency:<8} {row.fulfilled:>7} fulfilled in {row.average_seconds / 3600:.1f} h on average")
+
+
+def run_forecast(args):
+    try:
+        import forecast
+    except ImportError:
+        raise SystemExit("Forecasts need NumPy: pip install numpy")
+
+    reorders = forecast.forecast(history_days=args.history_days, average_days=args.average_days,
+                                 lead_days=args.lead_days)
+    print(f"{'Type':<5}{'Stock':>7}{'Per day':>9}{f'{args.lead_days} days':>9}{'Safety':>8}{'Reorder at':>12}"
+          f"{'Cover':>8}")
+    for row in reorders:
+        cover = f"{row.days_of_cover:.1f} d" if row.days_of_cover is not None else "-"
+        print(f"{row.blood_type:<5}{row.stock:>7}{row.daily_demand:>9.1f}{row.lead_demand:>9.1f}"
+              f"{row.safety_stock:>8.1f}{row.reorder_point:>12}{cover:>8}" + ("  REORDER" if row.reorder else ""))
+
+
+def run_archive(args):
+    import archive
+
+    if args.vacuum:
+        print("Rewriting the database for incremental vacuum...")
+        archive.vacuum()
+    result = archive.archive_requests(args.older_than, path=args.archive, batch_size=args.batch_size)
+    print(f"Archived {result.moved} fulfilled requests in {result.batches} batches to "
+          f"{args.archive or archive.archive_path()}, freed {result.pages_freed} pages in {result.seconds:.2f}s")
+
+
+def run_callouts(args):
+    import callouts
+
+    if args.smtp:
+        host, _, port = args.smtp.partition(":")
+        transport = callouts.SMTPTransport(host, int(port or 25), args.sender)
+    else:
+        transport = callouts.FileTransport(args.file)
+    if args.once:
+        result = callouts.drain(transport, limiter=callouts.RateLimiter(args.rate))
+        print(f"Sent {result.sent} call-outs for {result.events} requests, {result.failed} failed")
+        return
+    dispatcher = callouts.Dispatcher(transport, engine.DB_PATH, args.workers, args.rate).start()
+    print(f"Sending donor call-outs with {args.workers} workers, Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        dispatcher.stop()
+        print(dispatcher.stats())
+
+
+def run_backup(args):
+    import backup
+
+    if args.list:
+        for snapshot in backup.list_snapshots(args.dir):
+            print(f"{snapshot.taken_at:%Y-%m-%d %H:%M:%S}  {snapshot.size / 2**20:9.1f} MB  {snapshot.path}")
+        return
+    if args.verify:
+        problems = backup.verify(args.verify)
+        print(f"{args.verify}: " + ("ok" if not problems else "; ".join(problems)))
+        return
+    if args.every:
+        scheduler = backup.start_scheduler(engine.DB_PATH, args.every, args.dir, args.keep)
+        print(f"Taking a snapshot every {args.every:g} minutes, keeping {args.keep}, Ctrl+C to stop")
+        try:
+            scheduler.join()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            scheduler.stop()
+        return
+    result = backup.snapshot(directory=args.dir, keep=args.keep, pages=args.pages)
+    print(f"Backed up {result.bytes / 2**20:.1f} MB to {result.path} in {result.seconds:.2f}s "
+          f"({result.bytes_per_sec / 2**20:,.1f} MB/s, {result.steps} steps, longest lock "
+          f"{result.max_lock_seconds * 1000:.1f} ms, {result.restarts} restarts), checked in "
+          f"{result.check_seconds:.2f}s")
+
+
+def run_restore(args):
+    import backup
+
+    result = backup.restore(args.snapshot, args.at, directory=args.dir, keep_current=not args.no_save)
+    if result.saved_as:
+        print(f"Saved the current database as {result.saved_as}")
+    print(f"Restored {engine.DB_PATH} from {result.snapshot} ({result.pages} pages) in {result.seconds:.2f}s, "
+          "check passed")
+
+
+def run_migrate(args):
+    import migrations
+
+    conn = engine.get_connection()
+    print(f"{engine.DB_PATH}: schema version {migrations.get_version(conn)} of {migrations.LATEST_VERSION}")
+
+
+def run_serve(args):
+    import asyncio
+    import service
+
+    try:
+        asyncio.run(service.serve(engine.DB_PATH, args.host, args.port, args.readers, args.callouts,
+                                  args.backup_every))
+    except KeyboardInterrupt:
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Blood Link – blood donation and request management platform")
+    parser.add_argument("--db", help="database file (default: %(default)s)", default=engine.DB_PATH)
+    parser.add_argument("--metrics", help="dump latency histograms and counters to this file "
+                                          "(Prometheus text if it ends in .prom, JSON otherwise)")
+    parser.add_argument("--metrics-interval", type=float, default=60.0, help="seconds between metric dumps")
+    parser.add_argument("--startup-time", action="store_true",
+                        help="open the window, print how long each startup phase took and exit")
+    parser.set_defaults(func=run_gui)
+    commands = parser.add_subparsers(dest="command")
+
+    import_parser = commands.add_parser("import", help="bulk import donors from a CSV or JSONL file")
+    import_parser.add_argument("file")
+    import_parser.add_argument("--rejects", help="write rejected rows and reasons to this CSV file")
+    import_parser.add_argument("--format", choices=["csv", "jsonl"], help="file format (default: from the extension)")
+    import_parser.add_argument("--batch-size", type=int, default=10000)
+    import_parser.set_defaults(func=run_import)
+
+    export_parser = commands.add_parser("export", help="export a table to a CSV or JSONL file")
+    export_parser.add_argument("table", choices=["donors", "blood_requests", "blood_stock", "stock_movements"])
+    export_parser.add_argument("file", help="output file; a name ending in .gz is compressed")
+    export_parser.add_argument("--from", dest="start", help="first day, YYYY-MM-DD (request date, last donation "
+                                                           "or movement date)")
+    export_parser.add_argument("--to", dest="end", help="last day, YYYY-MM-DD")
+    export_parser.add_argument("--blood-type", choices=BLOOD_TYPES)
+    export_parser.add_argument("--status", choices=REQUEST_STATUSES)
+    export_parser.add_argument("--urgency", choices=URGENCY_LEVELS)
+    export_parser.add_argument("--kind", choices=engine.STOCK_MOVEMENT_KINDS, help="stock movement kind")
+    export_parser.add_argument("--format", choices=["csv", "jsonl"], help="file format (default: from the extension)")
+    export_parser.add_argument("--gzip", action="store_true", help="compress whatever the file name")
+    export_parser.add_argument("--batch-size", type=int, default=5000)
+    export_parser.set_defaults(func=run_export)
+
+    receive_parser = commands.add_parser("receive", help="add units to stock and fulfil pending requests")
+    receive_parser.add_argument("blood_type", choices=BLOOD_TYPES)
+    receive_parser.add_argument("units", type=int)
+    receive_parser.add_argument("--collected-on", help="collection date, YYYY-MM-DD (default: today)")
+    receive_parser.add_argument("--expires-on", help="expiry date, YYYY-MM-DD (default: 42 days after collection)")
+    receive_parser.set_defaults(func=run_receive)
+
+    expire_parser = commands.add_parser("expire", help="write off units past their expiry date")
+    expire_parser.set_defaults(func=run_expire)
+
+    network_parser = commands.add_parser("network", help="stock of this and other site databases")
+    network_parser.add_argument("databases", nargs="*", help="other site database files (NAME=PATH to name a site)")
+    network_parser.add_argument("--blood-type", choices=BLOOD_TYPES, help="show the sites that can fill a request")
+    network_parser.add_argument("--quantity", type=int, default=1)
+    network_parser.add_argument("--urgency", choices=URGENCY_LEVELS, default="Normal")
+    network_parser.set_defaults(func=run_network)
+
+    report_parser = commands.add_parser("report", help="fulfilment rate and time to fulfil from the rollups")
+    report_parser.add_argument("--from", dest="start", help="first day, YYYY-MM-DD (default: 30 days ago)")
+    report_parser.add_argument("--to", dest="end", help="last day, YYYY-MM-DD (default: today)")
+    report_parser.add_argument("--rebuild", action="store_true", help="recompute the rollups from blood_requests first")
+    report_parser.set_defaults(func=run_report)
+
+    forecast_parser = commands.add_parser("forecast", help="demand forecast and reorder points (needs NumPy)")
+    forecast_parser.add_argument("--lead-days", type=int, default=3, help="days until ordered units arrive")
+    forecast_parser.add_argument("--history-days", type=int, default=364, help="days of demand history used")
+    forecast_parser.add_argument("--average-days", type=int, default=28, help="days in the moving average")
+    forecast_parser.set_defaults(func=run_forecast)
+
+    archive_parser = commands.add_parser("archive", help="move old fulfilled requests to the archive database")
+    archive_parser.add_argument("--older-than", type=int, default=180, help="days since the request (default: 180)")
+    archive_parser.add_argument("--archive", help="archive database (default: <database>_archive.db)")
+    archive_parser.add_argument("--batch-size", type=int, default=500)
+    archive_parser.add_argument("--vacuum", action="store_true",
+                                help="first rewrite a database created before incremental vacuum (run once, offline)")
+    archive_parser.set_defaults(func=run_archive)
+
+    callouts_parser = commands.add_parser("callouts", help="call out donors for pending Critical requests")
+    transport = callouts_parser.add_mutually_exclusive_group()
+    transport.add_argument("--file", default="callouts.jsonl", help="append call-outs to this JSONL file (default)")
+    transport.add_argument("--smtp", help="send e-mails through this SMTP server, HOST[:PORT]")
+    callouts_parser.add_argument("--sender", default="bloodlink@localhost", help="From address of the e-mails")
+    callouts_parser.add_argument("--workers", type=int, default=4)
+    callouts_parser.add_argument("--rate", type=float, default=1000.0, help="call-outs per second at most")
+    callouts_parser.add_argument("--once", action="store_true", help="send what is queued and exit")
+    callouts_parser.set_defaults(func=run_callouts)
+
+    backup_parser = commands.add_parser("backup", help="snapshot the database while it is in use")
+    backup_parser.add_argument("--dir", help="snapshot directory (default: backups/ next to the database)")
+    backup_parser.add_argument("--keep", type=int, default=24, help="snapshots kept (default: %(default)s)")
+    backup_parser.add_argument("--pages", type=int, default=1024, help="pages copied per step")
+    backup_parser.add_argument("--every", type=float, help="keep running, one snapshot every this many minutes")
+    backup_parser.add_argument("--list", action="store_true", help="list the snapshots")
+    backup_parser.add_argument("--verify", metavar="FILE", help="check a snapshot or database file")
+    backup_parser.set_defaults(func=run_backup)
+
+    restore_parser = commands.add_parser("restore", help="replace the database with a checked snapshot")
+    restore_parser.add_argument("snapshot", nargs="?", help="snapshot file (default: the newest snapshot)")
+    restore_parser.add_argument("--at", help="the newest snapshot taken at or before this time, "
+                                             "YYYY-MM-DD[ HH:MM]")
+    restore_parser.add_argument("--dir", help="snapshot directory (default: backups/ next to the database)")
+    restore_parser.add_argument("--no-save", action="store_true", help="do not save the current database first")
+    restore_parser.set_defaults(func=run_restore)
+
+    migrate_parser = commands.add_parser("migrate", help="upgrade the database schema in place")
+    migrate_parser.set_defaults(func=run_migrate)
+
+    serve_parser = commands.add_parser("serve", help="run the HTTP/JSON service")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8080)
+    serve_parser.add_argument("--readers", type=int, default=4, help="reader connections in the pool")
+    serve_parser.add_argument("--callouts", help="also call out donors for Critical requests, to this JSONL file")
+    serve_parser.add_argument("--backup-every", type=float, help="also snapshot the database every this many minutes")
+    serve_parser.set_defaults(func=run_serve)
+
+    args = parser.parse_args(argv)
+    engine.set_database(args.db)
+    dump = metrics.start_dump(args.metrics, args.metrics_interval) if args.metrics else None
+    try:
+        args.func(args)
+    except ValidationError as error:
+        parser.exit(1, f"{error.title}: {error.message}\n")
+    finally:
+        if dump:
+            dump.stop()
+
+
+if __name__ == "__main__":
+    main()
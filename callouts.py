@@ -0,0 +1,334 @@
+# Donor call-outs for Critical requests that could not be filled.
+# Saving a Critical request as Pending queues an event in callout_outbox (a
+# trigger, in the same transaction, see migrations.add_callout_outbox), so the
+# submission path only pays for one small insert. A pool of Dispatcher
+# workers drains the outbox: a worker claims an event with a lease, queues a
+# notification for each eligible donor (engine.eligible_donors, less the
+# donors called in the last COOLDOWN_HOURS), and sends them SEND_BATCH at a
+# time through a transport, all workers sharing one rate limit.
+#
+# Each notification row is marked sent as soon as its batch is, so a retry
+# only sends what is left. A failed event is retried with exponential backoff
+# up to MAX_ATTEMPTS times; an event whose worker died is picked up again when
+# its lease runs out. Events for requests fulfilled in the meantime are
+# dropped.
+#
+#   python bloodlink.py callouts --file callouts.jsonl
+#   python bloodlink.py callouts --smtp localhost:1025 --sender bloodbank@example.com --once
+import json
+import smtplib
+import sqlite3
+import threading
+import time
+from email.message import EmailMessage
+from typing import NamedTuple
+
+import engine
+import metrics
+
+CALLOUT_WORKERS = 4
+# Donors called for one request
+CALLOUT_DONORS = 500
+SEND_BATCH = 100
+# Notifications per second over all workers
+RATE_LIMIT = 1000.0
+# A donor called out is not called again for another request within this time
+COOLDOWN_HOURS = 24
+MAX_ATTEMPTS = 5
+RETRY_BACKOFF = 30          # seconds before the first retry, doubled for each one after
+LEASE_SECONDS = 300         # a claimed event is retried after this if its worker does not finish
+POLL_INTERVAL = 1.0
+
+
+class Notification(NamedTuple):
+    request_id: int
+    donor_id: int
+    name: str
+    contact: str
+    email: str
+    blood_type: str         # the donor's blood type
+    text: str
+
+
+class CalloutResult(NamedTuple):
+    events: int
+    sent: int
+    failed: int             # sends that failed (retried later)
+
+
+def message_text(blood_type, quantity):
+    return (f"BloodLink: a patient in critical condition needs {quantity} unit(s) of {blood_type} blood "
+            "and you are eligible to donate. Please contact the blood bank as soon as you can.")
+
+
+# Transports. send(notifications) delivers a batch and returns
+# {donor_id: error message} for the notifications it could not deliver.
+
+# Appends one JSON line per notification to a file, for testing and for
+# handing the call-outs to another system
+class FileTransport:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def send(self, notifications):
+        text = "".join(json.dumps(notification._asdict()) + "\n" for notification in notifications)
+        with self.lock, open(self.path, "a", encoding="utf-8") as file:
+            file.write(text)
+        return {}
+
+
+# E-mail through an SMTP server, one connection per batch (python -m aiosmtpd
+# -n -l localhost:1025, or any local test server, stands in for a real one)
+class SMTPTransport:
+    def __init__(self, host="localhost", port=25, sender="bloodlink@localhost", subject="Urgent: blood needed",
+                 timeout=10):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.subject = subject
+        self.timeout = timeout
+
+    def send(self, notifications):
+        errors = {}
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            for notification in notifications:
+                if not notification.email:
+                    errors[notification.donor_id] = "no e-mail address"
+                    continue
+                message = EmailMessage()
+                message["From"] = self.sender
+                message["To"] = notification.email
+                message["Subject"] = self.subject
+                message.set_content(f"Dear {notification.name},\n\n{notification.text}\n")
+                try:
+                    smtp.send_message(message)
+                except smtplib.SMTPException as error:
+                    errors[notification.donor_id] = str(error)
+        return errors
+
+
+# Token bucket shared by the workers: acquire(n) waits until n sends fit under `rate` per second
+class RateLimiter:
+    def __init__(self, rate=RATE_LIMIT, burst=SEND_BATCH):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, count=1):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                # A batch larger than the burst goes out once the bucket is full
+                needed = min(count, self.burst)
+                if self.tokens >= needed:
+                    self.tokens -= count
+                    return
+                wait = (needed - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# Claim the next due event: its lease is pushed LEASE_SECONDS ahead so no other
+# worker takes it. Returns (event_id, request_id, blood_type, quantity, attempts) or None.
+def claim_event(conn):
+    with engine.write_transaction(conn):
+        return conn.execute('''UPDATE callout_outbox SET attempts = attempts + 1,
+                                      next_attempt_at = datetime('now', ?)
+                               WHERE event_id = (SELECT event_id FROM callout_outbox
+                                                 WHERE status = 'queued' AND next_attempt_at <= datetime('now')
+                                                 ORDER BY next_attempt_at, event_id LIMIT 1)
+                               RETURNING event_id, request_id, blood_type, quantity, attempts''',
+                            (f"+{LEASE_SECONDS} seconds",)).fetchone()
+
+
+# Close an event: 'done', 'cancelled' or 'failed'. Notifications still
+# queued are cancelled so their donors can be called for other requests.
+def finish_event(conn, event, status, error=None):
+    event_id, request_id = event[:2]
+
+    def finish():
+        with engine.write_transaction(conn):
+            conn.execute("UPDATE callout_outbox SET status = ?, last_error = ? WHERE event_id = ?",
+                         (status, error, event_id))
+            conn.execute("UPDATE callout_notifications SET status = 'cancelled' "
+                         "WHERE request_id = ? AND status = 'queued'", (request_id,))
+
+    engine.retry_on_busy(finish)
+
+
+# Back to the queue after a failure, or 'failed' after MAX_ATTEMPTS
+def retry_event(conn, event, error):
+    event_id, attempts = event[0], event[4]
+    if attempts >= MAX_ATTEMPTS:
+        return finish_event(conn, event, "failed", error)
+
+    def retry():
+        with engine.write_transaction(conn):
+            conn.execute("UPDATE callout_outbox SET next_attempt_at = datetime('now', ?), last_error = ? "
+                         "WHERE event_id = ?", (f"+{RETRY_BACKOFF * 2 ** (attempts - 1)} seconds", error, event_id))
+
+    engine.retry_on_busy(retry)
+
+
+# Queue notifications for up to `count` eligible donors, skipping donors
+# called out (or waiting to be) for another request within COOLDOWN_HOURS.
+# When the first donors in line were all called recently the search is
+# widened, up to 16 times `count`. Returns the donors queued for the request.
+def queue_notifications(conn, request_id, blood_type, count=CALLOUT_DONORS):
+    limit = count
+    while True:
+        donors = [row[0] for row in engine.eligible_donors(blood_type, "Critical", limit=limit, conn=conn)]
+        with engine.write_transaction(conn):
+            queued = conn.execute("SELECT COUNT(*) FROM callout_notifications WHERE request_id = ?",
+                                  (request_id,)).fetchone()[0]
+            queued += conn.execute('''INSERT INTO callout_notifications (request_id, donor_id)
+                                      SELECT ?1, value FROM json_each(?2)
+                                      WHERE NOT EXISTS (SELECT 1 FROM callout_notifications
+                                                        WHERE donor_id = value
+                                                        AND (request_id = ?1 OR status = 'queued'
+                                                             OR sent_at > datetime('now', ?3)))
+                                      LIMIT ?4''', (request_id, json.dumps(donors), f"-{COOLDOWN_HOURS} hours",
+                                                   max(count - queued, 0))).rowcount
+        if queued >= count or len(donors) < limit or limit >= count * 16:
+            return queued
+        limit *= 4
+
+
+# Mark a batch of notifications sent, or failed for the donors in errors.
+# The messages are already out: if the marks were lost, the donors would be
+# messaged again when the event's lease runs out, so the write is retried for
+# as long as the database stays busy.
+def record_sends(conn, request_id, batch, errors):
+    def record():
+        with engine.write_transaction(conn):
+            conn.executemany('''UPDATE callout_notifications SET status = 'sent', attempts = attempts + 1,
+                                       sent_at = CURRENT_TIMESTAMP, last_error = NULL
+                                WHERE request_id = ? AND donor_id = ?''',
+                             [(request_id, notification.donor_id) for notification in batch
+                              if notification.donor_id not in errors])
+            conn.executemany('''UPDATE callout_notifications SET attempts = attempts + 1, last_error = ?,
+                                       status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE status END
+                                WHERE request_id = ? AND donor_id = ?''',
+                             [(error, MAX_ATTEMPTS, request_id, donor_id) for donor_id, error in errors.items()])
+
+    while True:
+        try:
+            return engine.retry_on_busy(record)
+        except sqlite3.OperationalError as error:
+            if not engine.is_busy_error(error):
+                raise
+
+
+# Send the queued notifications of a request once each, in batches.
+# Returns (sent, failed).
+def send_notifications(conn, request_id, text, transport, limiter):
+    sent = failed = 0
+    after = -1
+    while True:
+        rows = conn.execute('''SELECT notification.donor_id, name, contact, email, blood_type
+                               FROM callout_notifications AS notification JOIN donors USING (donor_id)
+                               WHERE request_id = ? AND status = 'queued' AND notification.donor_id > ?
+                               ORDER BY notification.donor_id LIMIT ?''', (request_id, after, SEND_BATCH)).fetchall()
+        if not rows:
+            return sent, failed
+        after = rows[-1][0]
+        batch = [Notification(request_id, *row, text) for row in rows]
+        limiter.acquire(len(batch))
+        with metrics.timer("callouts.send"):
+            try:
+                errors = transport.send(batch)
+            except Exception as error:
+                errors = {notification.donor_id: str(error) or type(error).__name__ for notification in batch}
+        record_sends(conn, request_id, batch, errors)
+        sent += len(batch) - len(errors)
+        failed += len(errors)
+        metrics.rows("callouts.send", len(batch) - len(errors))
+
+
+# Handle one claimed event. Returns (sent, failed).
+@metrics.timed("callouts.event")
+def process_event(conn, event, transport, limiter):
+    _, request_id, blood_type, quantity, _ = event
+    request = conn.execute("SELECT status FROM blood_requests WHERE request_id = ?", (request_id,)).fetchone()
+    if request is None or request[0] != "Pending":
+        finish_event(conn, event, "cancelled")
+        return 0, 0
+    engine.retry_on_busy(lambda: queue_notifications(conn, request_id, blood_type))
+    sent, failed = send_notifications(conn, request_id, message_text(blood_type, quantity), transport, limiter)
+    if failed:
+        retry_event(conn, event, f"{failed} notification(s) could not be sent")
+    else:
+        finish_event(conn, event, "done")
+    return sent, failed
+
+
+# Process due events on conn until there are none left (or `stopped` is set)
+def drain(transport, conn=None, limiter=None, stopped=None) -> CalloutResult:
+    conn = conn or engine.get_connection()
+    limiter = limiter or RateLimiter()
+    events = sent = failed = 0
+    while not (stopped and stopped.is_set()):
+        event = engine.retry_on_busy(lambda: claim_event(conn))
+        if event is None:
+            break
+        event_sent, event_failed = process_event(conn, event, transport, limiter)
+        events += 1
+        sent += event_sent
+        failed += event_failed
+    return CalloutResult(events, sent, failed)
+
+
+# Pool of worker threads draining the outbox, each on its own connection.
+# An idle worker looks for new events every `poll` seconds.
+class Dispatcher:
+    def __init__(self, transport, path=None, workers=CALLOUT_WORKERS, rate=RATE_LIMIT, poll=POLL_INTERVAL):
+        self.transport = transport
+        self.path = path or engine.DB_PATH
+        self.poll = poll
+        self.limiter = RateLimiter(rate)
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.events = self.sent = self.failed = 0
+        self.error = None
+        self.threads = [threading.Thread(target=self.work, name=f"bloodlink-callout-{number}", daemon=True)
+                        for number in range(workers)]
+
+    def work(self):
+        conn = engine.connect(self.path)
+        try:
+            while not self.stopped.is_set():
+                try:
+                    result = drain(self.transport, conn, self.limiter, self.stopped)
+                except Exception as error:
+                    self.error = error
+                else:
+                    with self.lock:
+                        self.events += result.events
+                        self.sent += result.sent
+                        self.failed += result.failed
+                self.stopped.wait(self.poll)
+        finally:
+            conn.close()
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        for thread in self.threads:
+            thread.join()
+
+    def stats(self):
+        with self.lock:
+            return {"workers": len(self.threads), "events": self.events, "sent": self.sent, "failed": self.failed,
+                    "error": str(self.error) if self.error else None}
+
+
+def start_dispatcher(transport, path=None, workers=CALLOUT_WORKERS):
+    return Dispatcher(transport, path, workers).start()
@@ -0,0 +1,82 @@
+# ABO/Rh red cell compatibility and the substitution policy.
+# Everything is precomputed when the module is imported: a bitmask of the
+# donor types each recipient can receive, and for every (recipient, urgency,
+# policy) the ordered list of donor types to try. Picking the donor type for a
+# request is then a table lookup plus at most eight stock comparisons.
+from functools import lru_cache
+from typing import NamedTuple
+
+BLOOD_TYPES = ["A+", "A-", "B+", "B-", "O+", "O-", "AB+", "AB-"]
+BIT = {blood_type: 1 << index for index, blood_type in enumerate(BLOOD_TYPES)}
+
+
+def _can_give(donor, recipient):
+    donor_abo, donor_rh = donor[:-1], donor[-1]
+    recipient_abo, recipient_rh = recipient[:-1], recipient[-1]
+    abo_ok = donor_abo == "O" or donor_abo == recipient_abo or recipient_abo == "AB"
+    rh_ok = donor_rh == "-" or recipient_rh == "+"
+    return abo_ok and rh_ok
+
+
+# recipient -> bitmask of the donor types whose red cells it can receive
+COMPATIBLE_DONORS = {
+    recipient: sum(BIT[donor] for donor in BLOOD_TYPES if _can_give(donor, recipient))
+    for recipient in BLOOD_TYPES
+}
+
+# How many recipient types a donor type can serve. Substitutes are tried from
+# the least to the most universal, so O- is used last.
+REACH = {donor: sum(1 for recipient in BLOOD_TYPES if COMPATIBLE_DONORS[recipient] & BIT[donor])
+         for donor in BLOOD_TYPES}
+
+
+class Policy(NamedTuple):
+    exact_first: bool = True              # try the requested type before any substitute
+    substitute: bool = True               # allow compatible substitutes at all
+    save_o_negative: bool = True          # keep O- for O- patients and the urgencies below
+    o_negative_for: frozenset = frozenset({"Critical"})
+
+
+DEFAULT_POLICY = Policy()
+EXACT_ONLY = Policy(substitute=False)
+
+
+def can_receive(recipient, donor):
+    return bool(COMPATIBLE_DONORS[recipient] & BIT[donor])
+
+
+def compatible_donors(recipient):
+    return [donor for donor in BLOOD_TYPES if can_receive(recipient, donor)]
+
+
+# Donor types to try for a request, in order of preference
+@lru_cache(maxsize=None)
+def donor_order(recipient, urgency, policy=DEFAULT_POLICY):
+    if not policy.substitute:
+        return (recipient,)
+    donors = compatible_donors(recipient)
+    if policy.save_o_negative and recipient != "O-" and urgency not in policy.o_negative_for:
+        donors.remove("O-")
+    donors.sort(key=lambda donor: (not (policy.exact_first and donor == recipient), REACH[donor],
+                                   BLOOD_TYPES.index(donor)))
+    return tuple(donors)
+
+
+# Recipient types that may be given units of donor, each with the urgencies allowed
+@lru_cache(maxsize=None)
+def recipients_of(donor, policy=DEFAULT_POLICY):
+    urgencies = ("Normal", "Urgent", "Critical")
+    recipients = []
+    for recipient in BLOOD_TYPES:
+        allowed = tuple(urgency for urgency in urgencies if donor in donor_order(recipient, urgency, policy))
+        if allowed:
+            recipients.append((recipient, allowed))
+    return tuple(recipients)
+
+
+# First donor type in preference order with at least `quantity` units in stock, or None
+def choose_donor(recipient, urgency, quantity, stock, policy=DEFAULT_POLICY):
+    for donor in donor_order(recipient, urgency, policy):
+        if (stock.get(donor) or 0) >= quantity:
+            return donor
+    return None
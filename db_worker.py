@@ -0,0 +1,151 @@
+# Database worker thread for the Tk client.
+# The Tk event loop never runs SQL itself: it queues a call to an engine
+# function here and gets the result back through a callback. The worker owns
+# its own connection; consecutive write jobs found in the queue are committed
+# together in one transaction (each job in its own savepoint, so one failing
+# job does not undo the others). Results are handed back on a queue that the
+# Tk side drains with after(), since Tk must only be touched from its own thread.
+import queue
+import threading
+import time
+
+import engine
+import metrics
+
+# Most write jobs grouped into one commit
+MAX_GROUP = 64
+
+
+class Job:
+    __slots__ = ("fn", "args", "kwargs", "callback", "error_callback", "write", "queued_at")
+
+    def __init__(self, fn, args, kwargs, callback, error_callback, write):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.callback = callback
+        self.error_callback = error_callback
+        self.write = write
+        self.queued_at = time.perf_counter()
+
+
+class DatabaseWorker:
+    def __init__(self, path=None, max_group=MAX_GROUP):
+        self.path = path
+        self.max_group = max_group
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.held = None              # job taken off the queue while grouping writes
+        self.lock = threading.Lock()
+        self.completed = 0
+        self.failed = 0
+        self.commits = 0
+        self.grouped_writes = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.last_latency = 0.0
+        self.thread = threading.Thread(target=self.run, name="bloodlink-db", daemon=True)
+        self.thread.start()
+
+    # Queue fn(*args, conn=<worker connection>, **kwargs). callback(result) or
+    # error_callback(exception) runs on the thread that calls deliver().
+    def submit(self, fn, *args, callback=None, error_callback=None, write=False, **kwargs):
+        self.jobs.put(Job(fn, args, kwargs, callback, error_callback, write))
+
+    def stop(self):
+        self.jobs.put(None)
+        self.thread.join()
+
+    def run(self):
+        conn = engine.connect(self.path)
+        try:
+            while True:
+                job = self.held or self.jobs.get()
+                self.held = None
+                if job is None:
+                    return
+                if job.write:
+                    self.run_writes(conn, self.take_writes(job))
+                else:
+                    self.finish(job, *self.call(conn, job))
+        finally:
+            conn.close()
+
+    # The first write job plus any further write jobs already waiting
+    def take_writes(self, job):
+        group = [job]
+        while len(group) < self.max_group:
+            try:
+                following = self.jobs.get_nowait()
+            except queue.Empty:
+                break
+            if following is None or not following.write:
+                self.held = following
+                break
+            group.append(following)
+        return group
+
+    def call(self, conn, job):
+        try:
+            return job.fn(*job.args, conn=conn, **job.kwargs), None
+        except Exception as error:
+            return None, error
+
+    def run_writes(self, conn, group):
+        if len(group) == 1:
+            self.finish(group[0], *self.call(conn, group[0]))
+        else:
+            outcomes = engine.run_grouped(conn, [(job.fn, job.args, job.kwargs) for job in group])
+            for job, (result, error) in zip(group, outcomes):
+                self.finish(job, result, error)
+        self.count_commit(len(group))
+
+    def count_commit(self, size):
+        with self.lock:
+            self.commits += 1
+            self.grouped_writes += size
+
+    def finish(self, job, result, error):
+        latency = time.perf_counter() - job.queued_at
+        metrics.observe(metrics.OPERATION_SECONDS, (("operation", f"worker.{job.fn.__name__}"),), latency)
+        with self.lock:
+            self.completed += 1
+            self.failed += error is not None
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            self.last_latency = latency
+        self.results.put((job, result, error))
+
+    # Run the callbacks of finished jobs; call from the Tk thread
+    def deliver(self):
+        while True:
+            try:
+                job, result, error = self.results.get_nowait()
+            except queue.Empty:
+                return
+            if error is not None:
+                if job.error_callback:
+                    job.error_callback(error)
+                else:
+                    raise error
+            elif job.callback:
+                job.callback(result)
+
+    # Drain results every `interval` ms from the Tk event loop
+    def poll(self, widget, interval=30):
+        self.deliver()
+        widget.after(interval, self.poll, widget, interval)
+
+    # Queue depth, latency (queued to finished) and commit grouping figures
+    def stats(self):
+        with self.lock:
+            return {
+                "queue_depth": self.jobs.qsize() + (self.held is not None),
+                "completed": self.completed,
+                "failed": self.failed,
+                "avg_latency_ms": self.total_latency / self.completed * 1000 if self.completed else 0.0,
+                "max_latency_ms": self.max_latency * 1000,
+                "last_latency_ms": self.last_latency * 1000,
+                "commits": self.commits,
+                "writes_per_commit": self.grouped_writes / self.commits if self.commits else 0.0,
+            }
@@ -0,0 +1,856 @@
+# BloodLink engine: the donor and blood request rules without any GUI.
+# Importing this module does not touch Tk, PIL or the database; the
+# connection is opened the first time it is needed.
+import sqlite3
+import re
+import random
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
+from typing import NamedTuple
+
+import compatibility
+import metrics
+import migrations
+import readcache
+from compatibility import BLOOD_TYPES
+
+DB_PATH = 'blood_donation_platform.db'
+
+# Seconds SQLite itself waits on a locked database, then how often and how
+# long (base delay, doubled per attempt) we retry a write that still hit it.
+BUSY_TIMEOUT = 5.0
+BUSY_RETRIES = 5
+BUSY_BACKOFF = 0.05
+
+URGENCY_LEVELS = ["Normal", "Urgent", "Critical"]
+REQUEST_STATUSES = ["Pending", "Fulfilled"]
+# Order in which pending requests are served (lower first)
+URGENCY_PRIORITY = {"Critical": 0, "Urgent": 1, "Normal": 2}
+# Kinds of stock_movements rows; 'opening' carries over stock from before the ledger
+STOCK_MOVEMENT_KINDS = ("opening", "receipt", "issue", "adjustment", "expiry")
+# Days a unit of red cells keeps from collection
+SHELF_LIFE_DAYS = 42
+# Days a donor waits after giving whole blood before giving again
+DONATION_INTERVAL_DAYS = 56
+
+DATE_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+EMAIL_PATTERN = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+# Runs of letters and digits, as the FTS5 unicode61 tokenizer splits them
+SEARCH_TOKEN_PATTERN = re.compile(r"[^\W_]+")
+
+_conn = None
+
+
+# Raised when a donor or request does not pass validation.
+# title/message are what the Tk client shows in its message box.
+class ValidationError(ValueError):
+    def __init__(self, title, message):
+        super().__init__(message)
+        self.title = title
+        self.message = message
+
+
+class RequestResult(NamedTuple):
+    request_id: int
+    status: str
+    message: str
+    fulfilled_with: str = None   # donor blood type issued, None while Pending
+
+
+# Connection that keeps the read cache of its stock and report reads (see readcache)
+class Connection(sqlite3.Connection):
+    read_cache = None
+
+
+# Open a new connection to the given database file, apply the pragmas and
+# bring the schema up to date. The connection is in autocommit mode; writes
+# group themselves with write_transaction.
+def connect(path=None, check_same_thread=True):
+    conn = sqlite3.connect(path or DB_PATH, timeout=BUSY_TIMEOUT, isolation_level=None,
+                           check_same_thread=check_same_thread, factory=Connection)
+    migrations.apply_pragmas(conn)
+    migrations.migrate(conn)
+    return metrics.instrument(conn)
+
+
+# Shared connection, opened lazily on first use
+def get_connection():
+    global _conn
+    if _conn is None:
+        _conn = connect()
+    return _conn
+
+
+# Point the shared connection at another database file (batch jobs, workers)
+def set_database(path):
+    global DB_PATH, _conn
+    if _conn is not None:
+        _conn.close()
+        _conn = None
+    DB_PATH = path
+
+
+# Run the body in one write transaction. BEGIN IMMEDIATE takes the write lock
+# up front, so a read-then-write inside cannot race another connection.
+# Nested use becomes a savepoint of the outer transaction.
+@contextmanager
+def write_transaction(conn):
+    if conn.in_transaction:
+        conn.execute("SAVEPOINT nested_write")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK TO nested_write")
+            conn.execute("RELEASE nested_write")
+            raise
+        conn.execute("RELEASE nested_write")
+        return
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+        with metrics.timer("commit"):
+            conn.execute("COMMIT")
+    except BaseException:
+        # A failed COMMIT leaves the transaction open (SQLite may already
+        # have rolled it back after some errors): without the ROLLBACK every
+        # later write on conn would nest inside it and never commit
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+
+
+# Run several write calls fn(*args, conn=conn, **kwargs) under one commit.
+# Each call gets its own savepoint (engine writers nest write_transaction), so
+# a call that raises leaves the others in place. Returns [(result, error)]
+# in call order; if the commit itself fails every call reports that error.
+def run_grouped(conn, calls):
+    def run():
+        outcomes = []
+        with write_transaction(conn):
+            for fn, args, kwargs in calls:
+                try:
+                    outcomes.append((fn(*args, conn=conn, **kwargs), None))
+                except Exception as error:
+                    outcomes.append((None, error))
+        return outcomes
+
+    try:
+        return retry_on_busy(run)
+    except Exception as error:
+        return [(None, error)] * len(calls)
+
+
+def is_busy_error(error):
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+
+# Call fn(), retrying with jittered exponential backoff while the database stays
+# locked past the busy timeout
+def retry_on_busy(fn, retries=None, backoff=None):
+    retries = BUSY_RETRIES if retries is None else retries
+    backoff = BUSY_BACKOFF if backoff is None else backoff
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except sqlite3.OperationalError as error:
+            if attempt == retries or not is_busy_error(error):
+                raise
+            time.sleep(backoff * (2 ** attempt) * (1 + random.random()))
+
+
+# Stock only changes through rows of the stock_movements ledger; the
+# stock_movements_apply trigger adds each one to the balance in blood_stock.
+# Units are held in stock_lots, and every movement names its lot.
+INSERT_MOVEMENT = ("INSERT INTO stock_movements (blood_type, delta, kind, request_id, note, lot_id) "
+                   "VALUES (?, ?, ?, ?, ?, ?)")
+
+
+def record_movement(conn, blood_type, delta, kind, request_id=None, note=None, lot_id=None):
+    conn.execute(INSERT_MOVEMENT, (blood_type, delta, kind, request_id, note, lot_id))
+
+
+# The day lots expire by: the current UTC day, the day request times
+# (CURRENT_TIMESTAMP) and their rollups are kept in. Every expiry check uses
+# it, so the sweep, the allocator, the reports and the federation agree on
+# which lots have expired whatever the local time zone.
+def utc_today() -> date:
+    return datetime.now(timezone.utc).date()
+
+
+# Add a lot of quantity units collected on collected_on (default utc_today()) and
+# expiring on expires_on (default SHELF_LIFE_DAYS after collection). Must run
+# inside a write transaction. Returns the lot id.
+def receive_units(conn, blood_type, quantity, kind="receipt", collected_on=None, expires_on=None, note=None):
+    collected_on = collected_on or utc_today().isoformat()
+    if not expires_on:
+        collected = datetime.strptime(collected_on, "%Y-%m-%d").date()
+        expires_on = (collected + timedelta(days=SHELF_LIFE_DAYS)).isoformat()
+    lot_id = conn.execute("INSERT INTO stock_lots (blood_type, quantity, collected_on, expires_on) VALUES (?, ?, ?, ?)",
+                          (blood_type, quantity, collected_on, expires_on)).lastrowid
+    record_movement(conn, blood_type, quantity, kind, note=note, lot_id=lot_id)
+    return lot_id
+
+
+# Take quantity units of blood_type, soonest to expire first, with a movement
+# per lot they come from. Lots that expired before usable_on (a date) are left
+# for the expiry sweep; without usable_on they are taken first, as adjustments
+# may. The lots are read from the head of idx_stock_lots_fefo, at most one per
+# unit. Takes nothing and returns False when there are not enough units. Must
+# run inside a write transaction, so no other connection can take the same
+# units between the read and the update.
+def take_units(conn, blood_type, quantity, kind, request_id=None, note=None, usable_on=None):
+    lots = conn.execute('''SELECT lot_id, quantity FROM stock_lots INDEXED BY idx_stock_lots_fefo
+                           WHERE blood_type = ? AND quantity > 0 AND expires_on >= ?
+                           ORDER BY expires_on, lot_id LIMIT ?''',
+                        (blood_type, usable_on.isoformat() if usable_on else "", quantity)).fetchall()
+    taken = []
+    left = quantity
+    for lot_id, units in lots:
+        if left == 0:
+            break
+        taken.append((min(units, left), lot_id))
+        left -= taken[-1][0]
+    if left:
+        return False
+    conn.executemany("UPDATE stock_lots SET quantity = quantity - ? WHERE lot_id = ?", taken)
+    conn.executemany(INSERT_MOVEMENT, [(blood_type, -units, kind, request_id, note, lot_id) for units, lot_id in taken])
+    return True
+
+
+# Whether quantity units of blood_type that are usable on `today` are in
+# stock. Reads at most one lot per unit, however many expired lots await the
+# sweep.
+def has_units(conn, blood_type, quantity, today):
+    row = conn.execute('''SELECT SUM(quantity) FROM (
+                              SELECT quantity FROM stock_lots INDEXED BY idx_stock_lots_fefo
+                              WHERE blood_type = ? AND quantity > 0 AND expires_on >= ?
+                              ORDER BY expires_on, lot_id LIMIT ?)''',
+                       (blood_type, today.isoformat(), quantity)).fetchone()
+    return (row[0] or 0) >= quantity
+
+
+# Issue quantity units of blood_type to a request if (and only if) enough
+# unexpired units are there. Returns True when the units were taken.
+def reserve_stock(conn, blood_type, quantity, request_id=None, today=None):
+    return take_units(conn, blood_type, quantity, "issue", request_id, usable_on=today or utc_today())
+
+
+# Function to validate date format (YYYY-MM-DD)
+def validate_date_input(input_date):
+    if not DATE_PATTERN.match(input_date): # Check if the input matches the pattern
+        return False
+
+    year, month, day = map(int, input_date.split('-'))  # Extract the year, month, and day from the input string
+
+    if month < 1 or month > 12: # Check if the month is valid (1 to 12)
+        return False
+
+    if not is_valid_day_for_month(month, day, year):   # Check if the day is valid for the given month
+        return False
+
+    return True
+
+# Function to check if the day is valid for the given month
+def is_valid_day_for_month(month, day, year):
+    # Days in each month (for non-leap year)
+    days_in_month = {
+        1: 31, 2: 28, 3: 31, 4: 30, 5: 31, 6: 30,
+        7: 31, 8: 31, 9: 30, 10: 31, 11: 30, 12: 31
+    }
+    # Check if the month is February and account for leap years
+    if month == 2:
+        # Leap year check (divisible by 4, but not by 100 unless divisible by 400)
+        if (year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)):
+            days_in_month[2] = 29  # February has 29 days in a leap year
+
+    # Check if the day is valid for the month
+    if day < 1 or day > days_in_month[month]:
+        return False
+
+    return True
+
+# Function to check if a date is in the future
+def is_future_date(date_str):
+    try:
+        entered_date = datetime.strptime(date_str, "%Y-%m-%d")
+        current_date = datetime.now()
+        return entered_date > current_date
+    except ValueError:
+        return False
+
+# Function to calculate age
+def calculate_age(dob):
+    today = datetime.today()
+    dob_date = datetime.strptime(dob, "%Y-%m-%d")
+    age = today.year - dob_date.year - ((today.month, today.day) < (dob_date.month, dob_date.day))
+    return age
+
+def is_valid_email(email):
+    return EMAIL_PATTERN.match(email) is not None
+
+def is_valid_phone(number):
+    return number.isdigit() and len(number) == 10
+
+
+# Age of a donor born on dob; raises ValidationError for a malformed or future date.
+# The date checks are cached per calendar day, since bulk imports repeat the same
+# dates over and over.
+def check_dob(dob, today=None):
+    return _checked_age(dob, today or date.today())
+
+@lru_cache(maxsize=65536)
+def _checked_age(dob, today):
+    try:
+        age = calculate_age(dob)
+    except ValueError:
+        raise ValidationError("Input Error", "Invalid Date of Birth format. Please use YYYY-MM-DD.")
+
+    if is_future_date(dob):
+        raise ValidationError("Input Error", "Date of Birth cannot be a future date.")
+    return age
+
+def check_last_donation(last_donation, today=None):
+    _checked_last_donation(last_donation, today or date.today())
+
+@lru_cache(maxsize=65536)
+def _checked_last_donation(last_donation, today):
+    if not validate_date_input(last_donation):
+        raise ValidationError("Input Error", "Invalid Last Donation date format. Please use YYYY-MM-DD.")
+
+    if is_future_date(last_donation):
+        raise ValidationError("Input Error", "Last donation date cannot be a future date.")
+
+
+# Dates of a lot of units received: collected in the past, not yet expired
+def check_collection_date(collected_on):
+    if not validate_date_input(collected_on):
+        raise ValidationError("Input Error", "Invalid collection date format. Please use YYYY-MM-DD.")
+    if is_future_date(collected_on):
+        raise ValidationError("Input Error", "Collection date cannot be a future date.")
+
+def check_expiry_date(expires_on, today=None):
+    if not validate_date_input(expires_on):
+        raise ValidationError("Input Error", "Invalid expiry date format. Please use YYYY-MM-DD.")
+    if datetime.strptime(expires_on, "%Y-%m-%d").date() < (today or utc_today()):
+        raise ValidationError("Input Error", "These units have already expired.")
+
+
+# Check a donor against the registration rules, returns the donor's age.
+# medical_history holds the six yes/no answers of the form (transfusion,
+# chronic illness, allergies, surgeries, medication, high-risk behaviour).
+def validate_donor(name: str, gender: str, dob: str, blood_type: str, contact: str,
+                   email: str, nationality: str, emergency_contact_number: str,
+                   last_donation: str = "", medical_history=(), consent: bool = False,
+                   today: date = None) -> int:
+    # Basic validation for ensuring required fields are filled
+    if not (name and gender and email and nationality and dob and blood_type and contact):
+        raise ValidationError("Input Error", "Please fill in all mandatory fields.")
+
+    if blood_type not in BLOOD_TYPES:
+        raise ValidationError("Input Error", "Please select a valid blood type.")
+
+    age = check_dob(dob, today)
+
+    # Check age eligibility
+    if age < 18 or age > 65:
+        raise ValidationError("Eligibility Error", "Age must be between 18 and 65 to donate blood.")
+
+    # Validate phone number (must be 10 digits)
+    if not is_valid_phone(contact):
+        raise ValidationError("Input Error", "Please enter a valid 10-digit phone number.")
+
+    # Check if email is valid
+    if not is_valid_email(email):
+        raise ValidationError("Invalid Email", "Please enter a valid email address.")
+
+    # Check medical history
+    if any(medical_history):
+        raise ValidationError("Eligibility Error", "Donors with medical history are not eligible to donate blood.")
+
+    # Validate Last Donation Date (if provided, it must be a valid date and can't be in future)
+    if last_donation:
+        check_last_donation(last_donation, today)
+
+    # Validate emergency contact number (must be 10 digits)
+    if not is_valid_phone(emergency_contact_number):
+        raise ValidationError("Input Error", "Please enter a valid 10-digit emergency phone number.")
+
+    if not consent:
+        raise ValidationError("Consent Error", "You must provide consent to register.")
+
+    return age
+
+
+# Columns stored for a donor, in the order bulk_insert_donors takes them
+DONOR_COLUMNS = ("name", "gender", "dob", "blood_type", "contact", "email", "address", "nationality",
+                 "last_donation", "emergency_contact_name", "emergency_contact_number", "next_eligible_date")
+INSERT_DONOR = (f"INSERT INTO donors ({', '.join(DONOR_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(DONOR_COLUMNS))})")
+
+
+# Date a donor may give blood again: the last donation plus the donation
+# interval (DONATION_INTERVAL_DAYS by default), or today without one
+def next_eligible_date(last_donation="", interval=None, today=None):
+    if not last_donation:
+        return (today or date.today()).isoformat()
+    donated = datetime.strptime(last_donation, "%Y-%m-%d").date()
+    return (donated + timedelta(days=DONATION_INTERVAL_DAYS if interval is None else interval)).isoformat()
+
+
+# Insert many already validated donors (rows in DONOR_COLUMNS order) in one
+# write transaction. Indexing each row for search through its trigger costs
+# several times the insert itself, so the trigger is dropped for the
+# transaction and the new rows are indexed with one INSERT ... SELECT. Other
+# connections never miss it: it is created again before the commit, or comes
+# back with the rollback.
+def bulk_insert_donors(conn, rows):
+    with write_transaction(conn):
+        conn.execute("DROP TRIGGER IF EXISTS donors_fts_insert")
+        last_id = conn.execute("SELECT COALESCE(MAX(donor_id), 0) FROM donors").fetchone()[0]
+        conn.executemany(INSERT_DONOR, rows)
+        conn.execute("INSERT INTO donors_fts (rowid, name) SELECT donor_id, name FROM donors WHERE donor_id > ?",
+                     (last_id,))
+        conn.execute(migrations.DONOR_FTS_INSERT)
+
+
+# Validate and store a donor, returns (donor_id, age)
+@metrics.timed("register_donor")
+def register_donor(name: str, gender: str, dob: str, blood_type: str, contact: str,
+                   email: str, nationality: str, emergency_contact_number: str,
+                   last_donation: str = "", medical_history=(), consent: bool = False,
+                   address: str = "", emergency_contact_name: str = "", conn=None) -> tuple:
+    with metrics.timer("register_donor.validate"):
+        age = validate_donor(name, gender, dob, blood_type, contact, email, nationality,
+                             emergency_contact_number, last_donation, medical_history, consent)
+    row = (name, gender, dob, blood_type, contact, email, address, nationality, last_donation,
+           emergency_contact_name, emergency_contact_number, next_eligible_date(last_donation))
+
+    conn = conn or get_connection()
+
+    def insert():
+        with write_transaction(conn):
+            return conn.execute(INSERT_DONOR, row).lastrowid
+
+    return retry_on_busy(insert), age
+
+
+# Record a donation (default today), returns the donor's next eligible date
+def record_donation(donor_id: int, donated_on: str = None, conn=None) -> str:
+    donated_on = donated_on or date.today().isoformat()
+    check_last_donation(donated_on)
+    next_date = next_eligible_date(donated_on)
+    conn = conn or get_connection()
+
+    def update():
+        with write_transaction(conn):
+            return conn.execute("UPDATE donors SET last_donation = ?, next_eligible_date = ? WHERE donor_id = ?",
+                                (donated_on, next_date, donor_id)).rowcount
+
+    if not retry_on_busy(update):
+        raise ValidationError("Input Error", f"There is no donor with ID {donor_id}.")
+    return next_date
+
+
+# Check a blood request against the request rules, returns the quantity as an int
+def validate_request(requestor_name: str, contact_number: str, email_address: str,
+                     blood_type_required: str, quantity_needed, urgency: str,
+                     patient_name: str, patient_age, patient_condition: str,
+                     approval: bool = False) -> int:
+    # Check if all fields are filled
+    if not (requestor_name and contact_number and email_address and blood_type_required and quantity_needed and urgency and patient_name and patient_age and patient_condition):
+        raise ValidationError("Input Error", "Please fill in all mandatory fields.")
+
+    # Validate phone number (must be 10 digits)
+    if not is_valid_phone(contact_number):
+        raise ValidationError("Input Error", "Please enter a valid 10-digit phone number.")
+
+    # Check if email is valid
+    if not is_valid_email(email_address):
+        raise ValidationError("Invalid Email", "Please enter a valid email address.")
+
+    if blood_type_required not in BLOOD_TYPES:
+        raise ValidationError("Input Error", "Please select a valid blood type.")
+
+    if urgency not in URGENCY_LEVELS:
+        raise ValidationError("Input Error", "Please select a valid urgency.")
+
+    try:
+        quantity = int(quantity_needed)
+    except (TypeError, ValueError):
+        quantity = 0
+    if quantity <= 0:
+        raise ValidationError("Input Error", "Please enter a valid quantity of blood needed.")
+
+    if not approval:
+        raise ValidationError("Error", "You must have authorization to submit request.")
+
+    return quantity
+
+
+# Validate and store a blood request, taking it from stock when enough of the
+# requested type, or of a compatible one allowed by the substitution policy, is available
+@metrics.timed("submit_request")
+def submit_request(requestor_name: str, contact_number: str, email_address: str,
+                   blood_type_required: str, quantity_needed, urgency: str,
+                   patient_name: str, patient_age, patient_condition: str,
+                   approval: bool = False, conn=None, policy=None) -> RequestResult:
+    with metrics.timer("submit_request.validate"):
+        quantity = validate_request(requestor_name, contact_number, email_address, blood_type_required,
+                                    quantity_needed, urgency, patient_name, patient_age,
+                                    patient_condition, approval)
+
+    conn = conn or get_connection()
+    policy = policy or compatibility.DEFAULT_POLICY
+    return retry_on_busy(lambda: _store_request(conn, requestor_name, contact_number, email_address,
+                                                blood_type_required, quantity, urgency, patient_name,
+                                                policy))
+
+
+# Reserve the stock and save the request in one write transaction
+def _store_request(conn, requestor_name, contact_number, email_address, blood_type_required,
+                   quantity, urgency, patient_name, policy):
+    today = utc_today()
+    with write_transaction(conn):
+        # The write lock is held from BEGIN IMMEDIATE on, so this snapshot stays
+        # current until the commit. blood_stock still counts expired units the
+        # sweep has not retired, so a type that has enough is checked against
+        # its unexpired lots.
+        with metrics.timer("submit_request.stock_select"):
+            stock = get_stock(conn)
+            donor_type = next((donor for donor in compatibility.donor_order(blood_type_required, urgency, policy)
+                               if (stock.get(donor) or 0) >= quantity and has_units(conn, donor, quantity, today)),
+                              None)
+
+        # Case 1: Sufficient stock of the requested type or a compatible one
+        if donor_type is not None:
+            status = "Fulfilled"
+            if donor_type == blood_type_required:
+                message = f"Blood request for {patient_name} has been fulfilled."
+            else:
+                message = f"Blood request for {patient_name} has been fulfilled with compatible {donor_type} blood."
+        else:
+            status = "Pending"
+            donor_type = None
+
+            # Case 2: Insufficient stock (but stock available)
+            if blood_type_required in stock:
+                message = f"Insufficient stock for {blood_type_required}. Available stock: {usable_stock(conn, today)[blood_type_required]} units. Blood request for {patient_name} is pending."
+
+            # Case 3: No stock available
+            else:
+                message = f"Currently out of stock for {blood_type_required}. Blood request for {patient_name} is pending."
+
+        # Save the blood request details with the status (Pending or Fulfilled)
+        with metrics.timer("submit_request.insert"):
+            cur = conn.execute('''INSERT INTO blood_requests (requestor_name, contact_number, email_address, blood_type_required, quantity_needed, urgency, priority, patient_name, status, fulfilled_with, fulfilled_at)
+                              VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CASE WHEN ?10 IS NULL THEN NULL ELSE CURRENT_TIMESTAMP END)''',
+                               (requestor_name, contact_number, email_address, blood_type_required, quantity,
+                                urgency, URGENCY_PRIORITY[urgency], patient_name, status, donor_type))
+
+        # Issue the units against the request. The check repeats the one made
+        # on the snapshot above, so it only fails if the lock was not held.
+        if donor_type is not None:
+            with metrics.timer("submit_request.stock_update"):
+                if not reserve_stock(conn, donor_type, quantity, cur.lastrowid, today):
+                    raise RuntimeError(f"Stock of {donor_type} changed while request {cur.lastrowid} was saved")
+    return RequestResult(cur.lastrowid, status, message, donor_type)
+
+
+# Current stock as {blood_type: quantity}
+@metrics.timed("get_stock")
+def get_stock(conn=None) -> dict:
+    conn = conn or get_connection()
+    stock = dict(readcache.cached(conn, ("stock",),
+                                  lambda: conn.execute("SELECT blood_type, quantity FROM blood_stock").fetchall()))
+    metrics.rows("get_stock", len(stock))
+    return stock
+
+
+# Stock that can still be issued on `today` (default utc_today()): get_stock()
+# less the units of lots that have expired but not been swept yet (few, while
+# the sweep runs)
+def usable_stock(conn=None, today=None) -> dict:
+    conn = conn or get_connection()
+    stock = get_stock(conn)
+    day = (today or utc_today()).isoformat()
+    expired = readcache.cached(conn, ("expired_stock", day),
+                               lambda: conn.execute('''SELECT blood_type, SUM(quantity) FROM stock_lots
+                                                       INDEXED BY idx_stock_lots_expiry
+                                                       WHERE quantity > 0 AND expires_on < ?
+                                                       GROUP BY blood_type''', (day,)).fetchall())
+    for blood_type, units in expired:
+        stock[blood_type] -= units
+    return stock
+
+
+# Stock as {blood_type: quantity} as of a past time (datetime, or UTC text as
+# in stock_movements.at, e.g. "2024-06-01 12:00:00"). Starts from the latest
+# checkpoint at or before that time and replays the movements after it, at
+# most migrations.CHECKPOINT_EVERY of them.
+@metrics.timed("stock_as_of")
+def stock_as_of(at, conn=None) -> dict:
+    if isinstance(at, datetime):
+        at = at.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+    conn = conn or get_connection()
+    row = conn.execute("SELECT movement_id FROM stock_movements WHERE at <= ? ORDER BY at DESC, movement_id DESC LIMIT 1",
+                       (at,)).fetchone()
+    if row is None:
+        return {}
+    last = row[0]
+    row = conn.execute("SELECT movement_id FROM stock_checkpoints WHERE movement_id <= ? ORDER BY movement_id DESC LIMIT 1",
+                       (last,)).fetchone()
+    checkpoint = row[0] if row else 0
+    stock = dict(conn.execute("SELECT blood_type, quantity FROM stock_checkpoints WHERE movement_id = ?",
+                              (checkpoint,)))
+    for blood_type, delta in conn.execute('''SELECT blood_type, SUM(delta) FROM stock_movements
+                                             WHERE movement_id > ? AND movement_id <= ? GROUP BY blood_type''',
+                                          (checkpoint, last)):
+        stock[blood_type] = stock.get(blood_type, 0) + delta
+    return stock
+
+
+# Compare blood_stock with the full ledger and the lots. Returns
+# {blood_type: (stock, ledger total, units in lots)} for the types that
+# differ; with repair=True blood_stock is rewritten from the ledger.
+def check_stock_ledger(repair: bool = False, conn=None) -> dict:
+    conn = conn or get_connection()
+    with write_transaction(conn):
+        stock = get_stock(conn)
+        ledger = dict(conn.execute("SELECT blood_type, SUM(delta) FROM stock_movements GROUP BY blood_type"))
+        lots = dict(conn.execute("SELECT blood_type, SUM(quantity) FROM stock_lots GROUP BY blood_type"))
+        differences = {blood_type: (stock.get(blood_type), ledger.get(blood_type, 0), lots.get(blood_type, 0))
+                       for blood_type in set(stock) | set(ledger) | set(lots)
+                       if not (stock.get(blood_type) or 0) == ledger.get(blood_type, 0) == lots.get(blood_type, 0)}
+        if repair and differences:
+            conn.executemany('''INSERT INTO blood_stock (blood_type, quantity) VALUES (?, ?)
+                                ON CONFLICT (blood_type) DO UPDATE SET quantity = excluded.quantity''',
+                             [(blood_type, total) for blood_type, (_, total, _) in differences.items()])
+    return differences
+
+
+# Listings shown by the Tk client: keyset column, display columns and the
+# filters each one accepts (filter name -> column)
+LISTINGS = {
+    "donors": ("donor_id", ["donor_id", "name", "dob", "blood_type", "contact"],
+               {"blood_type": "blood_type"}),
+    "blood_requests": ("request_id", ["request_id", "requestor_name", "contact_number", "email_address",
+                                      "blood_type_required", "quantity_needed", "urgency", "patient_name",
+                                      "datetime", "status"],
+                       {"blood_type": "blood_type_required", "status": "status", "urgency": "urgency"}),
+}
+
+# Listings with a full-text index (FTS5 table over the listing's rows)
+SEARCH_INDEXES = {"donors": "donors_fts"}
+# Column the numbers of a search match the start of, and its index
+SEARCH_NUMBER_COLUMNS = {"donors": ("contact", "idx_donors_contact")}
+# A number search matching up to this many rows sorts them all; one matching
+# more reads the listing in page order and skips the other rows, which then
+# fill a page within a few thousand
+PREFIX_SORT_ROWS = 10000
+
+PAGE_SIZE = 100
+
+
+# Keyset position of a listing row: (sort value, key) or just (key,) when sorting by the key
+def page_key(table, row, sort=None):
+    key, columns, _ = LISTINGS[table]
+    sort = sort or key
+    if sort == key:
+        return (row[columns.index(key)],)
+    return (row[columns.index(sort)], row[columns.index(key)])
+
+
+# Split a search box entry into an FTS5 query, contact number prefixes and a
+# blood type. Words are prefixes of a word of the name, numbers prefixes of
+# the contact number (SEARCH_NUMBER_COLUMNS, not in the FTS5 index); a blood
+# type ("ab-") becomes a filter. Returns ("", [], None) for an empty search.
+def parse_search(text):
+    terms = []
+    prefixes = []
+    blood_type = None
+    for word in text.split():
+        if word.upper() in BLOOD_TYPES:
+            blood_type = word.upper()
+            continue
+        for token in SEARCH_TOKEN_PATTERN.findall(word):
+            if token.isdigit():
+                prefixes.append(token)
+            else:
+                terms.append(f'name : "{token}"*')
+    return " AND ".join(terms), prefixes, blood_type
+
+
+# Bounds of the strings starting with `prefix`: prefix <= s < upper
+def prefix_range(prefix):
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+# Rows matching a condition, counting no further than `limit` + 1
+def count_up_to(conn, source, where, params, limit):
+    return conn.execute(f"SELECT count(*) FROM (SELECT 1 FROM {source} WHERE {where} LIMIT ?)",
+                        (*params, limit + 1)).fetchone()[0]
+
+
+# FROM clause and condition of a search for numbers starting with `prefix`,
+# given the other conditions of the page. A number matching up to
+# PREFIX_SORT_ROWS rows reads them from its index, and so do other conditions
+# as selective; otherwise the matches are frequent and the listing is read
+# in page order until the page is full. The index is named, as without
+# ANALYZE statistics SQLite prefers any equality (a blood type) to a range.
+def number_search(conn, table, prefix, where, params, by_key):
+    column, index = SEARCH_NUMBER_COLUMNS[table]
+    column = f"{table}.{column}"
+    condition = f"{column} >= ? AND {column} < ?"
+    if count_up_to(conn, table, condition, prefix_range(prefix), PREFIX_SORT_ROWS) <= PREFIX_SORT_ROWS:
+        return f"{table} INDEXED BY {index}", condition
+    condition = f"+{column} >= ? AND +{column} < ?"
+    if where and count_up_to(conn, table, " AND ".join(where), params, PREFIX_SORT_ROWS) <= PREFIX_SORT_ROWS:
+        return table, condition
+    return f"{table} NOT INDEXED" if by_key else table, condition
+
+
+# The parts a page is read from, in scan order, as (conditions, params, order
+# columns) after the keyset `position`. A sort column can be NULL, and a row
+# value compared with NULL is NULL: the rows without a value (first when
+# ascending, as SQLite sorts them) are read as a part of their own, ordered by
+# the key. Each part can be read from an index in order.
+def keyset_parts(column, key, position, descending):
+    compare = "<" if descending else ">"
+    if column is None:
+        return [([f"{key} {compare} ?"], list(position), [key]) if position else ([], [], [key])]
+    nulls = ([f"{column} IS NULL"], [], [key])
+    values = ([f"{column} IS NOT NULL"], [], [column, key])
+    if position is not None:
+        value, position_key = position
+        if value is None:
+            nulls = ([f"{column} IS NULL", f"{key} {compare} ?"], [position_key], [key])
+            values = None if descending else values
+        else:
+            values = ([f"({column}, {key}) {compare} (?, ?)"], [value, position_key], [column, key])
+            nulls = nulls if descending else None
+    parts = [values, nulls] if descending else [nulls, values]
+    return [part for part in parts if part is not None]
+
+
+# One page of a listing using keyset pagination: rows after (or before) the
+# page_key of a row already shown, so a page costs the same wherever it is.
+# Sorting, filtering and searching (see parse_search) happen in SQL.
+@metrics.timed("fetch_page")
+def fetch_page(table: str, sort: str = None, descending: bool = False, filters: dict = None,
+               after: tuple = None, before: tuple = None, limit: int = PAGE_SIZE, search: str = None,
+               conn=None) -> list:
+    key, columns, filterable = LISTINGS[table]
+    sort = sort or key
+    if sort not in columns:
+        raise ValueError(f"Cannot sort {table} by {sort}")
+    if search and table not in SEARCH_INDEXES:
+        raise ValueError(f"Cannot search {table}")
+
+    conn = conn or get_connection()
+    match, prefixes, blood_type = parse_search(search or "")
+    filters = dict(filters or {})
+    if blood_type and not filters.get("blood_type"):
+        filters["blood_type"] = blood_type
+
+    # Columns are qualified as the full-text index has columns of the same name.
+    # When searching, the key is read from the index so that it returns its
+    # matches in key order and the LIMIT stops the scan early.
+    source = table
+    qualified = {column: f"{table}.{column}" for column in columns}
+    where = []
+    params = []
+    if match:
+        index = SEARCH_INDEXES[table]
+        source = f"{table} JOIN {index} ON {index}.rowid = {table}.{key}"
+        qualified[key] = f"{index}.rowid"
+        where.append(f"{index} MATCH ?")
+        params.append(match)
+
+    for name, value in filters.items():
+        if value:
+            where.append(f"{table}.{filterable[name]} = ?")
+            params.append(value)
+
+    if prefixes:
+        # The longest number: every other one has to be its own prefix
+        longest = max(prefixes, key=len)
+        if all(longest.startswith(prefix) for prefix in prefixes):
+            if match:
+                # The full-text index returns the rows, the number only filters them
+                column = qualified[SEARCH_NUMBER_COLUMNS[table][0]]
+                condition = f"+{column} >= ? AND +{column} < ?"
+            else:
+                source, condition = number_search(conn, table, longest, where, params, sort == key)
+            where.append(condition)
+            params.extend(prefix_range(longest))
+        else:
+            where.append("0")
+
+    # Paging backwards scans the other way and flips the page afterwards
+    forward = before is None
+    scan_descending = descending if forward else not descending
+    direction = "DESC" if scan_descending else "ASC"
+    rows = []
+    for condition, condition_params, order_columns in keyset_parts(
+            None if sort == key else qualified[sort], qualified[key], after if forward else before, scan_descending):
+        sql = (f"SELECT {', '.join(f'{table}.{column}' for column in columns)} FROM {source}"
+               + (f" WHERE {' AND '.join(where + condition)}" if where or condition else "")
+               + f" ORDER BY {', '.join(f'{column} {direction}' for column in order_columns)} LIMIT ?")
+        rows += conn.execute(sql, params + condition_params + [limit - len(rows)]).fetchall()
+        if len(rows) == limit:
+            break
+
+    metrics.rows("fetch_page", len(rows))
+    if not forward:
+        rows.reverse()
+    return rows
+
+
+# Donors matching a search such as "asha", "98765" or "rao o-", in donor_id
+# order; pass the page_key of the last row as `after` for the next page
+def search_donors(text: str, after: tuple = None, limit: int = PAGE_SIZE, conn=None) -> list:
+    return fetch_page("donors", after=after, limit=limit, search=text, conn=conn)
+
+
+# The same calendar day `years` years earlier (Feb 29 becomes Feb 28)
+def years_before(day, years):
+    try:
+        return day.replace(year=day.year - years)
+    except ValueError:
+        return day.replace(year=day.year - years, day=28)
+
+
+ELIGIBLE_COLUMNS = ["donor_id", "name", "blood_type", "contact", "email", "next_eligible_date"]
+
+
+# Donors who can give blood for a patient of blood_type on `on` (default
+# today): compatible types in compatibility.donor_order (O- only for O-
+# patients and Critical requests), each type eligible longest first, aged
+# 18 to 65. Each type is a range scan of idx_donors_eligible; the age check
+# runs on the rows it returns, from two date bounds instead of calculate_age.
+@metrics.timed("eligible_donors")
+def eligible_donors(blood_type: str, urgency: str = "Critical", on: date = None, limit: int = PAGE_SIZE,
+                    policy=compatibility.DEFAULT_POLICY, conn=None) -> list:
+    if blood_type not in BLOOD_TYPES:
+        raise ValidationError("Input Error", "Please select a valid blood type.")
+    on = on or date.today()
+    oldest = years_before(on, 66).isoformat()     # born after this: 65 or younger
+    youngest = years_before(on, 18).isoformat()   # born on or before this: 18 or older
+
+    donor_types = compatibility.donor_order(blood_type, urgency, policy)
+    select = (f"SELECT * FROM (SELECT {', '.join(ELIGIBLE_COLUMNS)} FROM donors INDEXED BY idx_donors_eligible"
+              " WHERE blood_type = ? AND next_eligible_date <= ? AND dob > ? AND dob <= ?"
+              " ORDER BY next_eligible_date LIMIT ?)")
+    params = []
+    for donor_type in donor_types:
+        params.extend((donor_type, on.isoformat(), oldest, youngest, limit))
+    params.append(limit)
+
+    conn = conn or get_connection()
+    rows = conn.execute(" UNION ALL ".join([select] * len(donor_types)) + " LIMIT ?", params).fetchall()
+    metrics.rows("eligible_donors", len(rows))
+    return rows
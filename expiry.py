@@ -0,0 +1,80 @@
+# Retirement of expired blood units.
+# A lot past its expiry date is never issued (engine.reserve_stock skips it)
+# but stays in blood_stock until the sweep writes it off with an 'expiry'
+# movement. The sweep reads expired lots from idx_stock_lots_expiry and
+# retires them SWEEP_BATCH at a time, each batch in its own short write
+# transaction, so requests being saved never wait long behind it.
+#
+#   python bloodlink.py expire
+import threading
+import time
+
+import engine
+import metrics
+
+SWEEP_BATCH = 200
+# Seconds between sweeps of the background sweeper
+SWEEP_INTERVAL = 3600.0
+
+
+# Retire one batch of lots that expired before today, returns [(lot_id, blood_type, units)]
+def expire_batch(conn, today, batch_size=SWEEP_BATCH):
+    with engine.write_transaction(conn):
+        lots = conn.execute('''SELECT lot_id, blood_type, quantity FROM stock_lots INDEXED BY idx_stock_lots_expiry
+                               WHERE quantity > 0 AND expires_on < ?
+                               ORDER BY expires_on LIMIT ?''', (today.isoformat(), batch_size)).fetchall()
+        conn.executemany("UPDATE stock_lots SET quantity = 0 WHERE lot_id = ?", [(lot_id,) for lot_id, _, _ in lots])
+        conn.executemany(engine.INSERT_MOVEMENT, [(blood_type, -units, "expiry", None, None, lot_id)
+                                                  for lot_id, blood_type, units in lots])
+    return lots
+
+
+# Retire every lot that expired before today (default: engine.utc_today()).
+# Returns {blood_type: units retired}.
+@metrics.timed("expire_lots")
+def expire_lots(conn=None, today=None, batch_size=SWEEP_BATCH) -> dict:
+    conn = conn or engine.get_connection()
+    today = today or engine.utc_today()
+    retired = {}
+    while True:
+        lots = engine.retry_on_busy(lambda: expire_batch(conn, today, batch_size))
+        for _, blood_type, units in lots:
+            retired[blood_type] = retired.get(blood_type, 0) + units
+        metrics.rows("expire_lots", len(lots))
+        if len(lots) < batch_size:
+            return retired
+
+
+# Background thread sweeping every `interval` seconds on its own connection
+class Sweeper(threading.Thread):
+    def __init__(self, path=None, interval=SWEEP_INTERVAL, batch_size=SWEEP_BATCH):
+        super().__init__(name="bloodlink-expiry", daemon=True)
+        self.path = path or engine.DB_PATH
+        self.interval = interval
+        self.batch_size = batch_size
+        self.stopped = threading.Event()
+        self.last_sweep = None      # (time, {blood_type: units retired})
+        self.error = None
+
+    def run(self):
+        conn = engine.connect(self.path)
+        try:
+            while True:
+                try:
+                    self.last_sweep = (time.time(), expire_lots(conn, batch_size=self.batch_size))
+                except Exception as error:
+                    self.error = error
+                if self.stopped.wait(self.interval):
+                    return
+        finally:
+            conn.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def start_sweeper(path=None, interval=SWEEP_INTERVAL):
+    sweeper = Sweeper(path, interval)
+    sweeper.start()
+    return sweeper
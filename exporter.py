@@ -0,0 +1,152 @@
+# Streaming exports of donors, requests and stock to CSV or JSONL.
+# One SELECT is read fetchmany(BATCH_SIZE) rows at a time and written through
+# a WRITE_BUFFER byte buffer (gzip compressed when asked), so memory stays flat
+# however many rows there are. The whole export is one read of the database:
+# under WAL it sees a single snapshot and never blocks a request being saved.
+# The file is written next to the target and renamed when complete.
+#
+#   python bloodlink.py export blood_requests requests.csv.gz --from 2024-01-01 --status Fulfilled
+#   python bloodlink.py export donors donors.jsonl --blood-type O-
+import csv
+import gzip
+import io
+import json
+import os
+import time
+from typing import NamedTuple
+
+import engine
+import importer
+import metrics
+from engine import ValidationError
+
+BATCH_SIZE = 5000
+WRITE_BUFFER = 1 << 20
+GZIP_LEVEL = 6
+
+
+class ExportTable(NamedTuple):
+    key: str
+    columns: tuple
+    date_column: str       # column the --from/--to range applies to
+    filters: dict          # filter name -> column
+    range_order: str       # ORDER BY for a date range, read straight from an index
+
+
+EXPORTS = {
+    "donors": ExportTable("donor_id", ("donor_id",) + engine.DONOR_COLUMNS, "last_donation",
+                          {"blood_type": "blood_type"}, "donor_id"),
+    "blood_requests": ExportTable("request_id", ("request_id", "requestor_name", "contact_number", "email_address",
+                                                 "blood_type_required", "quantity_needed", "urgency", "priority",
+                                                 "patient_name", "datetime", "status", "fulfilled_with",
+                                                 "fulfilled_at"), "datetime",
+                                  {"blood_type": "blood_type_required", "status": "status", "urgency": "urgency"},
+                                  "datetime, request_id"),
+    "blood_stock": ExportTable("blood_type", ("blood_type", "quantity"), None, {"blood_type": "blood_type"},
+                               None),
+    "stock_movements": ExportTable("movement_id", ("movement_id", "blood_type", "delta", "kind", "request_id",
+                                                   "lot_id", "note", "at"), "at",
+                                   {"blood_type": "blood_type", "kind": "kind"}, "movement_id"),
+}
+
+
+class ExportResult(NamedTuple):
+    rows: int
+    seconds: float
+
+    @property
+    def rows_per_sec(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+# "x.csv.gz" -> ("csv", True); an explicit format or compression wins over the name
+def detect_output(path, fmt=None, compress=None):
+    name = path[:-3] if path.lower().endswith(".gz") else path
+    compress = path.lower().endswith(".gz") if compress is None else compress
+    return fmt or importer.detect_format(name), compress
+
+
+# SELECT of a table with the filters (None values are ignored) and a date range,
+# both days included. Returns (sql, params).
+def export_query(table, start=None, end=None, filters=None):
+    if table not in EXPORTS:
+        raise ValidationError("Input Error", f"Unknown table {table}, choose one of {', '.join(EXPORTS)}.")
+    spec = EXPORTS[table]
+    where, params = [], []
+    for name, value in (filters or {}).items():
+        if value is None:
+            continue
+        if name not in spec.filters:
+            raise ValidationError("Input Error", f"{table} cannot be filtered by {name.replace('_', ' ')}.")
+        where.append(f"{spec.filters[name]} = ?")
+        params.append(value)
+    if start or end:
+        if spec.date_column is None:
+            raise ValidationError("Input Error", f"{table} has no dates to filter on.")
+        for value in (start, end):
+            if value and not engine.validate_date_input(value):
+                raise ValidationError("Input Error", "Invalid export date format. Please use YYYY-MM-DD.")
+        if start:
+            where.append(f"{spec.date_column} >= ?")
+            params.append(start)
+        if end:
+            where.append(f"{spec.date_column} < date(?, '+1 day')")
+            params.append(end)
+    sql = f"SELECT {', '.join(spec.columns)} FROM {table}"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    return sql + f" ORDER BY {spec.range_order if start or end else spec.key}", params
+
+
+def open_output(path, compress):
+    binary = gzip.open(path, "wb", compresslevel=GZIP_LEVEL) if compress else open(path, "wb", buffering=0)
+    return io.TextIOWrapper(io.BufferedWriter(binary, WRITE_BUFFER), encoding="utf-8", newline="")
+
+
+# Yield the rows of a query in lists of up to batch_size
+def fetch_batches(cursor, batch_size=BATCH_SIZE):
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        if not batch:
+            return
+        yield batch
+
+
+# Export a table to path (CSV or JSONL by the file name, .gz compressed).
+# filters: {"blood_type": "O-", "status": "Pending", ...}, see EXPORTS.
+@metrics.timed("export")
+def export_table(table, path, start=None, end=None, filters=None, fmt=None, compress=None, conn=None,
+                 batch_size=BATCH_SIZE) -> ExportResult:
+    sql, params = export_query(table, start, end, filters)
+    fmt, compress = detect_output(path, fmt, compress)
+    conn = conn or engine.get_connection()
+    columns = EXPORTS[table].columns
+    count = 0
+    started = time.perf_counter()
+
+    temporary = f"{path}.tmp"
+    try:
+        with open_output(temporary, compress) as output:
+            cursor = conn.execute(sql, params)
+            try:
+                if fmt == "jsonl":
+                    encode = json.JSONEncoder(ensure_ascii=False).encode
+                    for batch in fetch_batches(cursor, batch_size):
+                        output.write("".join(encode(dict(zip(columns, row))) + "\n" for row in batch))
+                        count += len(batch)
+                else:
+                    writer = csv.writer(output)
+                    writer.writerow(columns)
+                    for batch in fetch_batches(cursor, batch_size):
+                        writer.writerows(batch)
+                        count += len(batch)
+            finally:
+                cursor.close()
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+    metrics.rows("export", count)
+    return ExportResult(count, time.perf_counter() - started)
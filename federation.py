@@ -0,0 +1,189 @@
+# Network-wide stock across the site databases.
+# Every site keeps its own SQLite file: BloodLink databases, or older
+# blood_bank.db style stores that hold several blood_stock rows per type in
+# `units`. A Federation registers the sites, maps each schema to one stock
+# query, and asks all of them at once on a thread pool, so a network lookup
+# takes about as long as the slowest site. Each site's answer is cached for
+# `ttl` seconds; a site that fails or does not answer within `timeout` is
+# reported in `errors` and left out of the totals.
+#
+#   python federation.py blood_donation_platform.db blood_bank.db --blood-type A+ --quantity 2
+import argparse
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import NamedTuple
+from urllib.request import pathname2url
+
+import compatibility
+import engine
+import metrics
+
+# Stock query of each site schema: rows of (blood_type, units). :today is
+# engine.utc_today(), the day expiry is measured by everywhere.
+SCHEMAS = {
+    # BloodLink with stock lots: blood_stock less the expired units not yet swept
+    "bloodlink": '''SELECT blood_type, quantity - COALESCE((SELECT SUM(quantity) FROM stock_lots
+                                                         WHERE stock_lots.blood_type = blood_stock.blood_type
+                                                         AND quantity > 0 AND expires_on < :today), 0)
+                    FROM blood_stock''',
+    # BloodLink before the stock lots (schema version 7 and older)
+    "bloodlink_legacy": "SELECT blood_type, quantity FROM blood_stock",
+    # blood_bank.db: one row per delivery, units per row
+    "blood_bank": "SELECT blood_type, SUM(units) FROM blood_stock GROUP BY blood_type",
+}
+
+CACHE_TTL = 5.0
+SITE_TIMEOUT = 2.0
+
+
+class FederatedStock(NamedTuple):
+    total: dict        # {blood_type: units} over the sites that answered
+    sites: dict        # {site: {blood_type: units}}
+    errors: dict       # {site: error message} for the sites that did not
+
+
+class SiteMatch(NamedTuple):
+    site: str
+    blood_type: str    # donor type the site would issue
+    available: int
+
+
+# Schema of a site database, from the columns of its blood_stock table
+def detect_schema(conn):
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(blood_stock)")}
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    if "units" in columns:
+        return "blood_bank"
+    if "quantity" in columns:
+        return "bloodlink" if "stock_lots" in tables else "bloodlink_legacy"
+    raise ValueError("no blood_stock table with a quantity or units column")
+
+
+class Site:
+    def __init__(self, name, path, schema=None):
+        self.name = name
+        self.path = path
+        # Sites are only read: opened read-only, never migrated
+        self.conn = sqlite3.connect(f"file:{pathname2url(os.path.abspath(path))}?mode=ro", uri=True,
+                                    timeout=engine.BUSY_TIMEOUT, check_same_thread=False)
+        self.schema = schema or detect_schema(self.conn)
+        self.query = SCHEMAS[self.schema]
+        self.lock = threading.Lock()     # one query at a time on the connection
+        self.cached = None               # (monotonic time, stock)
+
+    def stock(self, ttl):
+        cached = self.cached
+        if cached and time.monotonic() - cached[0] < ttl:
+            return cached[1]
+        with self.lock:
+            started = time.perf_counter()
+            stock = {blood_type: units or 0 for blood_type, units
+                     in self.conn.execute(self.query, {"today": engine.utc_today().isoformat()})}
+            metrics.observe(metrics.OPERATION_SECONDS, (("operation", "federation.site"), ("site", self.name)),
+                            time.perf_counter() - started)
+        self.cached = (time.monotonic(), stock)
+        return stock
+
+    def close(self):
+        self.conn.close()
+
+
+class Federation:
+    def __init__(self, ttl=CACHE_TTL, timeout=SITE_TIMEOUT, workers=8):
+        self.ttl = ttl
+        self.timeout = timeout
+        self.sites = {}
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bloodlink-site")
+
+    # Register a site database; the name defaults to the file name
+    def add_site(self, path, name=None, schema=None):
+        name = name or os.path.splitext(os.path.basename(path))[0]
+        if name in self.sites:
+            raise ValueError(f"Site {name} is already registered")
+        self.sites[name] = Site(name, path, schema)
+        return name
+
+    def remove_site(self, name):
+        self.sites.pop(name).close()
+
+    def close(self):
+        self.executor.shutdown()
+        for site in self.sites.values():
+            site.close()
+
+    # Stock of every site, queried in parallel (max_age overrides the cache TTL, 0 forces a fresh read)
+    @metrics.timed("federation.stock")
+    def stock(self, max_age=None) -> FederatedStock:
+        ttl = self.ttl if max_age is None else max_age
+        futures = {self.executor.submit(site.stock, ttl): name for name, site in self.sites.items()}
+        done, _ = wait(futures, timeout=self.timeout)
+
+        total, sites, errors = {}, {}, {}
+        for future, name in futures.items():
+            if future not in done:
+                self.sites[name].conn.interrupt()
+                errors[name] = f"no answer within {self.timeout}s"
+            elif future.exception() is not None:
+                errors[name] = str(future.exception())
+            else:
+                sites[name] = future.result()
+                for blood_type, units in sites[name].items():
+                    total[blood_type] = total.get(blood_type, 0) + units
+        return FederatedStock(total, sites, errors)
+
+    # Total and per-site units of one blood type
+    def stock_of(self, blood_type, max_age=None):
+        stock = self.stock(max_age)
+        per_site = {name: site_stock.get(blood_type, 0) for name, site_stock in stock.sites.items()}
+        return sum(per_site.values()), per_site
+
+    # Sites that could fill a request on their own, best first: the donor type
+    # each would issue (as compatibility.choose_donor picks it), preferred
+    # types first and the sites with the most units first within a type
+    def sites_for(self, blood_type, quantity, urgency="Normal", policy=compatibility.DEFAULT_POLICY,
+                  max_age=None) -> list:
+        order = compatibility.donor_order(blood_type, urgency, policy)
+        matches = []
+        for name, site_stock in self.stock(max_age).sites.items():
+            donor_type = compatibility.choose_donor(blood_type, urgency, quantity, site_stock, policy)
+            if donor_type is not None:
+                matches.append(SiteMatch(name, donor_type, site_stock[donor_type]))
+        matches.sort(key=lambda match: (order.index(match.blood_type), -match.available, match.site))
+        return matches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stock across several site databases")
+    parser.add_argument("databases", nargs="+", help="site database files (NAME=PATH to name a site)")
+    parser.add_argument("--blood-type", choices=engine.BLOOD_TYPES, help="show the sites that can fill a request")
+    parser.add_argument("--quantity", type=int, default=1)
+    parser.add_argument("--urgency", choices=engine.URGENCY_LEVELS, default="Normal")
+    args = parser.parse_args(argv)
+
+    federation = Federation()
+    try:
+        for database in args.databases:
+            name, _, path = database.rpartition("=")
+            federation.add_site(path, name or None)
+        stock = federation.stock()
+        for name, site_stock in stock.sites.items():
+            print(f"{name:<28} " + "  ".join(f"{t} {site_stock.get(t, 0):>4}" for t in engine.BLOOD_TYPES))
+        print(f"{'total':<28} " + "  ".join(f"{t} {stock.total.get(t, 0):>4}" for t in engine.BLOOD_TYPES))
+        for name, error in stock.errors.items():
+            print(f"{name}: {error}")
+        if args.blood_type:
+            matches = federation.sites_for(args.blood_type, args.quantity, args.urgency)
+            print(f"\n{args.quantity} units for a {args.urgency} {args.blood_type} request:")
+            for match in matches:
+                print(f"  {match.site}: {match.available} units of {match.blood_type}")
+            if not matches:
+                print("  no single site can fill it")
+    finally:
+        federation.close()
+
+
+if __name__ == "__main__":
+    main()
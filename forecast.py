@@ -0,0 +1,138 @@
+# Demand forecasts and reorder points per blood type, computed with NumPy.
+# The units requested per day and blood type come from request_rollups (see
+# migrations.add_request_rollups), read BATCH_SIZE rows at a time into arrays,
+# so a forecast costs the same however many requests there are and keeps
+# counting archived ones. On the [blood type, day] demand matrix:
+#
+#   level       moving average of the last AVERAGE_DAYS days
+#   baseline    demand on each weekday relative to the average day, over HISTORY_DAYS
+#   forecast    level x baseline for each of the next LEAD_DAYS days
+#   safety      SERVICE_Z standard deviations of the one-day forecast error, over the lead time
+#
+# The reorder point is the forecast plus the safety stock: a blood type whose
+# usable stock is at or below it should be ordered now. NumPy is only needed
+# here; the rest of BloodLink runs without it.
+#
+#   python bloodlink.py forecast --lead-days 3
+import json
+import math
+from datetime import date, timedelta
+from typing import NamedTuple
+
+import numpy as np
+
+import engine
+import metrics
+import readcache
+from engine import ValidationError
+
+# 52 whole weeks, so every weekday counts as often in the baseline
+HISTORY_DAYS = 364
+AVERAGE_DAYS = 28
+# Days between ordering units and having them on the shelf
+LEAD_DAYS = 3
+# Safety stock for a 95% chance of not running out during the lead time
+SERVICE_Z = 1.645
+BATCH_SIZE = 50000
+
+
+class Reorder(NamedTuple):
+    blood_type: str
+    stock: int              # usable units now
+    daily_demand: float     # moving average, units per day
+    lead_demand: float      # units expected over the lead time
+    safety_stock: float
+    reorder_point: int
+    days_of_cover: float    # stock / daily demand, None without demand
+    reorder: bool           # stock at or below the reorder point
+
+
+# Units requested per blood type (rows, in engine.BLOOD_TYPES order) and day
+# (columns, from start to end, both included) as a float array
+@metrics.timed("forecast.daily_demand")
+def daily_demand(start: date, end: date, conn=None, batch_size=BATCH_SIZE):
+    conn = conn or engine.get_connection()
+    days = (end - start).days + 1
+    demand = np.zeros(len(engine.BLOOD_TYPES) * days)
+    cursor = conn.execute('''SELECT types.key * ?4 + CAST(julianday(day) - julianday(?1) AS INTEGER), units
+                             FROM request_rollups JOIN json_each(?3) AS types ON types.value = blood_type
+                             WHERE day BETWEEN ?1 AND ?2''',
+                          (start.isoformat(), end.isoformat(), json.dumps(engine.BLOOD_TYPES), days))
+    try:
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                break
+            cells, units = np.array(batch, dtype=np.int64).T
+            demand += np.bincount(cells, weights=units, minlength=demand.size)
+            metrics.rows("forecast.daily_demand", len(batch))
+    finally:
+        cursor.close()
+    return demand.reshape(len(engine.BLOOD_TYPES), days)
+
+
+# Mean of each run of `window` days: column i averages days i to i + window - 1
+def moving_average(demand, window):
+    total = np.cumsum(np.pad(demand, ((0, 0), (1, 0))), axis=1)
+    return (total[:, window:] - total[:, :-window]) / window
+
+
+# Demand on each weekday (columns, Monday first) relative to the average day;
+# 1 for blood types without demand
+def weekday_baseline(demand, start: date):
+    weekdays = (start.weekday() + np.arange(demand.shape[1])) % 7
+    days = weekdays[:, None] == np.arange(7)
+    per_weekday = (demand @ days) / np.maximum(days.sum(axis=0), 1)
+    average = demand.mean(axis=1, keepdims=True)
+    return np.divide(per_weekday, average, out=np.ones_like(per_weekday), where=average > 0)
+
+
+def compute(demand, start: date, stock, average_days=AVERAGE_DAYS, lead_days=LEAD_DAYS,
+            service_z=SERVICE_Z) -> list:
+    days = demand.shape[1]
+    baseline = weekday_baseline(demand, start)
+    moving = moving_average(demand, average_days)
+    level = moving[:, -1]
+    # Forecast for each of the next lead_days days (the day after the history first)
+    ahead = (start.weekday() + days + np.arange(lead_days)) % 7
+    lead_demand = (level[:, None] * baseline[:, ahead]).sum(axis=1)
+    # Error of the forecast made from the average_days before each day of the history
+    weekdays = (start.weekday() + np.arange(average_days, days)) % 7
+    errors = demand[:, average_days:] - moving[:, :-1] * baseline[:, weekdays]
+    sigma = errors.std(axis=1) if errors.shape[1] > 1 else demand.std(axis=1)
+    safety = service_z * sigma * math.sqrt(lead_days)
+    reorder_points = np.ceil(lead_demand + safety).astype(int)
+
+    reorders = []
+    for index, blood_type in enumerate(engine.BLOOD_TYPES):
+        units = stock.get(blood_type) or 0
+        reorders.append(Reorder(blood_type, units, round(float(level[index]), 2),
+                                round(float(lead_demand[index]), 2), round(float(safety[index]), 2),
+                                int(reorder_points[index]),
+                                round(units / float(level[index]), 1) if level[index] > 0 else None,
+                                bool(reorder_points[index] > 0 and units <= reorder_points[index])))
+    return reorders
+
+
+# Reorder points of every blood type against the usable stock on `today`
+# (default: engine.utc_today(), the day request_rollups counts in), from the
+# demand of the history_days before it. Kept in the read cache until the next
+# write.
+@metrics.timed("forecast")
+def forecast(conn=None, today=None, history_days=HISTORY_DAYS, average_days=AVERAGE_DAYS, lead_days=LEAD_DAYS,
+             service_z=SERVICE_Z) -> list:
+    conn = conn or engine.get_connection()
+    today = today or engine.utc_today()
+    if not 7 <= average_days <= history_days:
+        raise ValidationError("Input Error", "The history must be at least as long as the average, "
+                                             "which must be at least 7 days.")
+    if lead_days < 1:
+        raise ValidationError("Input Error", "The lead time must be at least one day.")
+
+    def load():
+        # Today is not over, so the history ends yesterday
+        start = today - timedelta(days=history_days)
+        demand = daily_demand(start, today - timedelta(days=1), conn)
+        return compute(demand, start, engine.usable_stock(conn, today), average_days, lead_days, service_z)
+
+    return readcache.cached(conn, ("forecast", today, history_days, average_days, lead_days, service_z), load)
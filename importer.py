@@ -0,0 +1,173 @@
+# Bulk donor import from CSV or JSONL files.
+# Rows are streamed in batches, so memory stays flat however big the file is.
+# Every row goes through the same rules as the donor registration form, valid
+# rows are inserted with executemany (one transaction per batch) and rejected
+# rows are written to a report with the reason.
+#
+#   python bloodlink.py import donors.csv --rejects rejects.csv
+import csv
+import json
+import time
+from datetime import date
+from functools import lru_cache
+from itertools import islice
+from operator import itemgetter
+from typing import NamedTuple
+
+import engine
+from engine import ValidationError
+
+BATCH_SIZE = 10000
+
+# Columns the import file must provide, in validate_donor's argument order
+REQUIRED_COLUMNS = ("name", "gender", "dob", "blood_type", "contact", "email", "nationality",
+                    "emergency_contact_number")
+# Yes/no medical history answers; any truthy value rejects the donor
+MEDICAL_COLUMNS = ("transfusion", "chronic_illness", "allergies", "surgeries", "medication", "high_risk")
+OPTIONAL_COLUMNS = ("last_donation", "consent") + MEDICAL_COLUMNS + ("address", "emergency_contact_name")
+
+FALSE_VALUES = {"", "0", "no", "n", "false", "f", "none"}
+
+REJECT_FIELDS = ("line", "name", "title", "reason")
+
+
+class ImportResult(NamedTuple):
+    accepted: int
+    rejected: int
+    seconds: float
+
+    @property
+    def rows_per_sec(self):
+        total = self.accepted + self.rejected
+        return total / self.seconds if self.seconds else 0.0
+
+
+# Import files repeat a handful of flag spellings, so the parsed answers are cached
+@lru_cache(maxsize=1024)
+def is_yes(value):
+    return value.strip().lower() not in FALSE_VALUES
+
+@lru_cache(maxsize=1024)
+def has_medical_history(answers):
+    return any(is_yes(answer) for answer in answers)
+
+@lru_cache(maxsize=65536)
+def next_eligible_date(last_donation, today):
+    return engine.next_eligible_date(last_donation, today=today)
+
+
+def detect_format(path):
+    return "jsonl" if path.lower().endswith((".jsonl", ".ndjson", ".json")) else "csv"
+
+
+# Yield (line_number, row) for a CSV file, rows as string tuples in `columns` order
+def read_csv(path, columns):
+    with open(path, newline="", encoding="utf-8") as file:
+        reader = csv.reader(file, skipinitialspace=True)
+        header = [column.strip().lower() for column in next(reader, [])]
+        missing = [column for column in REQUIRED_COLUMNS if column not in header]
+        if missing:
+            raise ValueError(f"{path} is missing columns: {', '.join(missing)}")
+        # Optional columns the file does not have read an empty cell appended to every row
+        width = len(header)
+        pick = itemgetter(*[header.index(column) if column in header else width for column in columns])
+        for row in reader:
+            if not row:
+                continue
+            if len(row) != width:
+                row = (row + [""] * width)[:width]
+            row.append("")
+            yield reader.line_num, pick(row)
+
+
+def as_text(value):
+    if isinstance(value, str):
+        return value.strip()
+    return "" if value is None else str(value)
+
+
+# Yield (line_number, row) for a JSONL file; a line that is not a JSON object yields None
+def read_jsonl(path, columns):
+    with open(path, encoding="utf-8") as file:
+        for line_number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            if not isinstance(record, dict):
+                yield line_number, None
+                continue
+            yield line_number, tuple(as_text(record.get(column)) for column in columns)
+
+
+def read_rows(path, fmt=None):
+    columns = REQUIRED_COLUMNS + OPTIONAL_COLUMNS
+    if (fmt or detect_format(path)) == "jsonl":
+        return read_jsonl(path, columns)
+    return read_csv(path, columns)
+
+
+def batched(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+# Run the registration rules over a batch.
+# Returns (insert parameters for valid rows, [(line, name, title, reason)] for the rest)
+def validate_batch(batch, today=None):
+    accepted = []
+    rejected = []
+    today = today or date.today()
+    validate = engine.validate_donor
+    for line_number, row in batch:
+        if row is None:
+            rejected.append((line_number, "", "Input Error", "Line is not a JSON object."))
+            continue
+        name, gender, dob, blood_type, contact, email, nationality, emergency, last_donation, consent = row[:10]
+        address, emergency_name = row[16:18]
+        try:
+            validate(name, gender, dob, blood_type, contact, email, nationality, emergency,
+                     last_donation, (has_medical_history(row[10:16]),), is_yes(consent), today)
+        except ValidationError as error:
+            rejected.append((line_number, name, error.title, error.message))
+            continue
+        accepted.append((name, gender, dob, blood_type, contact, email, address, nationality, last_donation,
+                         emergency_name, emergency, next_eligible_date(last_donation, today)))
+    return accepted, rejected
+
+
+def insert_batch(conn, rows):
+    engine.retry_on_busy(lambda: engine.bulk_insert_donors(conn, rows))
+
+
+# Import donors from a CSV or JSONL file, writing rejected rows to reject_path (CSV) if given
+def import_donors(path, conn=None, reject_path=None, fmt=None, batch_size=BATCH_SIZE) -> ImportResult:
+    conn = conn or engine.get_connection()
+    accepted = rejected = 0
+    started = time.perf_counter()
+
+    reject_file = open(reject_path, "w", newline="", encoding="utf-8") if reject_path else None
+    try:
+        reject_writer = csv.writer(reject_file) if reject_file else None
+        if reject_writer:
+            reject_writer.writerow(REJECT_FIELDS)
+
+        for batch in batched(read_rows(path, fmt), batch_size):
+            rows, rejects = validate_batch(batch)
+            if rows:
+                insert_batch(conn, rows)
+            if reject_writer and rejects:
+                reject_writer.writerows(rejects)
+            accepted += len(rows)
+            rejected += len(rejects)
+    finally:
+        if reject_file:
+            reject_file.close()
+
+    return ImportResult(accepted, rejected, time.perf_counter() - started)
@@ -0,0 +1,194 @@
+# Virtual Treeview for the donor and blood request listings.
+# Only a sliding window of a few pages is kept in the tree. Scrolling near the
+# bottom fetches the next page with keyset pagination and drops the oldest one,
+# scrolling near the top does the reverse. Sorting (click a heading) and the
+# filter boxes are pushed down into the SQL query, as is the search box of
+# listings with a full-text index. With a DatabaseWorker the pages are fetched
+# on its thread and added to the tree when they arrive.
+import tkinter as tk
+from tkinter import messagebox, ttk
+
+import engine
+
+ALL = "All"
+# ms to wait after the last keystroke in the search box before searching
+SEARCH_DELAY = 250
+
+
+class PagedTreeview:
+    # headings: [(column, heading text, width)] in the order of engine.LISTINGS[table]
+    # filters: {filter name: (label, values)} for the filter comboboxes
+    # search: label of a search box (listings in engine.SEARCH_INDEXES only)
+    def __init__(self, parent, table, headings, filters=None, search=None, page_size=engine.PAGE_SIZE,
+                 window_pages=5, conn=None, worker=None):
+        self.table = table
+        self.page_size = page_size
+        self.window_pages = window_pages
+        self.conn = conn
+        self.worker = worker
+        self.generation = 0       # bumped on reload so pages of an old query are dropped
+        self.sort = None
+        self.descending = False
+        self.filter_vars = {}
+        self.search_var = None
+        self.search_job = None
+        self.pages = []           # item ids of each page currently in the tree, top to bottom
+        self.rows = {}            # item id -> row as read from the database
+        self.at_start = True      # the first page in the tree is the first page of the listing
+        self.at_end = False       # the last page in the tree is the last page of the listing
+        self.loading = False
+
+        self.frame = tk.Frame(parent)
+        self.frame.grid_rowconfigure(1, weight=1)
+        self.frame.grid_columnconfigure(0, weight=1)
+
+        # Filter boxes
+        filter_bar = tk.Frame(self.frame)
+        filter_bar.grid(row=0, column=0, columnspan=2, sticky="w", pady=(0, 5))
+        for position, (name, (label, values)) in enumerate((filters or {}).items()):
+            var = tk.StringVar(value=ALL)
+            tk.Label(filter_bar, text=label).grid(row=0, column=position * 2, padx=(0, 5))
+            box = ttk.Combobox(filter_bar, textvariable=var, values=[ALL] + list(values), state="readonly", width=12)
+            box.grid(row=0, column=position * 2 + 1, padx=(0, 15))
+            box.bind("<<ComboboxSelected>>", lambda e: self.reload())
+            self.filter_vars[name] = var
+        if search:
+            self.search_var = tk.StringVar()
+            position = len(self.filter_vars) * 2
+            tk.Label(filter_bar, text=search).grid(row=0, column=position, padx=(0, 5))
+            entry = tk.Entry(filter_bar, textvariable=self.search_var, width=30)
+            entry.grid(row=0, column=position + 1)
+            entry.bind("<KeyRelease>", self.search_changed)
+
+        columns = [column for column, _, _ in headings]
+        self.tree = ttk.Treeview(self.frame, columns=columns, show="headings")
+        for column, text, width in headings:
+            self.tree.heading(column, text=text, command=lambda c=column: self.sort_by(c))
+            self.tree.column(column, width=width, anchor="center")
+        self.headings = {column: text for column, text, _ in headings}
+
+        self.scrollbar = tk.Scrollbar(self.frame, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self.on_scroll)
+        self.tree.grid(row=1, column=0, sticky="nsew")
+        self.scrollbar.grid(row=1, column=1, sticky="ns")
+
+        self.reload()
+
+    def grid(self, **kwargs):
+        self.frame.grid(**kwargs)
+
+    def filters(self):
+        return {name: var.get() for name, var in self.filter_vars.items() if var.get() != ALL}
+
+    def search(self):
+        return self.search_var.get().strip() if self.search_var else None
+
+    # Search once typing pauses rather than on every key
+    def search_changed(self, event=None):
+        if self.search_job:
+            self.frame.after_cancel(self.search_job)
+        self.search_job = self.frame.after(SEARCH_DELAY, self.reload)
+
+    # Fetch a page and hand it to callback, through the worker when there is one
+    def fetch(self, callback, after=None, before=None):
+        generation = self.generation
+        kwargs = dict(sort=self.sort, descending=self.descending, filters=self.filters(),
+                      after=after, before=before, limit=self.page_size, search=self.search())
+
+        def arrived(rows):
+            if generation == self.generation:
+                callback(rows)
+
+        if self.worker is None:
+            arrived(engine.fetch_page(self.table, conn=self.conn, **kwargs))
+        else:
+            self.worker.submit(engine.fetch_page, self.table, callback=arrived,
+                               error_callback=self.failed, **kwargs)
+
+    def failed(self, error):
+        self.loading = False
+        messagebox.showerror("Database Error", f"Could not load the list: {error}")
+
+    # Keyset position of a row in the tree, from the typed row rather than the Tk strings
+    def key_of(self, item):
+        return engine.page_key(self.table, self.rows[item], self.sort)
+
+    # Start again from the first page (after a sort or filter change)
+    def reload(self):
+        self.search_job = None
+        self.tree.delete(*self.tree.get_children())
+        self.pages = []
+        self.rows = {}
+        self.at_start = True
+        self.at_end = False
+        self.generation += 1
+        self.loading = True
+        self.fetch(self.first_page)
+
+    def first_page(self, rows):
+        self.append_page(rows)
+        self.tree.yview_moveto(0)
+        self.loading = False
+
+    def insert_rows(self, rows, index):
+        items = []
+        for offset, row in enumerate(rows):
+            item = self.tree.insert("", index if index == "end" else index + offset, values=row)
+            self.rows[item] = row
+            items.append(item)
+        return items
+
+    def drop_page(self, items):
+        self.tree.delete(*items)
+        for item in items:
+            del self.rows[item]
+
+    def append_page(self, rows):
+        if len(rows) < self.page_size:
+            self.at_end = True
+        if rows:
+            self.pages.append(self.insert_rows(rows, "end"))
+        if len(self.pages) > self.window_pages:
+            self.drop_page(self.pages.pop(0))
+            self.at_start = False
+
+    def prepend_page(self, rows):
+        if len(rows) < self.page_size:
+            self.at_start = True
+        if rows:
+            self.pages.insert(0, self.insert_rows(rows, 0))
+        if len(self.pages) > self.window_pages:
+            self.drop_page(self.pages.pop())
+            self.at_end = False
+
+    def sort_by(self, column):
+        if self.sort == column:
+            self.descending = not self.descending
+        else:
+            self.sort, self.descending = column, False
+        for name, text in self.headings.items():
+            arrow = (" ▼" if self.descending else " ▲") if name == column else ""
+            self.tree.heading(name, text=text + arrow)
+        self.reload()
+
+    # Treeview scroll callback: move the scrollbar and fetch more rows near either end
+    def on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        if self.loading or not self.pages:
+            return
+        if float(last) > 0.9 and not self.at_end:
+            self.loading = True
+            self.fetch(lambda rows: self.page_arrived(self.append_page, rows),
+                       after=self.key_of(self.pages[-1][-1]))
+        elif float(first) < 0.1 and not self.at_start:
+            self.loading = True
+            self.fetch(lambda rows: self.page_arrived(self.prepend_page, rows),
+                       before=self.key_of(self.pages[0][0]))
+
+    # Add a page while keeping the row at the top of the view in sight
+    def page_arrived(self, add_page, rows):
+        anchor = self.tree.identify_row(1)
+        add_page(rows)
+        if anchor and self.tree.exists(anchor):
+            self.tree.see(anchor)
+        self.loading = False
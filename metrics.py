@@ -0,0 +1,343 @@
+# In-process instrumentation of the hot paths.
+# Operations (submit_request, register_donor, the listing queries, the GUI
+# handlers and their phases) are timed into fixed-bucket latency histograms.
+# Every connection from engine.connect() also reports to the operation
+# running on its thread:
+#   - the trace callback counts statements by kind (SELECT, UPDATE, INSERT,
+#     COMMIT, ...) and times each one from its start to the start of the next
+#     statement or the end of the operation;
+#   - the progress handler counts SQLite VM steps, a measure of how many rows
+#     a statement had to scan;
+#   - engine reports the rows it returned.
+# Every outermost operation is timed, but only one in SAMPLE_EVERY is broken
+# down into phases and statements, which keeps the cost low enough to leave
+# on; set BLOODLINK_METRICS=0 to turn it all off. snapshot() and prometheus()
+# export the figures; PeriodicDump writes them to a file.
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+ENABLED = os.environ.get("BLOODLINK_METRICS", "1") != "0"
+
+# Histogram bucket upper bounds in seconds (the last bucket is +Inf)
+BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# SQLite VM instructions between progress handler calls
+PROGRESS_STEPS = 1000
+# Outermost operations broken down per sample (1 records every one)
+SAMPLE_DEFAULT = 8
+
+
+# BLOODLINK_METRICS_SAMPLE as a whole number of at least 1; the default if it is not a number
+def _sample_every(value):
+    try:
+        return max(1, int(value))
+    except (TypeError, ValueError):
+        return SAMPLE_DEFAULT
+
+
+SAMPLE_EVERY = _sample_every(os.environ.get("BLOODLINK_METRICS_SAMPLE", SAMPLE_DEFAULT))
+
+OPERATION_SECONDS = "bloodlink_operation_seconds"
+STATEMENT_SECONDS = "bloodlink_statement_seconds"
+STATEMENTS = "bloodlink_statements_total"
+VM_STEPS = "bloodlink_sqlite_vm_steps_total"
+ROWS_RETURNED = "bloodlink_rows_returned_total"
+CACHE_LOOKUPS = "bloodlink_cache_lookups_total"
+BACKUP_LOCK_SECONDS = "bloodlink_backup_lock_seconds"
+
+HELP = {
+    OPERATION_SECONDS: "Latency of BloodLink operations and their phases.",
+    STATEMENT_SECONDS: "Time from the start of an SQL statement to the next statement or the end of the operation.",
+    STATEMENTS: "SQL statements executed, by operation and kind.",
+    VM_STEPS: "SQLite virtual machine steps (rows scanned), by operation.",
+    ROWS_RETURNED: "Rows returned to the caller, by operation.",
+    CACHE_LOOKUPS: "Read cache lookups, by cached data and hit or miss.",
+    BACKUP_LOCK_SECONDS: "Time each online backup step held its read lock on the database.",
+}
+
+_lock = threading.Lock()
+_histograms = {}     # (metric, labels) -> Histogram
+_counters = {}       # (metric, labels) -> int
+_timers = {}
+_statement_key_cache = {}
+
+
+class Histogram:
+    __slots__ = ("buckets", "count", "sum", "max")
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.buckets[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    # Upper bound of the bucket holding the q-th quantile
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                return BUCKETS[index] if index < len(BUCKETS) else self.max
+        return self.max
+
+
+def _histogram(key):
+    histogram = _histograms.get(key)
+    if histogram is None:
+        with _lock:
+            histogram = _histograms.setdefault(key, Histogram())
+    return histogram
+
+
+def observe(metric, labels, seconds):
+    if ENABLED:
+        histogram = _histogram((metric, labels))
+        with _lock:
+            histogram.observe(seconds)
+
+
+def count(metric, labels, value=1):
+    if ENABLED:
+        key = (metric, labels)
+        with _lock:
+            _counters[key] = _counters.get(key, 0) + value
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+# Operations
+
+class _ThreadState(threading.local):
+    def __init__(self):
+        self.stack = []          # (operation, started) of the operations running on this thread
+        self.statement = None    # (keys, started) of the statement running in the innermost one
+        self.operations = 0      # outermost operations started on this thread
+        self.sampled = True      # whether the current outermost operation is broken down
+        self.skipped = 0         # nested timers not recorded because it is not
+
+
+_local = _ThreadState()
+
+
+def current_operation():
+    stack = _local.stack
+    return stack[-1][0] if stack else "none"
+
+
+class _Timer:
+    __slots__ = ("operation", "key")
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.key = (OPERATION_SECONDS, (("operation", operation),))
+
+    def __enter__(self):
+        if ENABLED:
+            state = _local
+            if not state.stack:
+                state.operations += 1
+                state.sampled = state.operations % SAMPLE_EVERY == 0
+            elif not state.sampled:
+                state.skipped += 1
+                return self
+            now = time.perf_counter()
+            if state.statement is not None:
+                _end_statement(state, now)
+            state.stack.append((self.operation, now))
+        return self
+
+    def __exit__(self, *exc):
+        if ENABLED:
+            state = _local
+            if state.skipped:
+                state.skipped -= 1
+                return False
+            now = time.perf_counter()
+            if state.statement is not None:
+                _end_statement(state, now)
+            _, started = state.stack.pop()
+            histogram = _histogram(self.key)
+            with _lock:
+                histogram.observe(now - started)
+        return False
+
+
+# with metrics.timer("submit_request.insert"): ...
+def timer(operation):
+    timer = _timers.get(operation)
+    if timer is None:
+        timer = _timers[operation] = _Timer(operation)
+    return timer
+
+
+# Decorator form of timer()
+def timed(operation):
+    def decorate(fn):
+        operation_timer = timer(operation)
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with operation_timer:
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def rows(operation, value):
+    count(ROWS_RETURNED, (("operation", operation),), value)
+
+
+# SQLite hooks
+
+def _statement_keys(operation, kind):
+    keys = _statement_key_cache.get((operation, kind))
+    if keys is None:
+        labels = (("operation", operation), ("statement", kind))
+        keys = _statement_key_cache[operation, kind] = ((STATEMENTS, labels), (STATEMENT_SECONDS, labels))
+    return keys
+
+
+def _end_statement(state, now):
+    (_, time_key), started = state.statement
+    state.statement = None
+    histogram = _histogram(time_key)
+    with _lock:
+        histogram.observe(now - started)
+
+
+# Statements outside an operation are not recorded, nor the "-- TRIGGER"
+# lines, which belong to the statement that fired the trigger
+def _on_statement(sql):
+    state = _local
+    if not state.stack or not state.sampled or sql.startswith("--"):
+        return
+    now = time.perf_counter()
+    words = sql.split(None, 1)
+    keys = _statement_keys(state.stack[-1][0], words[0].upper() if words else "EMPTY")
+    with _lock:
+        _counters[keys[0]] = _counters.get(keys[0], 0) + 1
+    if state.statement is not None:
+        _end_statement(state, now)
+    state.statement = (keys, now)
+
+
+def _on_progress():
+    if _local.stack and _local.sampled:
+        count(VM_STEPS, (("operation", current_operation()),), PROGRESS_STEPS)
+    return 0
+
+
+# Attach the statement hooks to a connection (engine.connect does this)
+def instrument(conn):
+    if ENABLED:
+        conn.set_trace_callback(_on_statement)
+        conn.set_progress_handler(_on_progress, PROGRESS_STEPS)
+    return conn
+
+
+# Export
+
+def _labels_text(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+def snapshot():
+    with _lock:
+        histograms = [(metric, labels, list(h.buckets), h.count, h.sum, h.max, h.quantile(0.5),
+                       h.quantile(0.95), h.quantile(0.99))
+                      for (metric, labels), h in sorted(_histograms.items())]
+        counters = sorted(_counters.items())
+    return {
+        "timestamp": time.time(),
+        "histograms": [
+            {"name": metric, "labels": dict(labels), "count": total, "sum_seconds": sum_,
+             "max_seconds": max_, "p50_seconds": p50, "p95_seconds": p95, "p99_seconds": p99,
+             "buckets": dict(zip([str(bound) for bound in BUCKETS] + ["+Inf"], buckets))}
+            for metric, labels, buckets, total, sum_, max_, p50, p95, p99 in histograms
+        ],
+        "counters": [{"name": metric, "labels": dict(labels), "value": value}
+                     for (metric, labels), value in counters],
+    }
+
+
+# Prometheus text exposition format
+def prometheus():
+    with _lock:
+        histograms = [(key, list(h.buckets), h.count, h.sum) for key, h in sorted(_histograms.items())]
+        counters = sorted(_counters.items())
+
+    lines = []
+    typed = set()
+    for (metric, labels), buckets, total, sum_ in histograms:
+        if metric not in typed:
+            typed.add(metric)
+            lines.append(f"# HELP {metric} {HELP.get(metric, metric)}")
+            lines.append(f"# TYPE {metric} histogram")
+        cumulative = 0
+        for bound, bucket in zip(list(BUCKETS) + ["+Inf"], buckets):
+            cumulative += bucket
+            lines.append(f"{metric}_bucket{_labels_text(labels, [('le', bound)])} {cumulative}")
+        lines.append(f"{metric}_sum{_labels_text(labels)} {sum_}")
+        lines.append(f"{metric}_count{_labels_text(labels)} {total}")
+    for (metric, labels), value in counters:
+        if metric not in typed:
+            typed.add(metric)
+            lines.append(f"# HELP {metric} {HELP.get(metric, metric)}")
+            lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric}{_labels_text(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# Write the figures to path every `interval` seconds (JSON, or Prometheus
+# text when the file name ends in .prom). The file is replaced atomically so
+# a collector never reads half a dump.
+class PeriodicDump(threading.Thread):
+    def __init__(self, path, interval=60.0, fmt=None):
+        super().__init__(name="bloodlink-metrics", daemon=True)
+        self.path = path
+        self.interval = interval
+        self.fmt = fmt or ("prometheus" if path.endswith(".prom") else "json")
+        self.stopped = threading.Event()
+
+    def write(self):
+        text = prometheus() if self.fmt == "prometheus" else json.dumps(snapshot(), indent=2)
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w") as f:
+            f.write(text)
+        os.replace(temporary, self.path)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.write()
+
+
+def start_dump(path, interval=60.0, fmt=None):
+    dump = PeriodicDump(path, interval, fmt)
+    dump.start()
+    return dump
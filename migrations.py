@@ -0,0 +1,504 @@
+# Versioned schema migrations, tracked in SQLite's user_version.
+# Each entry of MIGRATIONS upgrades the schema by one version; connect() runs
+# the ones a database has not seen yet, so existing blood_donation_platform.db
+# files are upgraded in place. New schema changes are appended to the list,
+# never edited once released.
+#
+#   python bloodlink.py migrate
+#   python migrations.py --benchmark --rows 1000000
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+# Pragmas applied to every connection. WAL lets readers run while a write is
+# in progress; synchronous=NORMAL is safe in WAL mode and avoids an fsync per
+# commit; cache_size is in KiB when negative. auto_vacuum only takes effect
+# on a new database (or after a VACUUM): pages freed by archive.py are then
+# given back to the file system with incremental_vacuum.
+PRAGMAS = {
+    "auto_vacuum": "INCREMENTAL",
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -16000,
+    "mmap_size": 268435456,
+    "temp_store": "MEMORY",
+}
+
+
+# Version 1: the original tables (already present in older databases)
+def create_tables(conn):
+    #display donors
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS donors (
+        donor_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT,
+        dob TEXT,
+        blood_type TEXT,
+        contact TEXT
+    )''')
+    #blood stock
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS blood_stock (
+        blood_type TEXT PRIMARY KEY,
+        quantity INTEGER
+    )''')
+    #blood requests
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS blood_requests (
+        request_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        requestor_name TEXT,
+        contact_number TEXT,
+        email_address TEXT,
+        blood_type_required TEXT,
+        quantity_needed INTEGER,
+        urgency TEXT,
+        patient_name TEXT,
+        datetime TEXT DEFAULT CURRENT_TIMESTAMP,
+        status TEXT
+    )''')
+
+
+# Version 2: secondary indexes for the status, blood type and date lookups and
+# for the listing filters and sorts
+def add_lookup_indexes(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_donors_blood_type ON donors (blood_type)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_donors_name ON donors (name)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_requests_status ON blood_requests (status, datetime)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_requests_blood_type ON blood_requests (blood_type_required, status)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_requests_urgency ON blood_requests (urgency)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_requests_datetime ON blood_requests (datetime)")
+
+
+# Version 3: pending-request queue. priority orders requests by urgency
+# (0 = Critical, 1 = Urgent, 2 = Normal) and the partial index holds only
+# Pending rows, in the order the allocator serves them.
+def add_pending_queue(conn):
+    conn.execute("ALTER TABLE blood_requests ADD COLUMN priority INTEGER")
+    conn.execute('''UPDATE blood_requests SET priority = CASE urgency
+                        WHEN 'Critical' THEN 0 WHEN 'Urgent' THEN 1 ELSE 2 END''')
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_requests_pending_queue
+                    ON blood_requests (blood_type_required, priority, datetime, request_id, quantity_needed)
+                    WHERE status = 'Pending'""")
+
+
+# Version 4: the donor blood type a request was fulfilled with, which can be
+# a compatible substitute for the type requested
+def add_fulfilled_with(conn):
+    conn.execute("ALTER TABLE blood_requests ADD COLUMN fulfilled_with TEXT")
+    conn.execute("UPDATE blood_requests SET fulfilled_with = blood_type_required WHERE status = 'Fulfilled'")
+
+
+# Version 5: donor search. donors_fts is an FTS5 index of name and contact
+# over the donors table (external content, so the text is not stored twice)
+# with prefix indexes for up to 4 characters; triggers keep it in step with
+# donors. Bulk loads set donors_fts_sync.paused inside their transaction and
+# index the new rows in one statement instead (until version 11, see
+# trim_donor_indexes). Contact numbers are left out since version 13.
+# (blood_type, name) serves a blood type filter sorted by name.
+def add_donor_search(conn):
+    conn.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS donors_fts USING fts5(
+                        name, contact, content='donors', content_rowid='donor_id', prefix='1 2 3 4')""")
+    conn.execute("CREATE TABLE IF NOT EXISTS donors_fts_sync (paused INTEGER NOT NULL)")
+    conn.execute("INSERT INTO donors_fts_sync (paused) VALUES (0)")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS donors_fts_insert AFTER INSERT ON donors
+                    WHEN (SELECT paused FROM donors_fts_sync) = 0 BEGIN
+                        INSERT INTO donors_fts (rowid, name, contact) VALUES (new.donor_id, new.name, new.contact);
+                    END""")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS donors_fts_delete AFTER DELETE ON donors BEGIN
+                        INSERT INTO donors_fts (donors_fts, rowid, name, contact)
+                        VALUES ('delete', old.donor_id, old.name, old.contact);
+                    END""")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS donors_fts_update AFTER UPDATE OF name, contact ON donors BEGIN
+                        INSERT INTO donors_fts (donors_fts, rowid, name, contact)
+                        VALUES ('delete', old.donor_id, old.name, old.contact);
+                        INSERT INTO donors_fts (rowid, name, contact) VALUES (new.donor_id, new.name, new.contact);
+                    END""")
+    conn.execute("INSERT INTO donors_fts (donors_fts) VALUES ('rebuild')")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_donors_blood_type_name ON donors (blood_type, name)")
+
+
+# Version 6: the rest of the registration form, and the date each donor may
+# give blood again (last donation plus the donation interval, or the day of
+# registration). (blood_type, next_eligible_date) answers "donors of type X
+# who can donate today" with one range scan. Existing donors have no
+# donation on record and are eligible from now.
+def add_donor_profile(conn):
+    for column in ("gender", "email", "address", "nationality", "last_donation", "emergency_contact_name",
+                   "emergency_contact_number", "next_eligible_date"):
+        conn.execute(f"ALTER TABLE donors ADD COLUMN {column} TEXT")
+    conn.execute("UPDATE donors SET next_eligible_date = date('now')")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_donors_eligible ON donors (blood_type, next_eligible_date)")
+
+
+# Movements between stock checkpoints (see add_stock_ledger)
+CHECKPOINT_EVERY = 1000
+
+
+# Version 7: stock ledger. Every receipt, issue and adjustment is a row of
+# stock_movements, which triggers keep append-only; blood_stock becomes the
+# balance materialized from it, updated by a trigger on each movement. Every
+# CHECKPOINT_EVERY movements the trigger also copies the balances into
+# stock_checkpoints, so the stock as of a past time replays at most that many
+# movements (engine.stock_as_of). Existing stock is carried over as
+# 'opening' movements.
+def add_stock_ledger(conn):
+    conn.execute("""CREATE TABLE IF NOT EXISTS stock_movements (
+                        movement_id INTEGER PRIMARY KEY,
+                        blood_type TEXT NOT NULL,
+                        delta INTEGER NOT NULL,
+                        kind TEXT NOT NULL,
+                        request_id INTEGER,
+                        note TEXT,
+                        at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))
+                    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_stock_movements_at ON stock_movements (at)")
+    conn.execute("""CREATE TABLE IF NOT EXISTS stock_checkpoints (
+                        movement_id INTEGER NOT NULL,
+                        at TEXT NOT NULL,
+                        blood_type TEXT NOT NULL,
+                        quantity INTEGER NOT NULL,
+                        PRIMARY KEY (movement_id, blood_type)
+                    ) WITHOUT ROWID""")
+    conn.execute("""INSERT INTO stock_movements (blood_type, delta, kind)
+                    SELECT blood_type, COALESCE(quantity, 0), 'opening' FROM blood_stock ORDER BY blood_type""")
+    conn.execute("""INSERT INTO stock_checkpoints (movement_id, at, blood_type, quantity)
+                    SELECT (SELECT COALESCE(MAX(movement_id), 0) FROM stock_movements),
+                           strftime('%Y-%m-%d %H:%M:%f', 'now'), blood_type, COALESCE(quantity, 0)
+                    FROM blood_stock""")
+    conn.execute(f"""CREATE TRIGGER IF NOT EXISTS stock_movements_apply AFTER INSERT ON stock_movements BEGIN
+                        INSERT INTO blood_stock (blood_type, quantity) VALUES (new.blood_type, new.delta)
+                        ON CONFLICT (blood_type) DO UPDATE SET quantity = COALESCE(quantity, 0) + excluded.quantity;
+                        INSERT INTO stock_checkpoints (movement_id, at, blood_type, quantity)
+                        SELECT new.movement_id, new.at, blood_type, quantity FROM blood_stock
+                        WHERE new.movement_id % {CHECKPOINT_EVERY} = 0;
+                    END""")
+    for action in ("UPDATE", "DELETE"):
+        conn.execute(f"""CREATE TRIGGER IF NOT EXISTS stock_movements_no_{action.lower()}
+                         BEFORE {action} ON stock_movements BEGIN
+                             SELECT RAISE(ABORT, 'stock_movements is append-only');
+                         END""")
+
+
+# Version 8: units as lots with a collection and expiry date. Lots still
+# holding units are the partial index idx_stock_lots_fefo, ordered by expiry
+# within each blood type, so the units to issue next are always at the head
+# of their blood type's range; idx_stock_lots_expiry finds the lots the
+# expiry sweep retires. Movements name the lot they came from or went to.
+# The stock already held becomes one lot per blood type with an unknown
+# collection date, expiring 42 days from now.
+def add_stock_lots(conn):
+    conn.execute("""CREATE TABLE IF NOT EXISTS stock_lots (
+                        lot_id INTEGER PRIMARY KEY,
+                        blood_type TEXT NOT NULL,
+                        quantity INTEGER NOT NULL,
+                        collected_on TEXT,
+                        expires_on TEXT NOT NULL,
+                        received_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))
+                    )""")
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_stock_lots_fefo ON stock_lots (blood_type, expires_on, lot_id)
+                    WHERE quantity > 0""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_stock_lots_expiry ON stock_lots (expires_on) WHERE quantity > 0")
+    conn.execute("ALTER TABLE stock_movements ADD COLUMN lot_id INTEGER")
+    conn.execute("""INSERT INTO stock_lots (blood_type, quantity, expires_on)
+                    SELECT blood_type, quantity, date('now', '+42 days') FROM blood_stock WHERE quantity > 0
+                    ORDER BY blood_type""")
+
+
+ROLLUP_COLUMNS = ("day", "blood_type", "urgency", "status", "requests", "units", "fulfil_seconds", "fulfil_count")
+
+
+# A request's contribution to its request_rollups row, one expression per
+# ROLLUP_COLUMNS, for a row alias (new/old in the triggers, the table in the
+# backfill); sign "-" takes it away. The time to fulfil only counts requests
+# whose fulfilment time is known.
+def _rollup_values(row, sign=""):
+    timed = f"{row}.status = 'Fulfilled' AND {row}.fulfilled_at IS NOT NULL"
+    return [f"date({row}.datetime)", f"{row}.blood_type_required", f"{row}.urgency", f"{row}.status",
+            f"{sign}1", f"{sign}{row}.quantity_needed",
+            f"{sign}CASE WHEN {timed} THEN (julianday({row}.fulfilled_at) - julianday({row}.datetime)) * 86400 "
+            f"ELSE 0 END",
+            f"{sign}CASE WHEN {timed} THEN 1 ELSE 0 END"]
+
+
+def _rollup_insert(row, sign=""):
+    return (f"INSERT INTO request_rollups ({', '.join(ROLLUP_COLUMNS)}) "
+            f"VALUES ({', '.join(_rollup_values(row, sign))}) "
+            "ON CONFLICT (day, blood_type, urgency, status) DO UPDATE SET "
+            + ", ".join(f"{column} = {column} + excluded.{column}" for column in ROLLUP_COLUMNS[4:]))
+
+
+# Recompute every rollup row from blood_requests
+_KEY_COLUMNS = ", ".join(ROLLUP_COLUMNS[:4])
+ROLLUP_BACKFILL = (f"INSERT INTO request_rollups ({', '.join(ROLLUP_COLUMNS)}) "
+                   f"SELECT {_KEY_COLUMNS}, {', '.join(f'SUM({column})' for column in ROLLUP_COLUMNS[4:])} "
+                   "FROM (SELECT "
+                   + ", ".join(f"{value} AS {column}"
+                               for value, column in zip(_rollup_values("blood_requests"), ROLLUP_COLUMNS))
+                   + f" FROM blood_requests) GROUP BY {_KEY_COLUMNS}")
+
+
+# Version 9: reporting rollups. request_rollups holds, per request day, blood
+# type, urgency and status, the number of requests, the units asked for and
+# the total time to fulfil, so reports read a few rows per day instead of
+# grouping the whole of blood_requests. Triggers move a request's counts on
+# every insert and every change of status (or of any other counted column);
+# rows deleted from blood_requests stay counted. fulfilled_at is when a
+# request was fulfilled; requests already Fulfilled were fulfilled on
+# submission as far as we know.
+def add_request_rollups(conn):
+    conn.execute("ALTER TABLE blood_requests ADD COLUMN fulfilled_at TEXT")
+    conn.execute("UPDATE blood_requests SET fulfilled_at = datetime WHERE status = 'Fulfilled'")
+    conn.execute("""CREATE TABLE IF NOT EXISTS request_rollups (
+                        day TEXT NOT NULL,
+                        blood_type TEXT NOT NULL,
+                        urgency TEXT NOT NULL,
+                        status TEXT NOT NULL,
+                        requests INTEGER NOT NULL,
+                        units INTEGER NOT NULL,
+                        fulfil_seconds REAL NOT NULL,
+                        fulfil_count INTEGER NOT NULL,
+                        PRIMARY KEY (day, blood_type, urgency, status)
+                    ) WITHOUT ROWID""")
+    conn.execute(ROLLUP_BACKFILL)
+    conn.execute(f"""CREATE TRIGGER IF NOT EXISTS request_rollups_insert AFTER INSERT ON blood_requests BEGIN
+                        {_rollup_insert("new")};
+                    END""")
+    conn.execute(f"""CREATE TRIGGER IF NOT EXISTS request_rollups_update
+                    AFTER UPDATE OF status, fulfilled_at, datetime, blood_type_required, urgency, quantity_needed
+                    ON blood_requests BEGIN
+                        {_rollup_insert("old", "-")};
+                        {_rollup_insert("new")};
+                    END""")
+
+
+# Version 10: outbox of donor call-outs. A Critical request saved as Pending
+# gets a callout_outbox row from a trigger, in the transaction that saves the
+# request, and callouts.py sends the notifications from there. There is one
+# callout_notifications row per donor called for a request, so a retry never
+# calls a donor twice; (donor_id, sent_at) finds the donors called recently.
+# Requests already pending are not called out.
+def add_callout_outbox(conn):
+    conn.execute("""CREATE TABLE IF NOT EXISTS callout_outbox (
+                        event_id INTEGER PRIMARY KEY,
+                        request_id INTEGER NOT NULL UNIQUE,
+                        blood_type TEXT NOT NULL,
+                        quantity INTEGER NOT NULL,
+                        created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                        status TEXT NOT NULL DEFAULT 'queued',
+                        attempts INTEGER NOT NULL DEFAULT 0,
+                        next_attempt_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                        last_error TEXT
+                    )""")
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_callout_outbox_due ON callout_outbox (next_attempt_at, event_id)
+                    WHERE status = 'queued'""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS callout_notifications (
+                        request_id INTEGER NOT NULL,
+                        donor_id INTEGER NOT NULL,
+                        status TEXT NOT NULL DEFAULT 'queued',
+                        attempts INTEGER NOT NULL DEFAULT 0,
+                        sent_at TEXT,
+                        last_error TEXT,
+                        PRIMARY KEY (request_id, donor_id)
+                    ) WITHOUT ROWID""")
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_callout_notifications_donor
+                    ON callout_notifications (donor_id, sent_at)""")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS callout_outbox_insert AFTER INSERT ON blood_requests
+                    WHEN new.status = 'Pending' AND new.urgency = 'Critical' BEGIN
+                        INSERT OR IGNORE INTO callout_outbox (request_id, blood_type, quantity)
+                        VALUES (new.request_id, new.blood_type_required, new.quantity_needed);
+                    END""")
+
+
+# Version 11: cheaper donor inserts. idx_donors_blood_type is covered by
+# idx_donors_blood_type_name and idx_donors_eligible and only cost a b-tree
+# update per insert. The search trigger loses its pause switch, a lookup per
+# inserted row: bulk loads drop the trigger inside their transaction instead
+# (engine.bulk_insert_donors).
+def trim_donor_indexes(conn):
+    conn.execute("DROP INDEX IF EXISTS idx_donors_blood_type")
+    conn.execute("DROP TRIGGER IF EXISTS donors_fts_insert")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS donors_fts_insert AFTER INSERT ON donors BEGIN
+                        INSERT INTO donors_fts (rowid, name, contact) VALUES (new.donor_id, new.name, new.contact);
+                    END""")
+    conn.execute("DROP TABLE IF EXISTS donors_fts_sync")
+
+
+# Version 12: numbers in the donor search match the start of the contact number
+# through this index, a range scan instead of the full-text index's prefix
+# lists (see engine.number_search). With the blood type in the index a search
+# filtered on one only reads the rows of the page it returns.
+def add_contact_index(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_donors_contact ON donors (contact, blood_type)")
+
+
+# Search indexing of a new donor (see index_names_only)
+DONOR_FTS_INSERT = """CREATE TRIGGER IF NOT EXISTS donors_fts_insert AFTER INSERT ON donors BEGIN
+                          INSERT INTO donors_fts (rowid, name) VALUES (new.donor_id, new.name);
+                      END"""
+
+
+# Version 13: donors_fts indexes the name only. Contact numbers are searched
+# through idx_donors_contact since version 12, and their prefix lists were a
+# third of the cost of indexing a donor. The table is created again and
+# filled in one pass.
+def index_names_only(conn):
+    for trigger in ("donors_fts_insert", "donors_fts_delete", "donors_fts_update"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    conn.execute("DROP TABLE IF EXISTS donors_fts")
+    conn.execute("""CREATE VIRTUAL TABLE donors_fts USING fts5(
+                        name, content='donors', content_rowid='donor_id', prefix='1 2 3 4')""")
+    conn.execute(DONOR_FTS_INSERT)
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS donors_fts_delete AFTER DELETE ON donors BEGIN
+                        INSERT INTO donors_fts (donors_fts, rowid, name) VALUES ('delete', old.donor_id, old.name);
+                    END""")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS donors_fts_update AFTER UPDATE OF name ON donors BEGIN
+                        INSERT INTO donors_fts (donors_fts, rowid, name) VALUES ('delete', old.donor_id, old.name);
+                        INSERT INTO donors_fts (rowid, name) VALUES (new.donor_id, new.name);
+                    END""")
+    conn.execute("INSERT INTO donors_fts (donors_fts) VALUES ('rebuild')")
+
+
+MIGRATIONS = [
+    create_tables,
+    add_lookup_indexes,
+    add_pending_queue,
+    add_fulfilled_with,
+    add_donor_search,
+    add_donor_profile,
+    add_stock_ledger,
+    add_stock_lots,
+    add_request_rollups,
+    add_callout_outbox,
+    trim_donor_indexes,
+    add_contact_index,
+    index_names_only,
+]
+
+LATEST_VERSION = len(MIGRATIONS)
+
+
+def get_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def apply_pragmas(conn, pragmas=None):
+    for name, value in (PRAGMAS if pragmas is None else pragmas).items():
+        conn.execute(f"PRAGMA {name} = {value}")
+
+
+# Bring the schema up to `target` (default: latest). Runs under one write
+# lock, so several processes opening a fresh database do not race.
+# Returns the list of versions applied.
+def migrate(conn, target=None):
+    target = LATEST_VERSION if target is None else target
+    if get_version(conn) >= target:
+        return []
+
+    applied = []
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        version = get_version(conn)
+        while version < target:
+            MIGRATIONS[version](conn)
+            version += 1
+            conn.execute(f"PRAGMA user_version = {version}")
+            applied.append(version)
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+    return applied
+
+
+# Before/after timings of typical lookups on a synthetic dataset
+
+BENCHMARK_QUERIES = {
+    "pending requests": "SELECT COUNT(*) FROM blood_requests WHERE status = 'Pending'",
+    "pending O- requests": "SELECT COUNT(*) FROM blood_requests "
+                           "WHERE blood_type_required = 'O-' AND status = 'Pending'",
+    "requests on one day": "SELECT COUNT(*) FROM blood_requests "
+                           "WHERE datetime >= '2024-06-01' AND datetime < '2024-06-02'",
+    "critical requests page": "SELECT * FROM blood_requests WHERE urgency = 'Critical' "
+                              "ORDER BY request_id LIMIT 100",
+    "AB- donors page": "SELECT * FROM donors WHERE blood_type = 'AB-' ORDER BY donor_id LIMIT 100",
+    "donors by name page": "SELECT * FROM donors WHERE name > 'Donor 5' ORDER BY name, donor_id LIMIT 100",
+}
+
+
+def fill_synthetic(conn, rows, seed=42):
+    blood_types = ["A+", "A-", "B+", "B-", "O+", "O-", "AB+", "AB-"]
+    rng = random.Random(seed)
+    conn.execute("BEGIN")
+    conn.executemany("INSERT INTO donors (name, dob, blood_type, contact) VALUES (?, ?, ?, ?)",
+                     ((f"Donor {rng.randrange(rows)}", "1990-01-01", rng.choice(blood_types), "9876543210")
+                      for _ in range(rows)))
+    conn.executemany('''INSERT INTO blood_requests (requestor_name, contact_number, email_address,
+                        blood_type_required, quantity_needed, urgency, patient_name, datetime, status)
+                        VALUES ('Requestor', '9876543210', 'r@example.com', ?, ?, ?, 'Patient', ?, ?)''',
+                     ((rng.choice(blood_types), rng.randint(1, 5),
+                       rng.choices(["Normal", "Urgent", "Critical"], [70, 22, 8])[0],
+                       f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} {rng.randint(0, 23):02d}:00:00",
+                       "Pending" if rng.random() < 0.05 else "Fulfilled")
+                      for _ in range(rows)))
+    conn.execute("COMMIT")
+
+
+def time_queries(conn, repeat=5):
+    timings = {}
+    for name, sql in BENCHMARK_QUERIES.items():
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            conn.execute(sql).fetchall()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        timings[name] = best
+    return timings
+
+
+# Time the benchmark queries at schema version 1 (rollback journal, no
+# indexes), then migrate and time them again
+def benchmark(rows, path=None):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = path or os.path.join(tmp, "benchmark.db")
+        conn = sqlite3.connect(path, isolation_level=None)
+        migrate(conn, target=1)
+        fill_synthetic(conn, rows)
+        before = time_queries(conn)
+
+        apply_pragmas(conn)
+        migrate(conn)
+        after = time_queries(conn)
+        conn.close()
+
+    print(f"{'query':<26}{'before ms':>12}{'after ms':>12}{'speedup':>10}")
+    for name in BENCHMARK_QUERIES:
+        print(f"{name:<26}{before[name] * 1000:>12.2f}{after[name] * 1000:>12.2f}"
+              f"{before[name] / max(after[name], 1e-9):>9.0f}x")
+    return before, after
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Upgrade a BloodLink database or time the indexes")
+    parser.add_argument("--db", default="blood_donation_platform.db")
+    parser.add_argument("--benchmark", action="store_true", help="time lookups before and after migrating")
+    parser.add_argument("--rows", type=int, default=1000000, help="synthetic rows for --benchmark")
+    args = parser.parse_args(argv)
+
+    if args.benchmark:
+        benchmark(args.rows)
+        return
+
+    conn = sqlite3.connect(args.db, isolation_level=None)
+    apply_pragmas(conn)
+    applied = migrate(conn)
+    print(f"{args.db}: schema version {get_version(conn)}"
+          + (f" (applied {', '.join(map(str, applied))})" if applied else " (up to date)"))
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
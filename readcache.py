@@ -0,0 +1,61 @@
+# In-process cache of small, often read data: stock levels and the report
+# figures dashboards poll. Entries are kept on the connection (engine.connect
+# returns a Connection with room for them) and stamped with the connection's
+# PRAGMA data_version, which changes whenever another connection, in this
+# process or another, commits to the database, and its total_changes, which
+# counts its own writes. Checking an entry costs that one PRAGMA instead of
+# the query, and the first read after a write anywhere goes to the tables.
+# Reads inside a transaction use entries that are still valid but never store
+# one, so the values of a write that is rolled back are not kept.
+import threading
+
+import metrics
+
+_lock = threading.Lock()
+_stats = {}          # name -> [hits, misses]
+
+
+def _record(name, result):
+    with _lock:
+        counts = _stats.setdefault(name, [0, 0])
+        counts[result == "miss"] += 1
+    metrics.count(metrics.CACHE_LOOKUPS, (("cache", name), ("result", result)))
+
+
+# Value of `key` (a tuple, its first item names the data) for conn, calling
+# load() to read it when the cached copy is missing or out of date. The value
+# is shared: callers must not change it.
+def cached(conn, key, load):
+    if not hasattr(conn, "read_cache"):
+        return load()
+    stamp = (conn.execute("PRAGMA data_version").fetchone()[0], conn.total_changes)
+    entry = conn.read_cache
+    if entry is not None and entry[0] == stamp and key in entry[1]:
+        _record(key[0], "hit")
+        return entry[1][key]
+    value = load()
+    _record(key[0], "miss")
+    if not conn.in_transaction:
+        if entry is None or entry[0] != stamp:
+            entry = conn.read_cache = (stamp, {})
+        entry[1][key] = value
+    return value
+
+
+# Drop the entries of conn (they are also dropped by any write)
+def clear(conn):
+    if hasattr(conn, "read_cache"):
+        conn.read_cache = None
+
+
+# {name: {"hits", "misses", "hit_rate"}} since start (or reset_stats)
+def stats():
+    with _lock:
+        return {name: {"hits": hits, "misses": misses,
+                       "hit_rate": hits / (hits + misses) if hits + misses else 0.0}
+                for name, (hits, misses) in sorted(_stats.items())}
+
+
+def reset_stats():
+    with _lock:
+        _stats.clear()
@@ -0,0 +1,122 @@
+# Dashboard figures: requests per day and blood type, fulfilment rate and
+# time to fulfil by urgency. Every query reads the request_rollups rows of
+# the days asked for (see migrations.add_request_rollups) and never
+# blood_requests itself, so a report costs the same however long the
+# history grows.
+#
+#   python bloodlink.py report --from 2024-06-01 --to 2024-06-30
+#   python bloodlink.py report --rebuild
+from datetime import date, timedelta
+from typing import NamedTuple
+
+import engine
+import metrics
+import migrations
+import readcache
+
+# Days covered by a report when no start date is given
+REPORT_DAYS = 30
+
+
+class DayCount(NamedTuple):
+    day: str
+    blood_type: str
+    requests: int
+    units: int
+
+
+class FulfilmentRate(NamedTuple):
+    blood_type: str
+    requests: int
+    fulfilled: int
+    rate: float            # fulfilled / requests
+
+
+class FulfilTime(NamedTuple):
+    urgency: str
+    fulfilled: int         # requests with a known time to fulfil
+    average_seconds: float
+
+
+class Report(NamedTuple):
+    start: str
+    end: str
+    per_day: list          # [DayCount]
+    rates: list            # [FulfilmentRate]
+    times: list            # [FulfilTime]
+
+
+# (start, end) as YYYY-MM-DD, both included; by default the last REPORT_DAYS days
+def date_range(start=None, end=None):
+    end = end or engine.utc_today().isoformat()
+    if not start:
+        start = (date.fromisoformat(end) - timedelta(days=REPORT_DAYS - 1)).isoformat()
+    for value in (start, end):
+        if not engine.validate_date_input(value):
+            raise engine.ValidationError("Input Error", "Invalid report date format. Please use YYYY-MM-DD.")
+    if start > end:
+        raise engine.ValidationError("Input Error", "The report start date is after its end date.")
+    return start, end
+
+
+@metrics.timed("reports.requests_per_day")
+def requests_per_day(start=None, end=None, blood_type=None, conn=None) -> list:
+    start, end = date_range(start, end)
+    conn = conn or engine.get_connection()
+    sql = "SELECT day, blood_type, SUM(requests), SUM(units) FROM request_rollups WHERE day BETWEEN ? AND ?"
+    params = [start, end]
+    if blood_type:
+        sql += " AND blood_type = ?"
+        params.append(blood_type)
+    return [DayCount(*row) for row in conn.execute(sql + " GROUP BY day, blood_type ORDER BY day, blood_type",
+                                                   params)]
+
+
+@metrics.timed("reports.fulfilment_rates")
+def fulfilment_rates(start=None, end=None, conn=None) -> list:
+    start, end = date_range(start, end)
+    conn = conn or engine.get_connection()
+    rows = conn.execute('''SELECT blood_type, SUM(requests), SUM(CASE WHEN status = 'Fulfilled' THEN requests END)
+                           FROM request_rollups WHERE day BETWEEN ? AND ?
+                           GROUP BY blood_type''', (start, end))
+    rates = {blood_type: FulfilmentRate(blood_type, requests, fulfilled or 0,
+                                        (fulfilled or 0) / requests if requests else 0.0)
+             for blood_type, requests, fulfilled in rows}
+    return [rates[blood_type] for blood_type in engine.BLOOD_TYPES if blood_type in rates]
+
+
+@metrics.timed("reports.fulfil_times")
+def fulfil_times(start=None, end=None, conn=None) -> list:
+    start, end = date_range(start, end)
+    conn = conn or engine.get_connection()
+    rows = conn.execute('''SELECT urgency, SUM(fulfil_count), SUM(fulfil_seconds) FROM request_rollups
+                           WHERE day BETWEEN ? AND ? AND status = 'Fulfilled' GROUP BY urgency''', (start, end))
+    times = {urgency: FulfilTime(urgency, count, seconds / count if count else 0.0)
+             for urgency, count, seconds in rows}
+    return [times[urgency] for urgency in engine.URGENCY_LEVELS if urgency in times]
+
+
+# All three figures for one date range. Kept in the read cache until the next
+# write, so a dashboard polling the same range only reads the rollups again
+# after a request was saved or changed.
+def summary(start=None, end=None, conn=None) -> Report:
+    start, end = date_range(start, end)
+    conn = conn or engine.get_connection()
+    return readcache.cached(conn, ("report", start, end), lambda: Report(
+        start, end, requests_per_day(start, end, conn=conn), fulfilment_rates(start, end, conn=conn),
+        fulfil_times(start, end, conn=conn)))
+
+
+# Recompute the rollups from blood_requests, returns the number of rollup rows.
+# Only needed if blood_requests was changed with the triggers missing; requests
+# deleted from blood_requests are no longer counted afterwards.
+def rebuild_rollups(conn=None) -> int:
+    conn = conn or engine.get_connection()
+
+    def rebuild():
+        with engine.write_transaction(conn):
+            conn.execute("DELETE FROM request_rollups")
+            conn.execute(migrations.ROLLUP_BACKFILL)
+            return conn.execute("SELECT COUNT(*) FROM request_rollups").fetchone()[0]
+
+    return engine.retry_on_busy(rebuild)
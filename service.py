@@ -0,0 +1,376 @@
+# HTTP/JSON service mode, for bedside tablets and hospital systems that do
+# not run the Tk client.
+#
+#   python bloodlink.py serve --port 8080
+#
+#   GET  /stock            current stock per blood type
+#   POST /donors           register a donor (same fields and rules as the form)
+#   POST /requests         submit a blood request
+#   POST /stock/receive    {"blood_type": "O+", "units": 10, "expires_on": "2025-02-01"}
+#   GET  /forecast         reorder points per blood type (needs NumPy)
+#   GET  /health, /stats
+#   GET  /metrics          latency histograms and counters, Prometheus text
+#
+# The asyncio loop only parses HTTP. SQL runs on a bounded pool of
+# connections in WAL mode: N reader connections for GETs and a single writer.
+# Writes arriving close together are batched into one commit by WriteBatcher.
+# Expired units are written off by an expiry.Sweeper on its own connection,
+# with --callouts a callouts.Dispatcher calls out donors for Critical
+# requests left pending and with --backup-every a backup.Scheduler takes
+# online snapshots.
+import argparse
+import asyncio
+import inspect
+import json
+import logging
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+import allocator
+import backup
+import callouts
+import engine
+import expiry
+import metrics
+import readcache
+from engine import ValidationError
+
+MAX_BODY = 64 * 1024
+
+log = logging.getLogger("bloodlink.service")
+
+# Fields accepted in the JSON bodies, passed to the engine as keyword arguments
+DONOR_FIELDS = {"name", "gender", "dob", "blood_type", "contact", "email", "nationality",
+                "emergency_contact_number", "last_donation", "medical_history", "consent", "address",
+                "emergency_contact_name"}
+REQUEST_FIELDS = {"requestor_name", "contact_number", "email_address", "blood_type_required",
+                  "quantity_needed", "urgency", "patient_name", "patient_age", "patient_condition",
+                  "approval"}
+# JSON type of the fields that are not text, and the fields that may be null
+# for "not given"
+FIELD_TYPES = {"consent": bool, "approval": bool, "quantity_needed": int, "patient_age": int, "units": int,
+               "medical_history": list}
+NULLABLE_FIELDS = {"collected_on", "expires_on"}
+TYPE_NAMES = {str: "text", bool: "true or false", int: "a whole number", list: "a list of text"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+# Bounded set of reader connections, each used by one thread at a time
+class ReaderPool:
+    def __init__(self, path, size):
+        self.connections = queue.Queue()
+        for _ in range(size):
+            self.connections.put(engine.connect(path, check_same_thread=False))
+        self.size = size
+        self.executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="bloodlink-read")
+
+    def _run(self, fn, args, kwargs):
+        conn = self.connections.get()
+        try:
+            return fn(*args, conn=conn, **kwargs)
+        finally:
+            self.connections.put(conn)
+
+    async def run(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._run, fn, args, kwargs)
+
+    def close(self):
+        self.executor.shutdown()
+        while not self.connections.empty():
+            self.connections.get().close()
+
+
+# The single writer connection. Writes queue up while a commit is running and
+# the next commit takes up to max_batch of them (waiting at most max_delay for
+# more to arrive); engine.run_grouped gives each its own savepoint.
+class WriteBatcher:
+    def __init__(self, path, max_batch=64, max_delay=0.002):
+        self.conn = engine.connect(path, check_same_thread=False)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bloodlink-write")
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.pending = asyncio.Queue()
+        self.task = None
+        self.commits = 0
+        self.writes = 0
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def submit(self, fn, *args, **kwargs):
+        future = asyncio.get_running_loop().create_future()
+        await self.pending.put((fn, args, kwargs, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.pending.get()]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0 and self.pending.empty():
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.pending.get(), max(timeout, 0)))
+                except asyncio.TimeoutError:
+                    break
+
+            calls = [(fn, args, kwargs) for fn, args, kwargs, _ in batch]
+            outcomes = await loop.run_in_executor(self.executor, engine.run_grouped, self.conn, calls)
+            self.commits += 1
+            self.writes += len(batch)
+            for (_, _, _, future), (result, error) in zip(batch, outcomes):
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+
+    async def close(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.executor.shutdown()
+        self.conn.close()
+
+
+class BloodLinkService:
+    def __init__(self, path=None, readers=4, max_batch=64, max_delay=0.002, callout_transport=None,
+                 backup_interval=None):
+        self.path = path or engine.DB_PATH
+        self.readers_size = readers
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.readers = None
+        self.writer = None
+        self.sweeper = None
+        self.callout_transport = callout_transport
+        self.dispatcher = None
+        self.backup_interval = backup_interval
+        self.backups = None
+        self.server = None
+        self.requests_served = 0
+        self.started = time.time()
+
+    async def start(self, host="127.0.0.1", port=8080):
+        # The writer opens first so the schema is migrated before readers connect
+        self.writer = WriteBatcher(self.path, self.max_batch, self.max_delay)
+        self.writer.start()
+        self.readers = ReaderPool(self.path, self.readers_size)
+        self.sweeper = expiry.start_sweeper(self.path)
+        if self.callout_transport:
+            self.dispatcher = callouts.start_dispatcher(self.callout_transport, self.path)
+        if self.backup_interval:
+            self.backups = backup.start_scheduler(self.path, self.backup_interval)
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def close(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.sweeper:
+            self.sweeper.stop()
+        if self.dispatcher:
+            self.dispatcher.stop()
+        if self.backups:
+            self.backups.stop()
+        if self.writer:
+            await self.writer.close()
+        if self.readers:
+            self.readers.close()
+
+    # Routes
+
+    async def route(self, method, path, body):
+        if method == "GET" and path == "/stock":
+            return HTTPStatus.OK, {"stock": await self.readers.run(engine.get_stock)}
+        if method == "GET" and path == "/forecast":
+            try:
+                import forecast
+            except ImportError:
+                raise HTTPError(HTTPStatus.NOT_IMPLEMENTED, "Forecasts need NumPy on the server.")
+            reorders = await self.readers.run(forecast.forecast)
+            return HTTPStatus.OK, {"forecast": [row._asdict() for row in reorders]}
+        if method == "GET" and path == "/health":
+            return HTTPStatus.OK, {"status": "ok"}
+        if method == "GET" and path == "/stats":
+            return HTTPStatus.OK, self.stats()
+        if method == "GET" and path == "/metrics":
+            return HTTPStatus.OK, metrics.prometheus()
+        if method == "POST" and path == "/donors":
+            fields = self.fields(body, DONOR_FIELDS, engine.register_donor)
+            donor_id, age = await self.writer.submit(engine.register_donor, **fields)
+            return HTTPStatus.CREATED, {"donor_id": donor_id, "age": age}
+        if method == "POST" and path == "/requests":
+            fields = self.fields(body, REQUEST_FIELDS, engine.submit_request)
+            result = await self.writer.submit(engine.submit_request, **fields)
+            return HTTPStatus.CREATED, result._asdict()
+        if method == "POST" and path == "/stock/receive":
+            fields = self.fields(body, {"blood_type", "units", "collected_on", "expires_on"})
+            allocation = await self.writer.submit(allocator.receive_stock, fields.get("blood_type"),
+                                                  fields.get("units"), collected_on=fields.get("collected_on"),
+                                                  expires_on=fields.get("expires_on"))
+            return HTTPStatus.OK, allocation._asdict()
+        if path in ("/stock", "/forecast", "/health", "/stats", "/metrics", "/donors", "/requests", "/stock/receive"):
+            raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED, f"{method} is not allowed on {path}")
+        raise HTTPError(HTTPStatus.NOT_FOUND, f"No such endpoint: {path}")
+
+    # The JSON object of a body, with only `allowed` keys of the FIELD_TYPES
+    # type and every parameter of fn (the engine function it is passed to)
+    # that has no default
+    def fields(self, body, allowed, fn=None):
+        try:
+            data = json.loads(body or b"{}")
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Body is not valid JSON.")
+        if not isinstance(data, dict):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Body must be a JSON object.")
+        unknown = set(data) - allowed
+        if unknown:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, f"Unknown fields: {', '.join(sorted(unknown))}")
+        if fn is not None:
+            missing = [name for name, parameter in inspect.signature(fn).parameters.items()
+                       if name in allowed and parameter.default is parameter.empty and name not in data]
+            if missing:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, f"Missing fields: {', '.join(missing)}")
+        for name, value in data.items():
+            expected = FIELD_TYPES.get(name, str)
+            if value is None and name in NULLABLE_FIELDS:
+                continue
+            # bool is a subclass of int, and 1.7 units must not become 1
+            if (not isinstance(value, expected) or (expected is int and isinstance(value, bool))
+                    or (expected is list and not all(isinstance(item, str) for item in value))):
+                raise ValidationError("Input Error", f"{name} must be {TYPE_NAMES[expected]}.")
+        return data
+
+    def stats(self):
+        writer = self.writer
+        return {
+            "uptime_seconds": round(time.time() - self.started, 1),
+            "requests_served": self.requests_served,
+            "readers": self.readers_size,
+            "write_queue": writer.pending.qsize(),
+            "commits": writer.commits,
+            "writes": writer.writes,
+            "writes_per_commit": writer.writes / writer.commits if writer.commits else 0.0,
+            "callouts": self.dispatcher.stats() if self.dispatcher else None,
+            "read_cache": readcache.stats(),
+            "backups": self.backups.stats() if self.backups else None,
+        }
+
+    # HTTP/1.1 with keep-alive, just enough for JSON clients
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request = await self.read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                status, payload = await self.respond(method, path, body)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                self.write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except HTTPError as error:
+            self.write_response(writer, error.status, {"error": error.message}, False)
+        finally:
+            writer.close()
+
+    async def read_request(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        try:
+            method, target, _ = line.decode("latin-1").split()
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Malformed request line.")
+        headers = {}
+        while True:
+            header = await reader.readline()
+            if header in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = header.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = headers.get("content-length") or "0"
+        if not length.isdigit():
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Invalid Content-Length.")
+        length = int(length)
+        if length > MAX_BODY:
+            raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Request body too large.")
+        body = await reader.readexactly(length) if length else b""
+        return method.upper(), target.split("?", 1)[0], headers, body
+
+    async def respond(self, method, path, body):
+        self.requests_served += 1
+        try:
+            return await self.route(method, path, body)
+        except HTTPError as error:
+            return error.status, {"error": error.message}
+        except ValidationError as error:
+            return HTTPStatus.BAD_REQUEST, {"error": error.title, "message": error.message}
+        except Exception:
+            # The details stay in the server log
+            log.exception("%s %s failed", method, path)
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "Database Error",
+                                                      "message": "The request could not be completed."}
+
+    # payload is sent as JSON, or as plain text when it is a string
+    def write_response(self, writer, status, payload, keep_alive):
+        if isinstance(payload, str):
+            body, content_type = payload.encode(), "text/plain; version=0.0.4"
+        else:
+            body, content_type = json.dumps(payload).encode(), "application/json"
+        writer.write(f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                     f"Content-Type: {content_type}\r\n"
+                     f"Content-Length: {len(body)}\r\n"
+                     f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + body)
+
+
+async def serve(path=None, host="127.0.0.1", port=8080, readers=4, callouts_path=None, backup_interval=None):
+    service = BloodLinkService(path, readers,
+                               callout_transport=callouts.FileTransport(callouts_path) if callouts_path else None,
+                               backup_interval=backup_interval)
+    address = await service.start(host, port)
+    print(f"BloodLink service on http://{address[0]}:{address[1]} ({readers} readers, 1 writer)")
+    try:
+        await service.server.serve_forever()
+    finally:
+        await service.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="BloodLink HTTP/JSON service")
+    parser.add_argument("--db", default=engine.DB_PATH)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--callouts", help="call out donors for Critical requests to this JSONL file")
+    parser.add_argument("--backup-every", type=float, help="snapshot the database every this many minutes")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.db, args.host, args.port, args.readers, args.callouts, args.backup_every))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
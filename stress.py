@@ -0,0 +1,105 @@
+# Multi-process stress run for concurrent blood request submission.
+# Several processes submit requests against the same SQLite file; afterwards
+# the run checks that no stock went negative and that the stock taken matches
+# the quantities of the Fulfilled requests exactly.
+#
+#   python stress.py --processes 1,2,4,8 --requests 500
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+import allocator
+import engine
+
+INITIAL_STOCK = 1000
+
+
+def seed_database(path, initial_stock=INITIAL_STOCK):
+    conn = engine.connect(path)
+    with engine.write_transaction(conn):
+        conn.execute("DELETE FROM blood_requests")
+        allocator.set_stock_levels({blood_type: initial_stock for blood_type in engine.BLOOD_TYPES},
+                                   note="stress run", conn=conn)
+    conn.close()
+
+
+# One worker process: submit `count` random requests on its own connection
+def submit_requests(args):
+    path, count, seed = args
+    rng = random.Random(seed)
+    conn = engine.connect(path)
+    for _ in range(count):
+        engine.submit_request(
+            requestor_name="Stress Test",
+            contact_number="9876543210",
+            email_address="stress@example.com",
+            blood_type_required=rng.choice(engine.BLOOD_TYPES),
+            quantity_needed=rng.randint(1, 5),
+            urgency=rng.choice(engine.URGENCY_LEVELS),
+            patient_name=f"Patient {seed}",
+            patient_age=40,
+            patient_condition="Stress",
+            approval=True,
+            conn=conn,
+        )
+    conn.close()
+    return count
+
+
+# Verify the inventory invariants after a run, returns the lowest stock seen
+def check_stock(path, initial_stock=INITIAL_STOCK):
+    conn = engine.connect(path)
+    stock = engine.get_stock(conn)
+    taken = dict(conn.execute('''SELECT COALESCE(fulfilled_with, blood_type_required), SUM(quantity_needed)
+                                 FROM blood_requests WHERE status = 'Fulfilled' GROUP BY 1'''))
+    differences = engine.check_stock_ledger(conn=conn)
+    conn.close()
+    if differences:
+        raise AssertionError(f"Stock does not match the ledger: {differences}")
+    for blood_type, quantity in stock.items():
+        if quantity < 0:
+            raise AssertionError(f"Stock for {blood_type} went negative: {quantity}")
+        if initial_stock - taken.get(blood_type, 0) != quantity:
+            raise AssertionError(f"Stock for {blood_type} is {quantity} but {taken.get(blood_type, 0)} "
+                                 f"units were issued from {initial_stock}")
+    return min(stock.values())
+
+
+# Run `requests_per_process` submissions in each of `processes` processes, returns a result dict
+def run(path, processes, requests_per_process, initial_stock=INITIAL_STOCK):
+    seed_database(path, initial_stock)
+    jobs = [(path, requests_per_process, seed) for seed in range(processes)]
+    started = time.perf_counter()
+    with multiprocessing.Pool(processes) as pool:
+        submitted = sum(pool.map(submit_requests, jobs))
+    elapsed = time.perf_counter() - started
+    return {
+        "processes": processes,
+        "requests": submitted,
+        "seconds": round(elapsed, 3),
+        "requests_per_sec": round(submitted / elapsed, 1),
+        "min_stock": check_stock(path, initial_stock),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent blood request stress run")
+    parser.add_argument("--processes", default="1,2,4", help="comma separated process counts")
+    parser.add_argument("--requests", type=int, default=500, help="requests per process")
+    parser.add_argument("--stock", type=int, default=INITIAL_STOCK, help="initial units per blood type")
+    parser.add_argument("--db", help="database file (default: a temporary file)")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.db or os.path.join(tmp, "stress.db")
+        for processes in (int(p) for p in args.processes.split(",")):
+            result = run(path, processes, args.requests, args.stock)
+            print(f"{result['processes']:>3} processes  {result['requests']:>6} requests  "
+                  f"{result['requests_per_sec']:>9.1f} req/s  min stock {result['min_stock']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import os
+import random
+import tempfile
+import unittest
+
+import engine
+
+
+class FetchPageTest(unittest.TestCase):
+    PAGE = 7
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.conn = engine.connect(os.path.join(self.directory.name, "test.db"))
+        rng = random.Random(4)
+        with engine.write_transaction(self.conn):
+            self.conn.executemany("INSERT INTO donors (name, dob, blood_type, contact) VALUES (?, ?, ?, ?)",
+                                  [(rng.choice([None, None, "Asha", "Rao", "Zed"]),
+                                    rng.choice([None, "1985-05-05", "1990-01-01"]),
+                                    rng.choice([None, "A+", "O-"]),
+                                    rng.choice([None, f"98{rng.randrange(10 ** 8):08d}"])) for _ in range(120)])
+        self.columns = engine.LISTINGS["donors"][1]
+        self.rows = self.conn.execute(f"SELECT {', '.join(self.columns)} FROM donors").fetchall()
+
+    def tearDown(self):
+        self.conn.close()
+        self.directory.cleanup()
+
+    # The rows in listing order: SQLite sorts NULLs first, then by donor_id
+    def expected(self, sort, descending, blood_type=None):
+        index = self.columns.index(sort)
+        rows = [row for row in self.rows if blood_type is None or row[3] == blood_type]
+        return sorted(rows, key=lambda row: (row[index] is not None, row[index] or "", row[0]), reverse=descending)
+
+    def page(self, sort, descending, blood_type, **position):
+        return engine.fetch_page("donors", sort=sort, descending=descending,
+                                 filters={"blood_type": blood_type}, limit=self.PAGE, conn=self.conn, **position)
+
+    def test_pages_sort_column_with_nulls(self):
+        for sort in ("name", "dob", "blood_type", "contact"):
+            for descending in (False, True):
+                for blood_type in (None, "A+") if sort != "blood_type" else (None,):
+                    with self.subTest(sort=sort, descending=descending, blood_type=blood_type):
+                        expected = self.expected(sort, descending, blood_type)
+                        self.assertTrue(any(row[self.columns.index(sort)] is None for row in expected))
+
+                        forward = self.page(sort, descending, blood_type)
+                        while True:
+                            page = self.page(sort, descending, blood_type,
+                                             after=engine.page_key("donors", forward[-1], sort))
+                            if not page:
+                                break
+                            forward += page
+                        self.assertEqual(forward, expected)
+
+                        backward = [expected[-1]]
+                        while True:
+                            page = self.page(sort, descending, blood_type,
+                                             before=engine.page_key("donors", backward[0], sort))
+                            if not page:
+                                break
+                            backward = page + backward
+                        self.assertEqual(backward, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
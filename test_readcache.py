@@ -0,0 +1,55 @@
+import os
+import tempfile
+import unittest
+
+import engine
+import readcache
+
+
+class ReadCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        path = os.path.join(self.directory.name, "test.db")
+        self.conn = engine.connect(path)
+        self.other = engine.connect(path)
+        readcache.reset_stats()
+
+    def tearDown(self):
+        self.conn.close()
+        self.other.close()
+        self.directory.cleanup()
+
+    def receive(self, conn, units):
+        engine.receive_units(conn, "A+", units, collected_on=engine.utc_today().isoformat())
+
+    def stock(self):
+        return engine.get_stock(self.conn).get("A+", 0)
+
+    def lookups(self):
+        counts = readcache.stats().get("stock", {"hits": 0, "misses": 0})
+        return counts["hits"], counts["misses"]
+
+    def test_commit_on_another_connection_invalidates(self):
+        self.assertEqual(self.stock(), 0)
+        self.assertEqual(self.stock(), 0)
+        self.assertEqual(self.lookups(), (1, 1))
+
+        with engine.write_transaction(self.other):
+            self.receive(self.other, 5)
+        self.assertEqual(self.stock(), 5)
+        self.assertEqual(self.lookups(), (1, 2))
+
+    def test_rolled_back_write_invalidates(self):
+        self.assertEqual(self.stock(), 0)
+        with self.assertRaises(RuntimeError):
+            with engine.write_transaction(self.conn):
+                self.receive(self.conn, 5)
+                self.assertEqual(self.stock(), 5)
+                raise RuntimeError("roll back")
+        self.assertEqual(self.stock(), 0)
+        self.assertEqual(self.stock(), 0)
+        self.assertEqual(self.lookups(), (1, 3))
+
+
+if __name__ == "__main__":
+    unittest.main()